@@ -61,6 +61,7 @@ class ModelParams(ParamGroup):
         self._resolution = -1
         self._white_background = False
         self.data_device = "cuda"
+        self.storage_dtype = "float32" # float16 / bfloat16: inference storage of anchor attributes and MLPs
         self.eval = False
         self.lod = 0
 
@@ -88,12 +89,14 @@ class PipelineParams(ParamGroup):
         self.convert_SHs_python = False
         self.compute_cov3D_python = False
         self.debug = False
+        self.rasterizer = "cuda" # or "torch", see gaussian_renderer/torch_rasterizer.py
         super().__init__(parser, "Pipeline Parameters")
 
 class VirtualPipelineParams2():
     convert_SHs_python = False
     compute_cov3D_python = False
     debug = False
+    rasterizer = "cuda"
 
 class OptimizationParams(ParamGroup):
     def __init__(self, parser):
@@ -159,8 +162,9 @@ class OptimizationParams(ParamGroup):
 
         super().__init__(parser, "Optimization Parameters")
 
-def get_combined_args(parser : ArgumentParser):
-    cmdlne_string = sys.argv[1:]
+def get_combined_args(parser : ArgumentParser, cmdlne_string=None):
+    if cmdlne_string is None:
+        cmdlne_string = sys.argv[1:]
     print(cmdlne_string)
     cfgfile_string = "Namespace()"
     args_cmdline = parser.parse_args(cmdlne_string)
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from arguments import ModelParams, PipelineParams
+from gaussian_renderer import render_baked, render_dof
+from render_pred_jobs import DATASETS, build_jobs, load_scene, load_view_params
+from scene.baked_gaussians import BakedGaussianModel
+from scene.cameras import CameraBatch
+from utils.render_io import quantize_image
+
+
+def baked_ply_path(model_path, iteration):
+    # standard 3DGS layout next to the scaffold checkpoints, so that RenderCache.for_model works on it too
+    return os.path.join(model_path, 'baked', 'point_cloud', f'iteration_{iteration}', 'point_cloud.ply')
+
+
+def bake_centers(model_path, views, num_views):
+    """Camera centres the MLPs are evaluated from: the training cameras of the model (cameras.json),
+    or the centres of the rendered poses when the model folder has none, subsampled to `num_views`."""
+    cameras_file = os.path.join(model_path, 'cameras.json')
+    if os.path.exists(cameras_file):
+        with open(cameras_file) as f:
+            centers = np.array([c['position'] for c in json.load(f)], dtype=np.float32)
+    else:
+        centers = views.camera_center.cpu().numpy()
+    if len(centers) > num_views:
+        centers = centers[np.linspace(0, len(centers) - 1, num_views).round().astype(int)]
+    return centers
+
+
+def timed(fn, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    t_start = time.time()
+    out = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return out, time.time() - t_start
+
+
+def compare_views(views, gaussians, baked, pipe, background):
+    """Quality loss and speed-up of the baked model against the scaffold model on `views`."""
+    results = []
+    for view in views:
+        ref_pkg, ref_time = timed(lambda: render_dof(view, gaussians, pipe, background), background.device)
+        pkg, time_baked = timed(lambda: render_baked(view, baked, pipe, background), background.device)
+        ref_image = quantize_image(ref_pkg["render"]).cpu().numpy().astype(np.float64)
+        image = quantize_image(pkg["render"]).cpu().numpy().astype(np.float64)
+        mse = ((image - ref_image) ** 2).mean()
+        ref_depth, depth = ref_pkg["depth"].cpu().numpy(), pkg["depth"].cpu().numpy()
+        valid = ref_depth > 0
+        rel = np.abs(depth[valid] - ref_depth[valid]) / ref_depth[valid]
+        results.append({'image': view.image_name, 'psnr': float(10 * np.log10(255 ** 2 / max(mse, 1e-12))),
+                        'depth_rel_median': float(np.median(rel)) if rel.size else 0.0,
+                        'scaffold_time': ref_time, 'baked_time': time_baked})
+    return results
+
+
+def bake_job(job, parser, model, pipe, args):
+    dataset, scene_name = job['dataset'], job['scene']
+    width, height = DATASETS[dataset]['size']
+    scene_params, scene, gaussians, background, _ = load_scene(job, parser, model, args)
+
+    view_params = []
+    for pose_file in job['pose_files'].values():
+        view_params += load_view_params(dataset, scene_name, pose_file)
+    views = CameraBatch([p[1] for p in view_params], [p[2] for p in view_params], [p[3] for p in view_params],
+                        [p[4] for p in view_params], width, height, [p[0] for p in view_params],
+                        data_device=scene_params.data_device)
+
+    centers = bake_centers(scene_params.model_path, views, args.num_views)
+    baked, bake_time = timed(lambda: BakedGaussianModel.from_scaffold(gaussians, centers, sh_degree=args.sh_degree,
+                                                                      chunk_size=args.chunk_size), background.device)
+    ply_path = baked_ply_path(scene_params.model_path, scene.loaded_iter)
+    baked.save_ply(ply_path)
+    print(f"baked {len(baked)} gaussians from {len(centers)} views in {bake_time:.1f}s to {ply_path}")
+
+    report_ids = np.linspace(0, len(views) - 1, min(args.report_views, len(views))).round().astype(int)
+    results = compare_views([views[i] for i in report_ids], gaussians, baked, pipe, background)
+    del gaussians
+    psnr = np.array([r['psnr'] for r in results])
+    scaffold_time = np.mean([r['scaffold_time'] for r in results[1:] or results])  # the first render warms up
+    baked_time = np.mean([r['baked_time'] for r in results[1:] or results])
+    return {'dataset': dataset, 'scene': scene_name, 'ply': ply_path, 'gaussians': len(baked), 'bake_views': len(centers),
+            'sh_degree': args.sh_degree, 'bake_time': bake_time, 'psnr_mean': float(psnr.mean()), 'psnr_min': float(psnr.min()),
+            'depth_rel_median': float(np.median([r['depth_rel_median'] for r in results])),
+            'scaffold_ms': scaffold_time * 1000, 'baked_ms': baked_time * 1000, 'speedup': scaffold_time / max(baked_time, 1e-9),
+            'views': results}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Bake Scaffold-GS models into explicit 3DGS gaussians and report quality against speed")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--dataset", type=str, default='7scenes', choices=list(DATASETS))
+    parser.add_argument("--scenes", nargs='+', default=None)
+    parser.add_argument("--pose_estimators", nargs='+', default=None, help='coarse poses used for the report, and for baking when the model has no cameras.json')
+    parser.add_argument("--exp_name", type=str, default='output')
+    parser.add_argument("--num_views", type=int, default=64, help='camera centres the MLPs are evaluated from')
+    parser.add_argument("--sh_degree", type=int, default=1, help='degree of the SH colour fit, 0 bakes a fixed colour')
+    parser.add_argument("--chunk_size", type=int, default=4096, help='anchors decoded at once')
+    parser.add_argument("--report_views", type=int, default=20, help='views rendered with both models for the report')
+    parser.add_argument("--report", type=str, default=None)
+    # ACT colour transform, Cambridge only; it is applied after rendering and does not enter the comparison
+    parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
+    parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
+    args = parser.parse_args()
+
+    stats = []
+    with torch.no_grad():
+        for job in build_jobs(args.dataset, args.scenes, args.pose_estimators):
+            stats.append(bake_job(job, parser, model, pipeline.extract(args), args))
+
+    print(f"{'scene':<18} {'gaussians':>10} {'PSNR':>7} {'min':>7} {'depth':>9} {'scaffold(ms)':>12} {'baked(ms)':>10} {'speed-up':>8}")
+    for s in stats:
+        print(f"{s['scene']:<18} {s['gaussians']:>10} {s['psnr_mean']:>7.2f} {s['psnr_min']:>7.2f} {s['depth_rel_median']:>9.2e} "
+              f"{s['scaffold_ms']:>12.1f} {s['baked_ms']:>10.1f} {s['speedup']:>7.2f}x")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(stats, f, indent=2)
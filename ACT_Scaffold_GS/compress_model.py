@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from arguments import ModelParams, PipelineParams
+from gaussian_renderer import GaussianModel
+from render_pred_jobs import DATASETS, build_jobs, load_scene, load_view_params
+from scene.cameras import CameraBatch
+from scene.compressed_model import COMPRESSED_FILE, compress_model, save_compressed
+from validate_storage_dtype import render_views
+from validate_torch_rasterizer import compare
+
+
+def empty_like_model(gaussians):
+    # same architecture, no anchors or weights loaded
+    model = GaussianModel(gaussians.feat_dim, gaussians.n_offsets, gaussians.voxel_size, use_feat_bank=gaussians.use_feat_bank,
+                          appearance_dim=gaussians.appearance_dim, add_opacity_dist=gaussians.add_opacity_dist,
+                          add_cov_dist=gaussians.add_cov_dist, add_color_dist=gaussians.add_color_dist, device=gaussians.device)
+    if gaussians.appearance_dim > 0:
+        model.set_appearance(gaussians.embedding_appearance.embedding.weight.shape[0])
+    return model
+
+
+def timed_load(load, device):
+    t_start = time.time()
+    load()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.time() - t_start
+
+
+def compress_job(job, parser, model, pipe, args):
+    dataset, scene_name = job['dataset'], job['scene']
+    width, height = DATASETS[dataset]['size']
+    scene_params, scene, gaussians, background, _ = load_scene(job, parser, model, args, storage_dtype='float32')
+    iteration_dir = os.path.join(scene_params.model_path, 'point_cloud', f'iteration_{scene.loaded_iter}')
+
+    # self-contained model folder: -m <model_path>/compressed (or --exp_name <exp_name>/compressed) loads it
+    output_path = os.path.join(scene_params.model_path, 'compressed')
+    output_file = os.path.join(output_path, 'point_cloud', f'iteration_{scene.loaded_iter}', COMPRESSED_FILE)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    for name in ('cfg_args', 'cameras.json'):
+        if os.path.exists(os.path.join(scene_params.model_path, name)):
+            shutil.copy(os.path.join(scene_params.model_path, name), os.path.join(output_path, name))
+
+    t_start = time.time()
+    arrays, errors = compress_model(gaussians, voxel_size=args.voxel_size, anchor_subdivisions=args.anchor_subdivisions,
+                                    feat_codes=args.feat_codes, feat_groups=args.feat_groups, offset_codes=args.offset_codes,
+                                    kmeans_iters=args.kmeans_iters)
+    save_compressed(output_file, arrays)
+    compress_time = time.time() - t_start
+
+    decoded = empty_like_model(gaussians)
+    decode_time = timed_load(lambda: decoded.load_compressed(output_file), gaussians.device)
+    decoded.eval()
+    original = empty_like_model(gaussians)
+    load_time = timed_load(lambda: (original.load_ply_sparse_gaussian(os.path.join(iteration_dir, 'point_cloud.ply')),
+                                    original.load_mlp_checkpoints(iteration_dir)), gaussians.device)
+    del original
+
+    pose_file = next(iter(job['pose_files'].values()))
+    view_params = load_view_params(dataset, scene_name, pose_file)[::args.stride][:args.max_views]
+    views = CameraBatch([p[1] for p in view_params], [p[2] for p in view_params], [p[3] for p in view_params],
+                        [p[4] for p in view_params], width, height, [p[0] for p in view_params], data_device=scene_params.data_device)
+    reference, _ = render_views(views, gaussians, pipe, background)
+    outputs, _ = render_views(views, decoded, pipe, background)
+    per_view = [compare(image, depth, ref_image, ref_depth) for (image, depth), (ref_image, ref_depth) in zip(outputs, reference)]
+
+    original_bytes = sum(os.path.getsize(os.path.join(iteration_dir, name)) for name in os.listdir(iteration_dir)
+                         if os.path.isfile(os.path.join(iteration_dir, name)) and name != COMPRESSED_FILE)
+    return {'dataset': dataset, 'scene': scene_name, 'file': output_file, 'anchors': gaussians.get_anchor.shape[0],
+            'original_bytes': original_bytes, 'compressed_bytes': os.path.getsize(output_file),
+            'ratio': original_bytes / os.path.getsize(output_file), 'compress_time': compress_time,
+            'ply_load_time': load_time, 'decode_time': decode_time, 'errors': errors,
+            'psnr': float(np.mean([s['psnr'] for s in per_view])), 'psnr_min': float(np.min([s['psnr'] for s in per_view])),
+            'depth_rel_median': float(np.median([s['depth_rel_median'] for s in per_view]))}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compress Scaffold-GS scene models (VQ anchor features and offsets, grid anchors, lzma) "
+                                        "and compare their renders with the uncompressed models")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--dataset", type=str, default='7scenes', choices=list(DATASETS))
+    parser.add_argument("--scenes", nargs='+', default=None)
+    parser.add_argument("--pose_estimators", nargs='+', default=None, help='the poses of the first estimator are rendered for the comparison')
+    parser.add_argument("--exp_name", type=str, default='output')
+    parser.add_argument("--voxel_size", type=float, default=None, help='anchor grid, default is the voxel size of the model')
+    parser.add_argument("--anchor_subdivisions", type=int, default=1, help='anchor coordinates are stored in steps of voxel_size / n')
+    parser.add_argument("--feat_codes", type=int, default=4096, help='codebook size of every anchor feature group')
+    parser.add_argument("--feat_groups", type=int, default=4, help='anchor features are split into this many sub-vectors')
+    parser.add_argument("--offset_codes", type=int, default=4096, help='codebook size of the offsets')
+    parser.add_argument("--kmeans_iters", type=int, default=10)
+    parser.add_argument("--max_views", type=int, default=20, help='views compared per scene')
+    parser.add_argument("--stride", type=int, default=1, help='take every n-th pose')
+    parser.add_argument("--report", type=str, default=None)
+    parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
+    parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
+    args = parser.parse_args()
+
+    stats = []
+    with torch.no_grad():
+        for job in build_jobs(args.dataset, args.scenes, args.pose_estimators):
+            stats.append(compress_job(job, parser, model, pipeline.extract(args), args))
+
+    print(f"{'scene':<18} {'MB':>7} {'comp.MB':>8} {'ratio':>6} {'load(s)':>8} {'decode(s)':>9} {'PSNR':>7} {'min':>7} {'depth':>9}")
+    for s in stats:
+        print(f"{s['scene']:<18} {s['original_bytes'] / 1024 ** 2:>7.1f} {s['compressed_bytes'] / 1024 ** 2:>8.2f} {s['ratio']:>6.1f} "
+              f"{s['ply_load_time']:>8.2f} {s['decode_time']:>9.2f} {s['psnr']:>7.2f} {s['psnr_min']:>7.2f} {s['depth_rel_median']:>9.2e}")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(stats, f, indent=2)
@@ -13,29 +13,36 @@ from einops import repeat
 
 import math
 #from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
-from diff_gaussian_rasterization_depth import GaussianRasterizationSettings, GaussianRasterizer
+try:
+    from diff_gaussian_rasterization_depth import GaussianRasterizationSettings, GaussianRasterizer
+except ImportError:
+    # CPU-only machines, only the torch rasterizer is available
+    from gaussian_renderer.torch_rasterizer import GaussianRasterizationSettings
+    GaussianRasterizer = None
+from gaussian_renderer import torch_rasterizer
 
 from scene.gaussian_model import GaussianModel
 
-def generate_neural_gaussians(viewpoint_camera, pc : GaussianModel, visible_mask=None, is_training=False):
-    ## view frustum filtering for acceleration    
-    if visible_mask is None:
-        visible_mask = torch.ones(pc.get_anchor.shape[0], dtype=torch.bool, device = pc.get_anchor.device)
-    
-    feat = pc._anchor_feat[visible_mask]
-    anchor = pc.get_anchor[visible_mask]
-    grid_offsets = pc._offset[visible_mask]
-    grid_scaling = pc.get_scaling[visible_mask]
 
-    ## get view properties for anchor
-    #print("anchor: ",anchor)
-    #print(viewpoint_camera.camera_center)
-    ob_view = anchor - viewpoint_camera.camera_center
-    # dist
-    ob_dist = ob_view.norm(dim=1, keepdim=True)
-    # view
-    ob_view = ob_view / ob_dist
+def get_rasterizer(raster_settings, pipe):
+    # pipe.rasterizer: "cuda" (diff_gaussian_rasterization_depth) or "torch" (gaussian_renderer/torch_rasterizer.py)
+    backend = getattr(pipe, "rasterizer", "cuda")
+    if backend == "torch":
+        return torch_rasterizer.GaussianRasterizer(raster_settings=raster_settings)
+    if backend != "cuda":
+        raise ValueError(f"Unknown rasterizer {backend}, expected 'cuda' or 'torch'")
+    if GaussianRasterizer is None:
+        raise ImportError("diff_gaussian_rasterization_depth is not installed, use the torch rasterizer (--rasterizer torch)")
+    return GaussianRasterizer(raster_settings=raster_settings)
 
+def decode_anchor_attributes(pc : GaussianModel, feat, ob_view, ob_dist, camera_uid=0):
+    """
+    Run the anchor MLPs: opacity [N*k, 1], color [N*k, 3] and scale/rotation [N*k, 7] of every offset,
+    before the opacity masking. ob_view are the unit anchor - camera directions [N, 3], ob_dist the distances [N, 1].
+    The MLPs run in the storage dtype of the model, the outputs are float32.
+    """
+    dtype = getattr(pc, 'storage_dtype', torch.float32)
+    feat, ob_view, ob_dist = feat.to(dtype), ob_view.to(dtype), ob_dist.to(dtype)
     ## view-adaptive feature
     if pc.use_feat_bank:
         cat_view = torch.cat([ob_view, ob_dist], dim=1)
@@ -53,7 +60,7 @@ def generate_neural_gaussians(viewpoint_camera, pc : GaussianModel, visible_mask
     cat_local_view = torch.cat([feat, ob_view, ob_dist], dim=1) # [N, c+3+1]
     cat_local_view_wodist = torch.cat([feat, ob_view], dim=1) # [N, c+3]
     if pc.appearance_dim > 0:
-        camera_indicies = torch.ones_like(cat_local_view[:,0], dtype=torch.long, device=ob_dist.device) * viewpoint_camera.uid
+        camera_indicies = torch.ones_like(cat_local_view[:,0], dtype=torch.long, device=ob_dist.device) * camera_uid
         print(torch.ones_like(cat_local_view[:,0], dtype=torch.long, device=ob_dist.device))
         # camera_indicies = torch.ones_like(cat_local_view[:,0], dtype=torch.long, device=ob_dist.device) * 10
         appearance = pc.get_appearance(camera_indicies)
@@ -64,13 +71,7 @@ def generate_neural_gaussians(viewpoint_camera, pc : GaussianModel, visible_mask
     else:
         neural_opacity = pc.get_opacity_mlp(cat_local_view_wodist)
 
-    # opacity mask generation
     neural_opacity = neural_opacity.reshape([-1, 1])
-    mask = (neural_opacity>0.0)
-    mask = mask.view(-1)
-
-    # select opacity 
-    opacity = neural_opacity[mask]
 
     # get offset's color
     if pc.appearance_dim > 0:
@@ -83,15 +84,46 @@ def generate_neural_gaussians(viewpoint_camera, pc : GaussianModel, visible_mask
             color = pc.get_color_mlp(cat_local_view)
         else:
             color = pc.get_color_mlp(cat_local_view_wodist)
-    color = color.reshape([anchor.shape[0]*pc.n_offsets, 3])# [mask]
+    color = color.reshape([feat.shape[0]*pc.n_offsets, 3])# [mask]
 
     # get offset's cov
     if pc.add_cov_dist:
         scale_rot = pc.get_cov_mlp(cat_local_view)
     else:
         scale_rot = pc.get_cov_mlp(cat_local_view_wodist)
-    scale_rot = scale_rot.reshape([anchor.shape[0]*pc.n_offsets, 7]) # [mask]
+    scale_rot = scale_rot.reshape([feat.shape[0]*pc.n_offsets, 7]) # [mask]
+
+    return neural_opacity.float(), color.float(), scale_rot.float()
+
+
+def generate_neural_gaussians(viewpoint_camera, pc : GaussianModel, visible_mask=None, is_training=False):
+    ## view frustum filtering for acceleration    
+    if visible_mask is None:
+        visible_mask = torch.ones(pc.get_anchor.shape[0], dtype=torch.bool, device = pc.get_anchor.device)
     
+    feat = pc._anchor_feat[visible_mask]
+    anchor = pc.get_anchor[visible_mask]
+    grid_offsets = pc._offset[visible_mask].float() # positions are composed in float32
+    grid_scaling = pc.get_scaling[visible_mask]
+
+    ## get view properties for anchor
+    #print("anchor: ",anchor)
+    #print(viewpoint_camera.camera_center)
+    ob_view = anchor - viewpoint_camera.camera_center
+    # dist
+    ob_dist = ob_view.norm(dim=1, keepdim=True)
+    # view
+    ob_view = ob_view / ob_dist
+
+    neural_opacity, color, scale_rot = decode_anchor_attributes(pc, feat, ob_view, ob_dist, viewpoint_camera.uid)
+
+    # opacity mask generation
+    mask = (neural_opacity>0.0)
+    mask = mask.view(-1)
+
+    # select opacity 
+    opacity = neural_opacity[mask]
+
     # offsets
     offsets = grid_offsets.view([-1, 3]) # [mask]
     
@@ -131,7 +163,7 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     
 
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(xyz, dtype=pc.get_anchor.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(xyz, dtype=pc.get_anchor.dtype, requires_grad=True, device=pc.get_anchor.device) + 0
     if retain_grad:
         try:
             screenspace_points.retain_grad()
@@ -158,7 +190,7 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         debug=pipe.debug
     )
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
+    rasterizer = get_rasterizer(raster_settings, pipe)
     
     # Rasterize visible Gaussians to image, obtain their radii (on screen). 
     rendered_image, radii = rasterizer(
@@ -169,7 +201,7 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         opacities = opacity,
         scales = scaling,
         rotations = rot,
-        cov3D_precomp = None)
+        cov3D_precomp = None)[:2]
     
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
     if is_training:
@@ -200,7 +232,7 @@ def render_dof(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tens
     xyz, color, opacity, scaling, rot = gng_result
 
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(xyz, dtype=pc.get_anchor.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(xyz, dtype=pc.get_anchor.dtype, requires_grad=True, device=pc.get_anchor.device) + 0
     if retain_grad:
         try:
             screenspace_points.retain_grad()
@@ -242,7 +274,7 @@ def render_dof(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tens
         cov3D_precomp = None)
     '''
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)    
+    rasterizer = get_rasterizer(raster_settings, pipe)
 
     rendered_image, radii, depth_map, weight_map = rasterizer(
     means3D = xyz, 
@@ -256,12 +288,94 @@ def render_dof(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tens
     )
     
     
-    return {"render": rendered_image,
+    render_pkg = {"render": rendered_image,
             "depth": depth_map,
         "viewspace_points": screenspace_points,
         "visibility_filter" : radii > 0,
         "radii": radii,
         }
+    if isinstance(rasterizer, torch_rasterizer.GaussianRasterizer):
+        # projected and sorted gaussians, render_depth_at can reuse them
+        render_pkg["raster_state"] = rasterizer.state
+    return render_pkg
+
+
+def render_baked(viewpoint_camera, pc, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0):
+    """
+    Render a BakedGaussianModel (scene/baked_gaussians.py): explicit gaussians with SH colours, no MLP.
+    Same outputs as render_dof.
+    """
+    screenspace_points = torch.zeros_like(pc.get_xyz, requires_grad=True, device=pc.get_xyz.device) + 0
+
+    raster_settings = GaussianRasterizationSettings(
+        image_height=int(viewpoint_camera.image_height),
+        image_width=int(viewpoint_camera.image_width),
+        tanfovx=math.tan(viewpoint_camera.FoVx * 0.5),
+        tanfovy=math.tan(viewpoint_camera.FoVy * 0.5),
+        bg=bg_color,
+        scale_modifier=scaling_modifier,
+        viewmatrix=viewpoint_camera.world_view_transform,
+        projmatrix=viewpoint_camera.full_proj_transform,
+        sh_degree=pc.active_sh_degree,
+        campos=viewpoint_camera.camera_center,
+        prefiltered=False,
+        debug=pipe.debug
+    )
+
+    rasterizer = get_rasterizer(raster_settings, pipe)
+    num_coeffs = (pc.active_sh_degree + 1) ** 2
+    rendered_image, radii, depth_map, weight_map = rasterizer(
+        means3D = pc.get_xyz,
+        means2D = screenspace_points,
+        shs = pc.get_features[:, :num_coeffs].contiguous(),
+        colors_precomp = None,
+        opacities = pc.get_opacity,
+        scales = pc.get_scaling,
+        rotations = pc.get_rotation,
+        cov3D_precomp = None)
+
+    render_pkg = {"render": rendered_image,
+            "depth": depth_map,
+        "viewspace_points": screenspace_points,
+        "visibility_filter" : radii > 0,
+        "radii": radii,
+        }
+    if isinstance(rasterizer, torch_rasterizer.GaussianRasterizer):
+        render_pkg["raster_state"] = rasterizer.state
+    return render_pkg
+
+
+def render_depth_at(viewpoint_camera, pc : GaussianModel, pipe, pixels, scaling_modifier = 1.0, visible_mask=None, return_weight=False, raster_state=None):
+    """
+    Depth of render_dof at a list of pixels, (N, 2) x, y coordinates, without rendering the dense maps.
+
+    Torch rasterizer only (pipe.rasterizer == "torch"), the CUDA rasterizer has no per-pixel query. The refinement
+    scripts read the dense depth maps written by render_pred_*.py and do not use it.
+    Pass the "raster_state" of a render_dof call with the torch rasterizer to reuse its gaussians,
+    otherwise they are decoded, projected and sorted here (with torch ops, on the device of the model).
+    Returns the depths (N,) and, with return_weight, the accumulated opacities (N,).
+    """
+    if getattr(pipe, "rasterizer", "cuda") != "torch":
+        raise ValueError("render_depth_at needs the torch rasterizer (--rasterizer torch), "
+                         f"the pipeline uses {getattr(pipe, 'rasterizer', 'cuda')!r}; render the dense depth with render_dof instead")
+    if raster_state is None:
+        xyz, color, opacity, scaling, rot = generate_neural_gaussians(viewpoint_camera, pc, visible_mask, is_training=False)
+        raster_settings = torch_rasterizer.GaussianRasterizationSettings(
+            image_height=int(viewpoint_camera.image_height),
+            image_width=int(viewpoint_camera.image_width),
+            tanfovx=math.tan(viewpoint_camera.FoVx * 0.5),
+            tanfovy=math.tan(viewpoint_camera.FoVy * 0.5),
+            bg=torch.zeros(3, device=xyz.device),
+            scale_modifier=scaling_modifier,
+            viewmatrix=viewpoint_camera.world_view_transform,
+            projmatrix=viewpoint_camera.full_proj_transform,
+            sh_degree=1,
+            campos=viewpoint_camera.camera_center,
+            prefiltered=False,
+            debug=pipe.debug
+        )
+        raster_state = torch_rasterizer.prepare_gaussians(xyz, None, opacity, scaling, rot, None, raster_settings)
+    return torch_rasterizer.query_depth(raster_state, pixels, return_weight)
 
 
 def prefilter_voxel(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
@@ -271,7 +385,7 @@ def prefilter_voxel(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch
     Background tensor (bg_color) must be on GPU!
     """
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_anchor, dtype=pc.get_anchor.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(pc.get_anchor, dtype=pc.get_anchor.dtype, requires_grad=True, device=pc.get_anchor.device) + 0
     try:
         screenspace_points.retain_grad()
     except:
@@ -296,7 +410,7 @@ def prefilter_voxel(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch
         debug=pipe.debug
     )
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
+    rasterizer = get_rasterizer(raster_settings, pipe)
 
     means3D = pc.get_anchor
 
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from gaussian_renderer import render_dof
+
+# bump when the output of render_dof changes, so that old entries are not reused
+CACHE_VERSION = 2
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def model_digest(iteration_dir, memo=None):
+    """Digest of a trained scene: every file of `point_cloud/iteration_N` (PLY + MLPs).
+    `memo` maps path -> {size, mtime_ns, sha256} so unchanged files are not hashed again."""
+    sha = hashlib.sha256()
+    for name in sorted(os.listdir(iteration_dir)):
+        path = os.path.join(iteration_dir, name)
+        if not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entry = None if memo is None else memo.get(os.path.abspath(path))
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_digest(path)}
+            if memo is not None:
+                memo[os.path.abspath(path)] = entry
+        sha.update(name.encode())
+        sha.update(entry['sha256'].encode())
+    return sha.hexdigest()
+
+
+def _quantize(values, step):
+    return np.round(np.asarray(values, dtype=np.float64) / step).astype(np.int64).tobytes()
+
+
+class RenderCache:
+    """Content-addressed cache of render_dof outputs (colour and depth).
+
+    Entries are keyed by the model digest, the pose (quantized to `pose_step`, so poses
+    that went through a text file round trip still hit), the FoV, the resolution, the
+    background, the rasterizer backend and the storage dtype of the model. The most recent `memory_entries` outputs stay on the device, all outputs
+    are stored in `cache_dir` until it exceeds `max_bytes`, then the least recently used
+    files are evicted.
+    """
+
+    def __init__(self, cache_dir, model_id, max_bytes=20 * 1024 ** 3, memory_entries=64, pose_step=1e-6):
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.pose_step = pose_step
+        self.memory = OrderedDict()
+        self.disk = OrderedDict()  # key -> size in bytes, least recently used first
+        self.disk_bytes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(cache_dir):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(cache_dir, name))
+                entries.append((stat.st_mtime_ns, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    @classmethod
+    def for_model(cls, cache_dir, model_path, iteration, **kwargs):
+        """Cache of the scene model trained in `model_path`, loaded at `iteration`."""
+        memo_path = os.path.join(cache_dir, 'digests.json')
+        memo = {}
+        if os.path.exists(memo_path):
+            with open(memo_path) as f:
+                memo = json.load(f)
+        model_id = model_digest(os.path.join(model_path, 'point_cloud', f'iteration_{iteration}'), memo)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(memo_path + '.tmp', 'w') as f:
+            json.dump(memo, f)
+        os.replace(memo_path + '.tmp', memo_path)
+        return cls(cache_dir, model_id, **kwargs)
+
+    def key(self, view, bg_color, scaling_modifier=1.0, pc=None, pipe=None):
+        backend = getattr(pipe, 'rasterizer', 'cuda')
+        dtype = str(getattr(pc, 'storage_dtype', torch.float32)).replace('torch.', '')
+        sha = hashlib.sha1()
+        sha.update(f'{CACHE_VERSION}:{self.model_id}:{int(view.image_width)}x{int(view.image_height)}:{backend}:{dtype}'.encode())
+        sha.update(_quantize(view.R, self.pose_step))
+        sha.update(_quantize(view.T, self.pose_step))
+        sha.update(_quantize([view.FoVx, view.FoVy, scaling_modifier], 1e-9))
+        sha.update(_quantize(bg_color.detach().cpu().numpy(), 1e-6))
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key, device='cuda'):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits_memory += 1
+            return self.memory[key]
+        if key in self.disk:
+            try:
+                with np.load(self._path(key)) as data:
+                    value = {name: torch.from_numpy(data[name]).to(device) for name in ('render', 'depth')}
+            except (OSError, ValueError, KeyError):
+                # removed or half written by another process, render again
+                self._drop(key)
+            else:
+                os.utime(self._path(key))
+                self.disk.move_to_end(key)
+                self.hits_disk += 1
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, render, depth):
+        value = {'render': render.detach(), 'depth': depth.detach()}
+        self._remember(key, value)
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, render=value['render'].cpu().numpy(), depth=value['depth'].cpu().numpy())
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        self.disk_bytes += size - self.disk.pop(key, 0)
+        self.disk[key] = size
+        while self.disk_bytes > self.max_bytes and len(self.disk) > 1:
+            self._drop(next(iter(self.disk)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        self.disk_bytes -= self.disk.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def render(self, viewpoint_camera, pc, pipe, bg_color, scaling_modifier=1.0, render_fn=render_dof):
+        """render_fn (render_dof or render_baked) with caching, returns a dict with "render" and "depth"."""
+        key = self.key(viewpoint_camera, bg_color, scaling_modifier, pc=pc, pipe=pipe)
+        value = self.get(key, device=bg_color.device)
+        if value is None:
+            render_pkg = render_fn(viewpoint_camera, pc, pipe, bg_color, scaling_modifier)
+            self.put(key, render_pkg["render"], render_pkg["depth"])
+            return render_pkg
+        return value
+
+    def stats(self):
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {'hits_memory': self.hits_memory, 'hits_disk': self.hits_disk, 'misses': self.misses,
+                'hit_rate': (self.hits_memory + self.hits_disk) / max(lookups, 1), 'evictions': self.evictions,
+                'disk_entries': len(self.disk), 'disk_bytes': self.disk_bytes}
+
+    def summary(self):
+        s = self.stats()
+        return (f"render cache: {s['hits_memory']} memory hits, {s['hits_disk']} disk hits, {s['misses']} misses "
+                f"({s['hit_rate'] * 100:.1f}% hit rate), {s['evictions']} evictions, "
+                f"{s['disk_entries']} entries / {s['disk_bytes'] / 1024 ** 3:.2f} GB on disk")
@@ -0,0 +1,414 @@
+"""
+Rasterizer backend written with vectorized torch operations, for machines without the CUDA extension.
+
+`GaussianRasterizer` has the interface of `diff_gaussian_rasterization_depth.GaussianRasterizer` and
+follows the forward pass of `submodules/diff-gaussian-rasterization/cuda_rasterizer` step by step:
+
+    preprocess  EWA splatting of the 3D covariances, near-plane culling, 3 sigma screen-space radii
+    binning     one (tile, gaussian) pair per 16x16 tile touched, sorted by tile then by view depth
+    render      front-to-back alpha compositing per tile, a chunk of gaussians at a time, with the same
+                alpha clamping (0.99), skipping (1/255) and early termination (T < 1e-4) as the kernel
+
+The outputs are the colour image (3, H, W), the radii (P,), the alpha-composited view depth (H, W)
+and the accumulated opacity (H, W). Everything is differentiable with autograd and runs on any device.
+"""
+import math
+from typing import NamedTuple
+
+import torch
+import torch.nn as nn
+
+from utils.sh_utils import eval_sh
+
+BLOCK_X = 16
+BLOCK_Y = 16
+NEAR_PLANE = 0.2
+LOW_PASS = 0.3
+MIN_ALPHA = 1.0 / 255.0
+MAX_ALPHA = 0.99
+MIN_TRANSMITTANCE = 1e-4
+
+
+class GaussianRasterizationSettings(NamedTuple):
+    image_height: int
+    image_width: int
+    tanfovx : float
+    tanfovy : float
+    bg : torch.Tensor
+    scale_modifier : float
+    viewmatrix : torch.Tensor
+    projmatrix : torch.Tensor
+    sh_degree : int
+    campos : torch.Tensor
+    prefiltered : bool
+    debug : bool
+
+
+class ProjectedGaussians(NamedTuple):
+    """Screen-space gaussians, (P, ...) tensors in the order of the inputs."""
+    means2D: torch.Tensor   # (P, 2) pixel coordinates
+    depths: torch.Tensor    # (P,) view space z
+    conics: torch.Tensor    # (P, 3) inverse 2D covariance (a, b, c)
+    radii: torch.Tensor     # (P,) int, 0 for culled gaussians
+    rect_min: torch.Tensor  # (P, 2) first tile touched
+    rect_max: torch.Tensor  # (P, 2) last tile touched + 1
+
+
+class TileBins(NamedTuple):
+    """Gaussian indices sorted by tile then depth, with the [start, start + count) range of every tile."""
+    gaussian_ids: torch.Tensor
+    tile_start: torch.Tensor
+    tile_count: torch.Tensor
+    grid: tuple
+
+
+def quaternion_to_rotation(rotations):
+    # (r, x, y, z) -> rotation matrix, like computeCov3D
+    r, x, y, z = rotations.unbind(-1)
+    R = torch.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - r * z), 2 * (x * z + r * y),
+        2 * (x * y + r * z), 1 - 2 * (x * x + z * z), 2 * (y * z - r * x),
+        2 * (x * z - r * y), 2 * (y * z + r * x), 1 - 2 * (x * x + y * y),
+    ], dim=-1)
+    return R.reshape(rotations.shape[:-1] + (3, 3))
+
+
+def build_covariance_3d(scales, rotations, scale_modifier=1.0):
+    R = quaternion_to_rotation(rotations)
+    M = R * (scale_modifier * scales)[..., None, :]
+    return M @ M.transpose(-1, -2)
+
+
+def unstrip_symmetric(cov6):
+    # 6 upper triangular values, the cov3D_precomp layout, -> (P, 3, 3)
+    a, b, c, d, e, f = cov6.unbind(-1)
+    return torch.stack([a, b, c, b, d, e, c, e, f], dim=-1).reshape(cov6.shape[:-1] + (3, 3))
+
+
+def tile_grid(settings):
+    return ((settings.image_width + BLOCK_X - 1) // BLOCK_X, (settings.image_height + BLOCK_Y - 1) // BLOCK_Y)
+
+
+def project_gaussians(means3D, settings, scales=None, rotations=None, cov3D_precomp=None):
+    """preprocessCUDA for all gaussians at once."""
+    viewmatrix = settings.viewmatrix.to(means3D)
+    projmatrix = settings.projmatrix.to(means3D)
+    W, H = settings.image_width, settings.image_height
+    grid_x, grid_y = tile_grid(settings)
+
+    # matrices are stored transposed (row vector convention)
+    p_view = means3D @ viewmatrix[:3, :3] + viewmatrix[3, :3]
+    p_hom = means3D @ projmatrix[:3] + projmatrix[3]
+    p_proj = p_hom[:, :3] / (p_hom[:, 3:] + 1e-7)
+    in_front = p_view[:, 2] > NEAR_PLANE
+
+    if cov3D_precomp is not None:
+        cov3D = unstrip_symmetric(cov3D_precomp)
+    else:
+        cov3D = build_covariance_3d(scales, rotations, settings.scale_modifier)
+
+    # EWA: local affine approximation of the perspective projection, clamped slightly outside the frustum
+    focal_x = W / (2.0 * settings.tanfovx)
+    focal_y = H / (2.0 * settings.tanfovy)
+    # culled gaussians get a harmless depth so that no inf/nan leaks into the gradients
+    tz = torch.where(in_front, p_view[:, 2], torch.ones_like(p_view[:, 2]))
+    tx = (p_view[:, 0] / tz).clamp(-1.3 * settings.tanfovx, 1.3 * settings.tanfovx) * tz
+    ty = (p_view[:, 1] / tz).clamp(-1.3 * settings.tanfovy, 1.3 * settings.tanfovy) * tz
+    zero = torch.zeros_like(tz)
+    J = torch.stack([focal_x / tz, zero, -(focal_x * tx) / (tz * tz),
+                     zero, focal_y / tz, -(focal_y * ty) / (tz * tz)], dim=-1).reshape(-1, 2, 3)
+    T = J @ viewmatrix[:3, :3].transpose(0, 1)
+    cov2D = T @ cov3D @ T.transpose(1, 2)
+    a = cov2D[:, 0, 0] + LOW_PASS
+    b = cov2D[:, 0, 1]
+    c = cov2D[:, 1, 1] + LOW_PASS
+
+    det = a * c - b * b
+    valid = in_front & (det != 0)
+    det_inv = 1.0 / torch.where(valid, det, torch.ones_like(det))
+    conics = torch.stack([c * det_inv, -b * det_inv, a * det_inv], dim=-1)
+
+    mid = 0.5 * (a + c)
+    lambda1 = mid + torch.sqrt(torch.clamp(mid * mid - det, min=0.1))
+    lambda2 = mid - torch.sqrt(torch.clamp(mid * mid - det, min=0.1))
+    radius = torch.ceil(3.0 * torch.sqrt(torch.maximum(lambda1, lambda2))).detach()
+    means2D = torch.stack([((p_proj[:, 0] + 1.0) * W - 1.0) * 0.5,
+                           ((p_proj[:, 1] + 1.0) * H - 1.0) * 0.5], dim=-1)
+
+    rect_min, rect_max = tile_rect(means2D.detach(), radius, (grid_x, grid_y))
+    valid = valid & ((rect_max - rect_min).prod(dim=-1) > 0)
+
+    radii = torch.where(valid, radius, torch.zeros_like(radius)).int()
+    return ProjectedGaussians(means2D, p_view[:, 2], conics, radii, rect_min, rect_max)
+
+
+def tile_rect(center, radius, grid):
+    # getRect, the float -> int conversions truncate like the CUDA casts
+    grid = torch.tensor(grid, device=center.device)
+    r = radius[:, None]
+    rect_min = torch.minimum(grid, ((center - r) / BLOCK_X).clamp(min=0).long())
+    rect_max = torch.minimum(grid, ((center + r + BLOCK_X - 1) / BLOCK_X).clamp(min=0).long())
+    return rect_min, rect_max
+
+
+def bin_gaussians(projected, settings, opacities=None):
+    """duplicateWithKeys + the radix sort: (tile, gaussian) pairs ordered by tile then depth.
+
+    With `opacities`, tiles where a gaussian stays under the 1/255 alpha threshold are left out:
+    alpha >= 1/255 needs a Mahalanobis distance below sqrt(2 ln(255 o)), often well inside the
+    3 sigma rectangle. Those pairs would be skipped by the blending anyway, the result is the same.
+    """
+    grid_x, grid_y = tile_grid(settings)
+    device = projected.depths.device
+    visible = projected.radii > 0
+    rect_min, rect_max = projected.rect_min, projected.rect_max
+    if opacities is not None:
+        opacities = opacities.detach().reshape(-1)
+        visible = visible & (opacities >= MIN_ALPHA)
+        # radius / 3 bounds the standard deviation, +1 pixel covers the truncation of getRect
+        cutoff = torch.sqrt(2 * torch.log(255 * opacities.clamp(min=MIN_ALPHA))) * projected.radii / 3 + 1
+        rect_min, rect_max = tile_rect(projected.means2D.detach(), torch.minimum(projected.radii.float(), cutoff), (grid_x, grid_y))
+        visible = visible & ((rect_max - rect_min).prod(dim=-1) > 0)
+    visible = torch.nonzero(visible).squeeze(1)
+    # sorting by depth first makes the stable sort by tile keep the depth order inside each tile
+    visible = visible[torch.sort(projected.depths[visible].detach(), stable=True).indices]
+    rect_min = rect_min[visible]
+    extent = rect_max[visible] - rect_min
+    counts = extent.prod(dim=-1)
+
+    num_pairs = int(counts.sum())
+    pair_gaussian = torch.repeat_interleave(torch.arange(visible.shape[0], device=device), counts)
+    first_pair = torch.cumsum(counts, 0) - counts
+    local = torch.arange(num_pairs, device=device) - first_pair[pair_gaussian]
+    width = extent[pair_gaussian, 0]
+    tile_x = rect_min[pair_gaussian, 0] + local % width
+    tile_y = rect_min[pair_gaussian, 1] + local // width
+    tile_ids = tile_y * grid_x + tile_x
+
+    tile_ids, order = torch.sort(tile_ids, stable=True)
+    gaussian_ids = visible[pair_gaussian[order]]
+    tile_count = torch.bincount(tile_ids, minlength=grid_x * grid_y)
+    tile_start = torch.cumsum(tile_count, 0) - tile_count
+    return TileBins(gaussian_ids, tile_start, tile_count, (grid_x, grid_y))
+
+
+def blend_chunk(T, alpha):
+    """Blending weights of the next gaussians (..., K) of pixels with transmittance T (...,),
+    and whether the pixels terminated within the chunk. Pixels with T = 0 do not blend anymore."""
+    T_after = T[..., None] * torch.cumprod(1 - alpha, dim=-1)
+    # the first gaussian that would bring T under the threshold terminates the pixel unblended
+    blend = T_after >= MIN_TRANSMITTANCE
+    T_before = torch.cat([T[..., None], T_after[..., :-1]], dim=-1)
+    weight = torch.where(blend, alpha * T_before, torch.zeros_like(alpha))
+    return weight, ~blend[..., -1]
+
+
+def composite_tiles(projected, bins, colors, opacities, settings, chunk_size=32, max_elements=1 << 22):
+    """renderCUDA: front-to-back blending of the sorted gaussians of every tile.
+
+    All tiles advance together through their depth sorted lists, `chunk_size` gaussians per step,
+    in groups of tiles bounded by `max_elements` pixel x gaussian evaluations; tiles whose pixels
+    are all saturated or which ran out of gaussians drop out of the loop.
+    Returns colour (C, H, W), depth (H, W) and final transmittance (H, W).
+    """
+    grid_x, grid_y = bins.grid
+    num_tiles = grid_x * grid_y
+    num_pixels = BLOCK_X * BLOCK_Y
+    num_channels = colors.shape[1]
+    device = colors.device
+    dtype = colors.dtype
+    W, H = settings.image_width, settings.image_height
+
+    # the exponent is a quadratic polynomial of the pixel position, evaluated for a whole chunk with one
+    # matmul: [1, x, y, x^2, y^2, xy] (pixels) @ coefficients (gaussians), relative to the tile centre
+    local_y, local_x = torch.meshgrid(torch.arange(BLOCK_Y, device=device, dtype=dtype) - (BLOCK_Y - 1) / 2,
+                                      torch.arange(BLOCK_X, device=device, dtype=dtype) - (BLOCK_X - 1) / 2, indexing='ij')
+    local_x, local_y = local_x.reshape(-1), local_y.reshape(-1)
+    monomials = torch.stack([torch.ones_like(local_x), local_x, local_y, local_x ** 2, local_y ** 2, local_x * local_y], dim=-1)
+    tiles = torch.arange(num_tiles, device=device)
+    tile_centers = torch.stack([(tiles % grid_x) * BLOCK_X + (BLOCK_X - 1) / 2,
+                                (tiles // grid_x) * BLOCK_Y + (BLOCK_Y - 1) / 2], dim=-1).to(dtype)
+
+    # one extra transparent gaussian pads the chunks of tiles with fewer gaussians
+    features = torch.cat([projected.means2D.to(dtype), projected.conics.to(dtype), opacities.reshape(-1, 1).to(dtype),
+                          colors, projected.depths[:, None].to(dtype), torch.ones_like(colors[:, :1])], dim=-1)
+    features = torch.cat([features, torch.zeros_like(features[:1])])
+    null_id = features.shape[0] - 1
+
+    accum = torch.zeros(num_tiles, num_pixels, num_channels + 2, device=device, dtype=dtype)  # colour, depth, weight
+    transmittance = torch.ones(num_tiles, num_pixels, device=device, dtype=dtype)
+    # pixels outside of the image never blend, as in the kernel
+    pixel_x = (tiles % grid_x)[:, None] * BLOCK_X + torch.arange(BLOCK_X, device=device).repeat(BLOCK_Y)[None]
+    pixel_y = (tiles // grid_x)[:, None] * BLOCK_Y + torch.arange(BLOCK_Y, device=device).repeat_interleave(BLOCK_X)[None]
+    done = (pixel_x >= W) | (pixel_y >= H)
+
+    tile_batch = max(1, max_elements // (num_pixels * chunk_size))
+    index = torch.arange(chunk_size, device=device)
+    offset = 0
+    while True:
+        active = torch.nonzero((bins.tile_count > offset) & ~done.all(dim=1)).squeeze(1)
+        if active.numel() == 0:
+            break
+        for group in active.split(tile_batch):
+            position = offset + index[None]
+            in_range = position < bins.tile_count[group, None]
+            pair = (bins.tile_start[group, None] + position).clamp(max=max(bins.gaussian_ids.shape[0] - 1, 0))
+            ids = torch.where(in_range, bins.gaussian_ids[pair], torch.full_like(pair, null_id))
+            xy, conic, opacity, values = features[ids].split([2, 3, 1, num_channels + 2], dim=-1)  # (G, K, .)
+
+            gx, gy = (xy - tile_centers[group, None]).unbind(-1)
+            ca, cb, cc = conic.unbind(-1)
+            log_opacity = torch.log(opacity[..., 0].clamp(min=1e-12))
+            # ln(o) is folded into the constant term: the matmul gives ln(o * exp(power)) directly
+            coefficients = torch.stack([log_opacity - 0.5 * ca * gx * gx - 0.5 * cc * gy * gy - cb * gx * gy,
+                                        ca * gx + cb * gy, cc * gy + cb * gx,
+                                        -0.5 * ca, -0.5 * cc, -cb], dim=1)  # (G, 6, K)
+            log_alpha = torch.matmul(monomials, coefficients)  # (G, 256, K)
+            # power <= 0 (up to rounding, the kernel skips those rare cases) and alpha <= 0.99
+            log_alpha = torch.minimum(log_alpha, torch.clamp(log_opacity, max=math.log(MAX_ALPHA))[:, None])
+            alpha = torch.exp(log_alpha)
+            alpha = alpha.masked_fill(alpha < MIN_ALPHA, 0)
+
+            T = torch.where(done[group], torch.zeros_like(transmittance[group]), transmittance[group])
+            weight, terminated = blend_chunk(T, alpha)
+
+            blended = torch.matmul(weight, values)
+            accum[group] = accum[group] + blended
+            transmittance[group] = torch.where(done[group], transmittance[group], T - blended[..., -1])
+            done[group] = done[group] | terminated
+        offset += chunk_size
+
+    def to_image(x):
+        x = x.reshape(grid_y, grid_x, BLOCK_Y, BLOCK_X, -1).permute(4, 0, 2, 1, 3)
+        return x.reshape(x.shape[0], grid_y * BLOCK_Y, grid_x * BLOCK_X)[:, :H, :W]
+
+    return to_image(accum[..., :num_channels]), to_image(accum[..., num_channels:num_channels + 1])[0], to_image(transmittance[..., None])[0]
+
+
+class RasterState(NamedTuple):
+    """Projected and binned gaussians of a view, shared by the colour pass and the depth queries."""
+    projected: ProjectedGaussians
+    bins: TileBins
+    opacities: torch.Tensor
+    settings: GaussianRasterizationSettings
+
+
+def prepare_gaussians(means3D, means2D, opacities, scales, rotations, cov3D_precomp, raster_settings):
+    projected = project_gaussians(means3D, raster_settings, scales, rotations, cov3D_precomp)
+    if means2D is not None:
+        # gradients of the screen-space means end up in means2D, like with the CUDA rasterizer
+        projected = projected._replace(means2D=projected.means2D + means2D[:, :2])
+    bins = bin_gaussians(projected, raster_settings, opacities)
+    return RasterState(projected, bins, opacities, raster_settings)
+
+
+def rasterize_gaussians(means3D, means2D, shs, colors_precomp, opacities, scales, rotations, cov3D_precomp,
+                        raster_settings, chunk_size=32):
+    state = prepare_gaussians(means3D, means2D, opacities, scales, rotations, cov3D_precomp, raster_settings)
+    return rasterize_state(state, means3D, shs, colors_precomp, chunk_size)
+
+
+def rasterize_state(state, means3D, shs, colors_precomp, chunk_size=32):
+    raster_settings = state.settings
+    if colors_precomp is None:
+        dirs = means3D - raster_settings.campos.to(means3D)
+        dirs = dirs / dirs.norm(dim=1, keepdim=True)
+        colors_precomp = torch.clamp_min(eval_sh(raster_settings.sh_degree, shs.transpose(1, 2), dirs) + 0.5, 0.0)
+    color, depth, transmittance = composite_tiles(state.projected, state.bins, colors_precomp, state.opacities,
+                                                  raster_settings, chunk_size)
+    bg = raster_settings.bg.to(color)
+    color = color + transmittance[None] * bg[:, None, None]
+    return color, state.projected.radii, depth, 1 - transmittance
+
+
+def query_depth(state, pixels, return_weight=False, chunk_size=64, max_elements=1 << 22):
+    """Alpha-composited depth at a list of pixels only, the values of the dense depth map at these pixels.
+
+    pixels: (N, 2) x, y pixel coordinates (integers are pixel centres, as in the depth maps), on any
+    device. Only the gaussians binned to the tile of each pixel are blended, in depth order, with the
+    same thresholds as the dense rendering. Pixels outside of the image get depth 0 and weight 0.
+    Returns depth (N,) and, with return_weight, the accumulated opacity (N,).
+    """
+    projected, bins = state.projected, state.bins
+    W, H = state.settings.image_width, state.settings.image_height
+    grid_x = bins.grid[0]
+    dtype = projected.means2D.dtype
+    device = projected.means2D.device
+    pixels = torch.as_tensor(pixels, device=device).to(dtype).reshape(-1, 2)
+    num_pixels = pixels.shape[0]
+
+    features = torch.cat([projected.means2D, projected.conics.to(dtype), state.opacities.reshape(-1, 1).to(dtype),
+                          projected.depths[:, None].to(dtype)], dim=-1)
+    features = torch.cat([features, torch.zeros_like(features[:1])])
+    null_id = features.shape[0] - 1
+
+    pixel_index = torch.round(pixels).long()
+    inside = (pixel_index[:, 0] >= 0) & (pixel_index[:, 0] < W) & (pixel_index[:, 1] >= 0) & (pixel_index[:, 1] < H)
+    tile = (pixel_index[:, 1].clamp(0, H - 1) // BLOCK_Y) * grid_x + pixel_index[:, 0].clamp(0, W - 1) // BLOCK_X
+    tile_start, tile_count = bins.tile_start[tile], bins.tile_count[tile]
+
+    depth = torch.zeros(num_pixels, device=device, dtype=dtype)
+    transmittance = torch.ones(num_pixels, device=device, dtype=dtype)
+    done = ~inside
+    index = torch.arange(chunk_size, device=device)
+    offset = 0
+    while True:
+        active = torch.nonzero((tile_count > offset) & ~done).squeeze(1)
+        if active.numel() == 0:
+            break
+        for group in active.split(max(1, max_elements // chunk_size)):
+            position = offset + index[None]
+            in_range = position < tile_count[group, None]
+            pair = (tile_start[group, None] + position).clamp(max=max(bins.gaussian_ids.shape[0] - 1, 0))
+            ids = torch.where(in_range, bins.gaussian_ids[pair], torch.full_like(pair, null_id))
+            xy, conic, opacity, gaussian_depth = features[ids].split([2, 3, 1, 1], dim=-1)  # (G, K, .)
+
+            d = xy - pixels[group, None]
+            power = -0.5 * (conic[..., 0] * d[..., 0] ** 2 + conic[..., 2] * d[..., 1] ** 2) - conic[..., 1] * d[..., 0] * d[..., 1]
+            alpha = torch.clamp(opacity[..., 0] * torch.exp(power), max=MAX_ALPHA)
+            alpha = torch.where((power > 0) | (alpha < MIN_ALPHA), torch.zeros_like(alpha), alpha)
+
+            T = torch.where(done[group], torch.zeros_like(transmittance[group]), transmittance[group])
+            weight, terminated = blend_chunk(T, alpha)
+            depth[group] = depth[group] + (weight * gaussian_depth[..., 0]).sum(dim=-1)
+            transmittance[group] = torch.where(done[group], transmittance[group], T - weight.sum(dim=-1))
+            done[group] = done[group] | terminated
+        offset += chunk_size
+
+    if return_weight:
+        return depth, torch.where(inside, 1 - transmittance, torch.zeros_like(transmittance))
+    return depth
+
+
+class GaussianRasterizer(nn.Module):
+    def __init__(self, raster_settings, chunk_size=32):
+        super().__init__()
+        self.raster_settings = raster_settings
+        self.chunk_size = chunk_size
+        # projected and binned gaussians of the last forward pass, for query_depth
+        self.state = None
+
+    def markVisible(self, positions):
+        with torch.no_grad():
+            viewmatrix = self.raster_settings.viewmatrix.to(positions)
+            p_view = positions @ viewmatrix[:3, :3] + viewmatrix[3, :3]
+        return p_view[:, 2] > NEAR_PLANE
+
+    def forward(self, means3D, means2D, opacities, shs = None, colors_precomp = None, scales = None, rotations = None, cov3D_precomp = None):
+        if (shs is None and colors_precomp is None) or (shs is not None and colors_precomp is not None):
+            raise Exception('Please provide excatly one of either SHs or precomputed colors!')
+
+        if ((scales is None or rotations is None) and cov3D_precomp is None) or ((scales is not None or rotations is not None) and cov3D_precomp is not None):
+            raise Exception('Please provide exactly one of either scale/rotation pair or precomputed 3D covariance!')
+
+        self.state = prepare_gaussians(means3D, means2D, opacities, scales, rotations, cov3D_precomp, self.raster_settings)
+        return rasterize_state(self.state, means3D, shs, colors_precomp, self.chunk_size)
+
+    def query_depth(self, pixels, return_weight=False):
+        if self.state is None:
+            raise RuntimeError("query_depth needs the gaussians of a forward pass")
+        return query_depth(self.state, pixels, return_weight)
+
+    def visible_filter(self, means3D, scales = None, rotations = None, cov3D_precomp = None):
+        with torch.no_grad():
+            return project_gaussians(means3D, self.raster_settings, scales, rotations, cov3D_precomp).radii
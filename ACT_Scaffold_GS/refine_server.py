@@ -0,0 +1,251 @@
+import base64
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+from PIL.ImageOps import exif_transpose
+
+from arguments import ModelParams, PipelineParams
+from gaussian_renderer import render_dof
+from render_pred_jobs import scene_loader
+from scene.cameras import CameraBatch
+from scene.scene_pool import ScenePool
+from utils.graphics_utils import focal2fov
+from utils.pose_utils import invert_pose, rotmat2qvec
+from utils.refine import REPROJECTION_ERROR, filter_and_scale_matches, solve_pose
+from utils.render_io import quantize_image
+
+# MASt3R lives at the repository root. The scene modules are imported first: dust3r puts the
+# croco checkout, which has its own top-level `utils` package, in front of sys.path.
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+from mast3r.model import AsymmetricMASt3R  # noqa: E402
+from mast3r.fast_nn import fast_reciprocal_NNs  # noqa: E402
+from dust3r.inference import inference  # noqa: E402
+from dust3r.utils.image import ImgNorm, _resize_pil_image  # noqa: E402
+from models.blocks import ATTENTION_BACKENDS, set_attention_backend  # noqa: E402
+
+
+def mast3r_view(image, size=512):
+    # dust3r.utils.image.load_images(size=512) for an in-memory image
+    image = _resize_pil_image(image, size)
+    W, H = image.size
+    cx, cy = W // 2, H // 2
+    halfw, halfh = ((2 * cx) // 16) * 8, ((2 * cy) // 16) * 8
+    if W == H:
+        halfh = 3 * halfw / 4
+    image = image.crop((cx - halfw, cy - halfh, cx + halfw, cy + halfh))
+    return dict(img=ImgNorm(image)[None], true_shape=np.int32([image.size[::-1]]), idx=0, instance='0')
+
+
+class MicroBatcher:
+    """
+    Runs the MASt3R forward pass of the (rendering, query) pairs submitted by concurrent requests in batches:
+    the first pair waits at most `window` seconds for others, up to `max_batch` pairs of the same size
+    go through the network together.
+    """
+
+    def __init__(self, model, device, window=0.01, max_batch=8, precision='fp32'):
+        self.model = model
+        self.device = device
+        self.precision = precision
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.pairs = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, view1, view2):
+        future = Future()
+        self.queue.put((view1, view2, future, time.time()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[0]['img'].shape, item[1]['img'].shape), []).append(item)
+            for items in groups.values():
+                self._forward(items)
+
+    def _forward(self, items):
+        t_start = time.time()
+        try:
+            output = inference([(view1, view2) for view1, view2, _, _ in items], self.model, self.device,
+                               batch_size=len(items), verbose=False, precision=self.precision)
+        except Exception as e:
+            for _, _, future, _ in items:
+                future.set_exception(e)
+            return
+        t_forward = time.time() - t_start
+        self.batches += 1
+        self.pairs += len(items)
+        for i, (view1, view2, future, t_submit) in enumerate(items):
+            future.set_result({'desc1': output['pred1']['desc'][i], 'desc2': output['pred2']['desc'][i],
+                               'shape1': view1['true_shape'][0], 'shape2': view2['true_shape'][0], 'batch_size': len(items),
+                               'queue': t_start - t_submit, 'mast3r': t_forward})
+
+
+class RefinementService:
+    """GS-CPR refinement of single queries against resident scene models, see gs_cpr_7s.py for the offline version."""
+
+    def __init__(self, pool, batcher, pipe, device):
+        self.pool = pool
+        self.batcher = batcher
+        self.pipe = pipe
+        self.device = device
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def render(self, scene, query, w2c, fx, fy):
+        width, height = query.size
+        view = CameraBatch(w2c[:3, :3].T, w2c[:3, 3], focal2fov(fx, width), focal2fov(fy, height), width, height,
+                           data_device=scene.background.device)[0]
+        render_pkg = render_dof(view, scene.gaussians, self.pipe, scene.background)
+        rendering = render_pkg["render"]
+        if scene.act is not None:
+            # Cambridge renders are matched to the exposure of the query image
+            query_tensor = transforms.ToTensor()(query).to(rendering.device)
+            rendering = scene.act(rendering, hist=scene.act.histogram(query_tensor))
+        return Image.fromarray(quantize_image(rendering).cpu().numpy()), render_pkg["depth"].cpu().numpy()
+
+    @torch.no_grad()
+    def refine(self, scene_id, image_bytes, w2c, intrinsics, reprojection_error=None):
+        t_start = time.time()
+        query = exif_transpose(Image.open(io.BytesIO(image_bytes))).convert('RGB')
+        fx, fy = float(intrinsics['fx']), float(intrinsics['fy'])
+        cx, cy = float(intrinsics.get('cx', query.size[0] / 2)), float(intrinsics.get('cy', query.size[1] / 2))
+        w2c = np.asarray(w2c, dtype=np.float64).reshape(4, 4)
+        with self.pool.use(scene_id) as scene:
+            rendering, depth_map = self.render(scene, query, w2c, fx, fy)
+        t_render = time.time()
+
+        matched = self.batcher.submit(mast3r_view(rendering), mast3r_view(query)).result()
+        t_mast3r = time.time()
+        matches_im0, matches_im1 = fast_reciprocal_NNs(matched['desc1'], matched['desc2'], subsample_or_initxy1=8,
+                                                       device=self.device, dist='dot', block_size=2**13)
+        # ignore small border around the edge, back to the query resolution undoing the resize and crop of mast3r_view
+        matches_im0, matches_im1 = filter_and_scale_matches(matches_im0, matches_im1, matched['shape1'], matched['shape2'],
+                                                            query.size[::-1])
+        t_match = time.time()
+
+        K = np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]])
+        reprojection_error = reprojection_error or REPROJECTION_ERROR.get(scene_id.split('/')[0], 1.0)
+        c2w_refine, num_inliers = solve_pose(matches_im0, matches_im1, depth_map, K, invert_pose(w2c), reprojection_error)
+        t_pnp = time.time()
+
+        w2c_refine = invert_pose(c2w_refine)
+        with self.lock:
+            self.requests += 1
+        return {'pose_w2c': w2c_refine.tolist(), 'qvec': rotmat2qvec(w2c_refine[:3, :3]).tolist(), 'tvec': w2c_refine[:3, 3].tolist(),
+                'num_matches': int(matches_im1.shape[0]), 'num_inliers': num_inliers, 'batch_size': matched['batch_size'],
+                'timings': {'render': t_render - t_start, 'queue': matched['queue'], 'mast3r': matched['mast3r'],
+                            'wait': t_mast3r - t_render, 'match': t_match - t_mast3r, 'pnp': t_pnp - t_match, 'total': t_pnp - t_start}}
+
+    def stats(self):
+        return {'requests': self.requests, 'failures': self.failures, 'batches': self.batcher.batches,
+                'mean_batch_size': self.batcher.pairs / max(self.batcher.batches, 1), 'pool': self.pool.stats()}
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        """POST /refine {scene, image (base64), pose_w2c (4x4), intrinsics {fx, fy[, cx, cy]}[, reprojection_error]}, GET /stats."""
+
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, service.stats())
+            else:
+                self._reply(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/refine':
+                self._reply(404, {'error': f'unknown path {self.path}'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                args = (request['scene'], base64.b64decode(request['image']), request['pose_w2c'], request['intrinsics'])
+            except (KeyError, TypeError, ValueError) as e:
+                self._reply(400, {'error': f'bad request: {e!r}'})
+                return
+            try:
+                self._reply(200, service.refine(*args, reprojection_error=request.get('reprojection_error')))
+            except Exception as e:
+                with service.lock:
+                    service.failures += 1
+                self._reply(500, {'error': repr(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="GS-CPR refinement server: keeps MASt3R and the scene models loaded, batches concurrent queries")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--exp_name", type=str, default='output')
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mast3r", type=str, default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", help='model name or local checkpoint')
+    parser.add_argument("--batch_window_ms", type=float, default=10, help='how long the first query of a batch waits for others')
+    parser.add_argument("--max_batch", type=int, default=8)
+    parser.add_argument("--precision", type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'], help='MASt3R encoder / decoder precision')
+    parser.add_argument("--head_precision", type=str, default=['fp32'], nargs='+', choices=['fp32', 'amp'], help='per head (one value for both)')
+    parser.add_argument("--attention", type=str, default=None, choices=ATTENTION_BACKENDS, help='MASt3R attention kernel, default is $CROCO_ATTENTION or math')
+    parser.add_argument("--device_budget_gb", type=float, default=8, help='memory of the scene models kept on the device')
+    parser.add_argument("--host_budget_gb", type=float, default=16, help='memory of the scene models parked on the host, 0 drops them')
+    parser.add_argument("--preload", nargs='*', default=[], help="scenes loaded at start, e.g. 7scenes/chess")
+    parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
+    parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if args.attention is not None:
+        set_attention_backend(args.attention)
+    pool = ScenePool(scene_loader(parser, model, args), device=args.data_device or device,
+                     device_budget=int(args.device_budget_gb * 1024 ** 3), host_budget=int(args.host_budget_gb * 1024 ** 3))
+    for scene_id in args.preload:
+        pool.get(scene_id)
+    mast3r = AsymmetricMASt3R.from_pretrained(args.mast3r).to(device).eval()
+    mast3r.head_precision = tuple(args.head_precision * 2)[:2]
+    batcher = MicroBatcher(mast3r, device, window=args.batch_window_ms / 1000, max_batch=args.max_batch, precision=args.precision)
+    service = RefinementService(pool, batcher, pipeline.extract(args), device)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"refinement server on http://{args.host}:{args.port} ({pool.summary()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(service.stats(), indent=2))
@@ -16,22 +16,11 @@ import numpy as np
 import time
 import root_file_io as fio
 
-from scene.cameras import Camera, VirtualCamera2
+from scene.cameras import Camera, VirtualCamera2, CameraBatch
+from utils.pose_utils import load_pose_file, qvec2rotmat
+from utils.render_io import AsyncRenderWriter, make_sinks
 import matplotlib.pyplot as plt
 
-def qvec2rotmat(qvec):
-    return np.array([
-        [1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
-         2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-         2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2]],
-        [2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-         1 - 2 * qvec[1]**2 - 2 * qvec[3]**2,
-         2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1]],
-        [2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-         2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-         1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
-
-
 def PILtoTorch(pil_image, resolution):
     resized_image_PIL = pil_image.resize(resolution)
     resized_image = torch.from_numpy(np.array(resized_image_PIL)) / 255.0
@@ -80,29 +69,17 @@ def render_set_virtual2(source_path, model_path, name, views, gaussians_na, pipe
     render_path = fio.createPath(fio.sep, [session_dir, 'render_single_view'])
     makedirs(render_path, exist_ok=True)
 
+    # PNG encoding and np.save run on writer threads while the next view renders
+    writer = AsyncRenderWriter(make_sinks(render_path, args.depth_format), num_workers=args.writer_threads)
     for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
         gt_image_name = view.image_name
 
-        rendering = render_dof(view, gaussians_na, pipeline, background)["render"]
-        depth = render_dof(view, gaussians_na, pipeline, background)["depth"]
-        save_path = fio.createPath(fio.sep, [render_path], gt_image_name)
-        (savedir, savename, saveext) = fio.get_filename_components(save_path)
-        fio.ensure_dir(savedir)
+        render_pkg = render_dof(view, gaussians_na, pipeline, background)
+        rendering, depth = render_pkg["render"], render_pkg["depth"]
         print(os.path.join(render_path, gt_image_name))
         print("render path: ",render_path)
-        torchvision.utils.save_image(rendering, os.path.join(render_path, gt_image_name))
-        depth_array = depth.cpu().numpy()
-        '''
-        depth_min = depth_array.min()
-        depth_max = depth_array.max()
-        depth_normalized = (depth_array - depth_min) / (depth_max - depth_min)
-
-        # 转换为 8 位图像
-        depth_image = (depth_normalized * 255).astype(np.uint8)
-        plt.imshow(depth_image, cmap='viridis')
-        plt.savefig(os.path.join(render_path, gt_image_name.replace('.png','_depth.png')))
-        '''
-        np.save(os.path.join(render_path, gt_image_name.replace('.jpg','.npy')), depth_array)
+        writer.submit(gt_image_name, rendering, depth)
+    writer.close()
         
 
 
@@ -128,20 +105,13 @@ def render_sets_virtual2(dataset : ModelParams, iteration : int, pipeline : Pipe
         focal_length_x = camera_intrin_params[2]
         render_scene = args.render_scene
         render_pose_path = f"../coarse_poses/{args.pose_estimator}/12Scenes_pgt/poses_pgt_12scenes_{render_scene}_.txt"
-        with open(render_pose_path, 'r') as file:
-            lines = file.readlines()
-        views = []
-        for line in lines:
-            image_name = line.split()[0]
-            qvec =  [float(value) for value in line.split()[1:5]]
-            tvec = [float(value) for value in line.split()[5:8]]
-            R = np.transpose(qvec2rotmat(qvec))
-            T = np.array(tvec)
-            if camera_model=="SIMPLE_PINHOLE":
-                FovY = focal2fov(focal_length_x, height)
-                FovX = focal2fov(focal_length_x, width)
-            view = VirtualCamera2(colmap_id=1, uid=0, R=R, T=T, FoVx=FovX, FoVy=FovY, width=width, height=height, image_name=image_name)
-            views.append(view)
+        image_names, qvecs, tvecs = load_pose_file(render_pose_path)
+        Rs = np.transpose(qvec2rotmat(qvecs), (0, 2, 1))
+
+        if camera_model=="SIMPLE_PINHOLE":
+            FovY = focal2fov(focal_length_x, height)
+            FovX = focal2fov(focal_length_x, width)
+        views = CameraBatch(Rs, tvecs, FovX, FovY, width, height, image_names)
         render_set_virtual2(dataset.source_path, dataset.model_path, f"evaluate_{args.pose_estimator}", views, gaussians, pipeline, background)
 
 
@@ -157,9 +127,13 @@ if __name__ == "__main__":
     parser.add_argument("--quiet", action="store_true")
     parser.add_argument("--render_scene", type=str)
     parser.add_argument("--pose_estimator", type=str)
+    parser.add_argument("--depth_format", type=str, default='npy', choices=['npy', 'packed'], help='one .npy per view, or a single packed depth store per render set (read by utils/refine.load_depth of the refinement scripts)')
+    parser.add_argument("--writer_threads", type=int, default=2, help='background threads encoding and saving the renders')
     args = get_combined_args(parser)
     print("args: ",args)
     print("Rendering " + args.model_path + ' for testing set ' + args.source_path)
     virtual_pipeline = VirtualPipelineParams2()
+    # the training pipeline settings of cfg_args are not used for rendering, only the backend is taken from the command line
+    virtual_pipeline.rasterizer = args.rasterizer
     print(f"----------render images for {args.pose_estimator}----------")
     render_sets_virtual2(model.extract(args), args.iteration, virtual_pipeline)
\ No newline at end of file
@@ -17,23 +17,11 @@ import numpy as np
 import root_file_io as fio
 
 import time
-from scene.cameras import Camera, VirtualCamera2
+from scene.cameras import Camera, VirtualCamera2, CameraBatch
+from utils.pose_utils import load_pose_file, qvec2rotmat
+from utils.render_io import AsyncRenderWriter, make_sinks
 import matplotlib.pyplot as plt
-from scene.nerfh_nff import create_nerf
-from dataset_loaders.utils.color import rgb_to_yuv
-
-def qvec2rotmat(qvec):
-    return np.array([
-        [1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
-         2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-         2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2]],
-        [2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-         1 - 2 * qvec[1]**2 - 2 * qvec[3]**2,
-         2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1]],
-        [2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-         2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-         1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
-
+from scene.act import ACT
 
 def PILtoTorch(pil_image, resolution):
     resized_image_PIL = pil_image.resize(resolution)
@@ -87,7 +75,9 @@ def render_set_virtual2(source_path, model_path, name, views, gaussians_na, pipe
 
     psnr_value = 0
     l1_loss_value = 1
-    render_kwargs_train, render_kwargs_test, start, grad_vars, optimizer = create_nerf(args)
+    act = ACT.from_checkpoint(args.ft_path + f"{args.render_scene}/0{args.act_itr}.tar", hist_bin=args.hist_bin).to(device)
+    # PNG encoding and np.save run on writer threads while the next view renders
+    writer = AsyncRenderWriter(make_sinks(render_path, args.depth_format), num_workers=args.writer_threads)
     for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
         gt_image_name = view.image_name.replace('_frame','/frame')
         gt_original_image_path = os.path.join(source_path, 'images', gt_image_name)
@@ -97,37 +87,18 @@ def render_set_virtual2(source_path, model_path, name, views, gaussians_na, pipe
     ])
 
     # 将图片应用转换
-        gt_image = transform(gt_image).cuda()
-        yuv = rgb_to_yuv(gt_image)
-        y_img = yuv[0] # extract y channel only
-        hist = torch.histc(y_img, bins=10, min=0., max=1.) # compute intensity histogram
-        hist = hist/(hist.sum())*100 # convert to histogram density, in terms of percentage per bin
-        hist = torch.round(hist).unsqueeze(0).cuda()
-        rendering = render_dof(view, gaussians_na, pipeline, background)["render"]
+        gt_image = transform(gt_image)
+        # the Y histogram is computed on the host, only the [1,10] histogram is sent to the GPU
+        hist = act.histogram(gt_image)
+        render_pkg = render_dof(view, gaussians_na, pipeline, background)
+        rendering, depth = render_pkg["render"], render_pkg["depth"]
+        rgb = rendering
         if args.encode_hist:
-            affine_color_transform = render_kwargs_test['network_fn'].affine_color_transform
-            rgb = affine_color_transform(args, rendering, hist, 1)
-        depth = render_dof(view, gaussians_na, pipeline, background)["depth"]
+            rgb = act(rendering, hist=hist)
         
 
-        save_path = fio.createPath(fio.sep, [render_path], gt_image_name)
-        (savedir, savename, saveext) = fio.get_filename_components(save_path)
-        fio.ensure_dir(savedir)
-        torchvision.utils.save_image(rgb.reshape(3,1080,1920), os.path.join(render_path, gt_image_name))
-        #torchvision.utils.save_image(rgb.reshape(3,480,854), os.path.join(render_path, gt_image_name))
-        depth_array = depth.cpu().numpy()
-        '''
-        depth_min = depth_array.min()
-        depth_max = depth_array.max()
-        depth_normalized = (depth_array - depth_min) / (depth_max - depth_min)
-        #depth_normalized_inv = 1.0 - depth_normalized
-        
-        depth_image = (depth_normalized * 255).astype(np.uint8)
-        plt.imshow(depth_image, cmap='plasma_r')
-        plt.axis('off')
-        plt.savefig(os.path.join(render_path, gt_image_name.replace('.png','_depth.png')), bbox_inches='tight', pad_inches=0)
-        '''
-        np.save(os.path.join(render_path, gt_image_name.replace('.png','.npy')), depth_array)
+        writer.submit(gt_image_name, rgb.reshape(3,1080,1920), depth)
+    writer.close()
         
 
 
@@ -152,22 +123,16 @@ def render_sets_virtual2(dataset : ModelParams, iteration : int, pipeline : Pipe
         height = camera_intrin_params[1]
         focal_length_path = f'../datasets/Cambridge_{args.render_scene}/test/calibration/'
         render_pose_path = f"../coarse_poses/{args.pose_estimator}/Cambridge/poses_Cambridge_{args.render_scene}_.txt"
-        with open(render_pose_path, 'r') as file:
-            lines = file.readlines()
-
-        views = []
-        for line in lines:
-            image_name = line.split()[0]
-            qvec =  [float(value) for value in line.split()[1:5]]
-            tvec = [float(value) for value in line.split()[5:8]]
-            R = np.transpose(qvec2rotmat(qvec))
-            T = np.array(tvec)
+        image_names, qvecs, tvecs = load_pose_file(render_pose_path)
+        Rs = np.transpose(qvec2rotmat(qvecs), (0, 2, 1))
+
+        FovXs, FovYs = [], []
+        for image_name in image_names:
             focal_length = np.loadtxt(focal_length_path + image_name.replace('.png','.txt').replace('/frame','_frame'))
             if camera_model=="SIMPLE_PINHOLE":
-                FovY = focal2fov(focal_length * 2.25, height) #*1 if render image in ace preprocess size
-                FovX = focal2fov(focal_length * 2.25, width)  #*1 if render image in ace preprocess size
-            view = VirtualCamera2(colmap_id=1, uid=0, R=R, T=T, FoVx=FovX, FoVy=FovY, width=width, height=height, image_name=image_name)
-            views.append(view)
+                FovYs.append(focal2fov(focal_length * 2.25, height)) #*1 if render image in ace preprocess size
+                FovXs.append(focal2fov(focal_length * 2.25, width))  #*1 if render image in ace preprocess size
+        views = CameraBatch(Rs, tvecs, FovXs, FovYs, width, height, image_names)
         render_set_virtual2(dataset.source_path, dataset.model_path, f"evaluate_{args.pose_estimator}", views, gaussians, pipeline, background)
 
 
@@ -183,43 +148,12 @@ if __name__ == "__main__":
     parser.add_argument("--quiet", action="store_true")
     parser.add_argument("--render_scene", type=str)
     parser.add_argument("--pose_estimator", type=str)
-    parser.add_argument("--multires_views", type=int, default=4, help='log2 of max freq for positional encoding (2D direction)')
-    parser.add_argument("--multires", type=int, default=10, help='log2 of max freq for positional encoding (3D location)')
-    parser.add_argument("--i_embed", type=int, default=0, help='set 0 for default positional encoding, -1 for none')
-    parser.add_argument("--reduce_embedding", type=int, default=-1, help='fourier embedding mode: -1: paper default, \
-                                                                        0: reduce by half, 1: remove embedding, 2: DNeRF embedding')
-    parser.add_argument("--use_viewdirs", action='store_true', default=True, help='use full 5D input instead of 3D')
-    parser.add_argument("--netdepth", type=int, default=8, help='layers in network')
-    parser.add_argument("--netwidth", type=int, default=128, help='channels per layer')
-    parser.add_argument("--use_fusion_res", default=False, action='store_true', help='add residual connection to the fusion block')
-    parser.add_argument("--no_fusion_BN", default=False, action='store_true', help='no batchnorm for fusion block')
-    parser.add_argument("--multi_gpu", action='store_true', help='use multiple gpu on the server')
-    parser.add_argument("--N_importance", type=int, default=64,help='number of additional fine samples per ray')
-    parser.add_argument("--N_samples", type=int, default=64, help='number of coarse samples per ray')
-    parser.add_argument("--NeRFW", action='store_true', default=True, help='new implementation for NeRFW')
-    parser.add_argument("--in_channels_a", type=int, default=50, help='appearance embedding dimension, hist_bin*N_a when embedding histogram')
-    parser.add_argument("--in_channels_t", type=int, default=20, help='transient embedding dimension, hist_bin*N_tau when embedding histogram')
-    parser.add_argument("--netchunk", type=int, default=2097152, help='number of pts sent through network in parallel, defualt is 2^21, consider reduce this if GPU OOM')
-    parser.add_argument("--no_grad_update", default=False, help='do not update nerf in training')
-    parser.add_argument("--basedir", type=str, default='./logs/', help='where to store ckpts and logs')
-    parser.add_argument("--expname", type=str, default='paper_models', help='experiment name')
+    parser.add_argument("--depth_format", type=str, default='npy', choices=['npy', 'packed'], help='one .npy per view, or a single packed depth store per render set (read by utils/refine.load_depth of the refinement scripts)')
+    parser.add_argument("--writer_threads", type=int, default=2, help='background threads encoding and saving the renders')
     parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
-    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='specific weights npy file to reload for coarse network')
-    parser.add_argument("--perturb", type=float, default=1.,help='set to 0. for no jitter, 1. for jitter')
-    parser.add_argument("--white_bkgd", action='store_true', help='set to render synthetic data on a white bkgd (always use for dvoxels)')
-    parser.add_argument("--raw_noise_std", type=float, default=0., help='std dev of noise added to regularize sigma_a output, 1e0 recommended')
-    parser.add_argument("--dataset_type", type=str, default='Cambridge', help='options: llff / blender / deepvoxels')
-    parser.add_argument("--lindisp", action='store_true', help='sampling linearly in disparity rather than depth')
-    #parser.add_argument("--datadir", type=str, default='./data/Cambridge/ShopFacade', help='input data directory')
-    parser.add_argument("--df", type=float, default=2., help='image downscale factor')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
     parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
-    parser.add_argument("--semantic", action='store_true', default=False, help='using semantic segmentation mask to remove temporal noise at training time')
-    parser.add_argument("--encode_hist", default=True, action='store_true', help='encode histogram instead of frame index')
-    parser.add_argument("--i_weights", type=int, default=10000, help='frequency of weight ckpt saving')
-    parser.add_argument("--lrate", type=float, default=5e-4, help='learning rate')
-    parser.add_argument("--ffmlp", action='store_true', default=False, help='using NeRF with tiny-cuda-nn acceleration on mlp')
-    parser.add_argument("--tcnn", action='store_true', default=False, help='using NeRF with tiny-cuda-nn acceleration, with hash encoding')
-    parser.add_argument("--no_reload", action='store_true', help='do not reload weights from saved ckpt')
+    parser.add_argument("--encode_hist", default=True, action='store_true', help='apply the histogram based colour transform')
 
     args = get_combined_args(parser)
     print("args: ",args)
@@ -227,5 +161,7 @@ if __name__ == "__main__":
     print(f"----------render images for {args.pose_estimator}----------")
 
     virtual_pipeline = VirtualPipelineParams2()
+    # the training pipeline settings of cfg_args are not used for rendering, only the backend is taken from the command line
+    virtual_pipeline.rasterizer = args.rasterizer
     
     render_sets_virtual2(model.extract(args), args.iteration, virtual_pipeline)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+from tqdm import tqdm
+
+import root_file_io as fio
+from arguments import ModelParams, PipelineParams, get_combined_args
+from gaussian_renderer import GaussianModel, render_baked, render_dof
+from gaussian_renderer.render_cache import RenderCache
+from scene import SceneAnchor
+from scene.act import ACT
+from scene.baked_gaussians import BakedGaussianModel
+from scene.cameras import CameraBatch
+from scene.scene_pool import ResidentScene
+from utils.graphics_utils import focal2fov
+from utils.pose_utils import load_pose_file, qvec2rotmat
+from utils.render_io import AsyncRenderWriter, make_sinks
+
+# per dataset: scenes, pose estimators, where the scene models and the coarse poses live, and the render size
+DATASETS = {
+    '7scenes': {
+        'scenes': ['chess', 'fire', 'heads', 'office', 'pumpkin', 'redkitchen', 'stairs'],
+        'pose_estimators': ['ace', 'marepo', 'dfnet', 'glace'],
+        'data_path': 'data/7scenes/scene_{scene}',
+        'pose_path': '../coarse_poses/{pe}/7Scenes_pgt/poses_pgt_7scenes_{scene}_.txt',
+        'size': (640, 480),
+        'focal_length': {'chess': 526.22, 'fire': 526.903, 'heads': 527.745, 'office': 525.143, 'pumpkin': 525.647,
+                         'redkitchen': 525.505, 'stairs': 525.505},
+    },
+    '12scenes': {
+        'scenes': ['apt1_kitchen', 'apt1_living', 'apt2_bed', 'apt2_kitchen', 'apt2_living', 'apt2_luke',
+                   'office1_gates362', 'office1_gates381', 'office1_lounge', 'office1_manolis', 'office2_5a', 'office2_5b'],
+        'pose_estimators': ['ace', 'marepo', 'glace'],
+        'data_path': 'data/12scenes/scene_{scene}',
+        'pose_path': '../coarse_poses/{pe}/12Scenes_pgt/poses_pgt_12scenes_{scene}_.txt',
+        'size': (1296, 968),
+        'focal_length': {'apt1_kitchen': 1167.8, 'apt1_living': 1172.29, 'apt2_bed': 1166.72, 'apt2_kitchen': 1169.57,
+                         'apt2_living': 1166.41, 'apt2_luke': 1160.96, 'office1_gates362': 1170.08,
+                         'office1_gates381': 1168.02, 'office1_lounge': 1165.19, 'office1_manolis': 1168.41,
+                         'office2_5a': 1139.32, 'office2_5b': 1161.54},
+    },
+    'cambridge': {
+        'scenes': ['KingsCollege', 'ShopFacade', 'OldHospital', 'StMarysChurch'],
+        'pose_estimators': ['dfnet', 'ace', 'glace'],
+        'data_path': 'data/cambridge/scene_{scene}',
+        'pose_path': '../coarse_poses/{pe}/Cambridge/poses_Cambridge_{scene}_.txt',
+        'size': (1920, 1080),
+        # per image focal length of the ACE preprocessing, scaled to the full resolution
+        'calibration_path': '../datasets/Cambridge_{scene}/test/calibration/',
+        'calibration_scale': 2.25,
+    },
+}
+
+
+def build_jobs(dataset, scenes=None, pose_estimators=None):
+    config = DATASETS[dataset]
+    jobs = []
+    for scene in (scenes or config['scenes']):
+        pose_files = {pe: config['pose_path'].format(pe=pe, scene=scene) for pe in (pose_estimators or config['pose_estimators'])}
+        jobs.append({'dataset': dataset, 'scene': scene, 'pose_files': pose_files})
+    return jobs
+
+
+def load_view_params(dataset, scene, pose_file):
+    # (image_name, R, T, FoVx, FoVy) of every pose, as built by render_pred_{7s,12s,cam_act}.py
+    config = DATASETS[dataset]
+    width, height = config['size']
+    image_names, qvecs, tvecs = load_pose_file(pose_file)
+    Rs = np.transpose(qvec2rotmat(qvecs), (0, 2, 1))
+    views = []
+    for image_name, R, T in zip(image_names, Rs, tvecs):
+        if 'calibration_path' in config:
+            calibration_file = config['calibration_path'].format(scene=scene) + image_name.replace('.png', '.txt').replace('/frame', '_frame')
+            focal_length = float(np.loadtxt(calibration_file)) * config['calibration_scale']
+        else:
+            focal_length = config['focal_length'][scene]
+        views.append((image_name, R, T, focal2fov(focal_length, width), focal2fov(focal_length, height)))
+    return views
+
+
+def render_path_for(source_path, model_path, pose_estimator):
+    # same output folder as render_set_virtual2
+    model_position_combo = model_path.split(fio.sep)
+    session_dir = fio.createPath(fio.sep, [source_path, f"evaluate_{pose_estimator}", '_'.join(model_position_combo[-2:])])
+    return fio.createPath(fio.sep, [session_dir, 'render_single_view'])
+
+
+def load_scene(job, parser, model, args, storage_dtype=None):
+    """Scene model of a job on `--data_device`, with its background colour and, for Cambridge, its ACT.
+    `storage_dtype` overrides `--storage_dtype`."""
+    dataset, scene_name = job['dataset'], job['scene']
+    data_path = job.get('data_path', DATASETS[dataset]['data_path'].format(scene=scene_name))
+    scene_args = get_combined_args(parser, sys.argv[1:] + ['-s', f"{data_path}/test", '-m', f"{data_path}/train/{args.exp_name}"])
+    scene_params = model.extract(scene_args)
+    gaussians = GaussianModel(scene_params.feat_dim, scene_params.n_offsets, scene_params.voxel_size, scene_params.update_depth,
+                              scene_params.update_init_factor, scene_params.update_hierachy_factor, scene_params.use_feat_bank,
+                              scene_params.appearance_dim, scene_params.ratio, scene_params.add_opacity_dist,
+                              scene_params.add_cov_dist, scene_params.add_color_dist, device=scene_params.data_device,
+                              storage_dtype=storage_dtype or getattr(scene_params, 'storage_dtype', None) or 'float32')
+    gaussians.eval()
+    scene = SceneAnchor(scene_params, gaussians, load_iteration=args.iteration, shuffle=False)
+    bg_color = [1, 1, 1] if scene_params.white_background else [0, 0, 0]
+    background = torch.tensor(bg_color, dtype=torch.float32, device=scene_params.data_device)
+    act = None
+    if dataset == 'cambridge':
+        act = ACT.from_checkpoint(args.ft_path + f"{scene_name}/0{args.act_itr}.tar", hist_bin=args.hist_bin).to(scene_params.data_device)
+    return scene_params, scene, gaussians, background, act
+
+
+def scene_loader(parser, model, args):
+    """Loader of a ScenePool: scene ids are '<dataset>/<scene>', e.g. '7scenes/chess'."""
+    def load(scene_id):
+        dataset, scene_name = scene_id.split('/', 1)
+        scene_params, _, gaussians, background, act = load_scene({'dataset': dataset, 'scene': scene_name, 'pose_files': {}},
+                                                                 parser, model, args)
+        return ResidentScene(scene_id, gaussians, background, act, scene_params)
+    return load
+
+
+def apply_act(act, rendering, source_path, image_name):
+    # Cambridge renders are matched to the exposure of the query image, returns the output name and the rendering
+    image_name = image_name.replace('_frame', '/frame')
+    gt_image = transforms.ToTensor()(Image.open(os.path.join(source_path, 'images', image_name)))
+    return image_name, act(rendering, hist=act.histogram(gt_image))
+
+
+def run_job(job, parser, model, pipeline, args):
+    """Load the scene model of one job once and render the pose sets of all its estimators."""
+    dataset, scene_name = job['dataset'], job['scene']
+    width, height = DATASETS[dataset]['size']
+
+    t_start = time.time()
+    scene_params, scene, gaussians, background, act = load_scene(job, parser, model, args)
+    model_path, render_fn = scene_params.model_path, render_dof
+    if args.baked:
+        # explicit gaussians written by bake_gaussians.py, the anchor MLPs are not run
+        model_path, render_fn = os.path.join(scene_params.model_path, 'baked'), render_baked
+        gaussians = BakedGaussianModel.load_ply(os.path.join(model_path, 'point_cloud', f'iteration_{scene.loaded_iter}', 'point_cloud.ply'),
+                                                device=scene_params.data_device)
+    cache = None
+    if args.render_cache is not None:
+        cache = RenderCache.for_model(args.render_cache, model_path, scene.loaded_iter,
+                                      max_bytes=int(args.cache_size_gb * 1024 ** 3), memory_entries=args.cache_memory_entries)
+    if background.is_cuda:
+        torch.cuda.synchronize()
+    t_load = time.time() - t_start
+
+    # group identical views of all estimators, every unique view is rendered once and written to each estimator
+    writers = {}
+    targets = {}
+    for pe, pose_file in job['pose_files'].items():
+        writers[pe] = AsyncRenderWriter(make_sinks(render_path_for(scene_params.source_path, scene_params.model_path, pe), args.depth_format),
+                                        num_workers=args.writer_threads)
+        for image_name, R, T, FovX, FovY in load_view_params(dataset, scene_name, pose_file):
+            key = (image_name, R.tobytes(), T.tobytes(), FovX, FovY)
+            if args.no_dedup:
+                key += (pe,)
+            if key not in targets:
+                targets[key] = ((image_name, R, T, FovX, FovY), [])
+            targets[key][1].append(pe)
+
+    t_start = time.time()
+    unique_views = [params for params, _ in targets.values()]
+    views = CameraBatch([p[1] for p in unique_views], [p[2] for p in unique_views], [p[3] for p in unique_views],
+                        [p[4] for p in unique_views], width, height, [p[0] for p in unique_views], data_device=scene_params.data_device)
+    for view, (_, pes) in tqdm(zip(views, targets.values()), total=len(views), desc=f"Rendering {dataset}/{scene_name}"):
+        image_name = view.image_name
+        if cache is not None:
+            render_pkg = cache.render(view, gaussians, pipeline, background, render_fn=render_fn)
+        else:
+            render_pkg = render_fn(view, gaussians, pipeline, background)
+        rendering, depth = render_pkg["render"], render_pkg["depth"]
+        if act is not None:
+            image_name, rendering = apply_act(act, rendering, scene_params.source_path, image_name)
+        for pe in pes:
+            writers[pe].submit(image_name, rendering, depth)
+    for writer in writers.values():
+        writer.close()
+    t_render = time.time() - t_start
+
+    num_views = sum(len(pes) for _, pes in targets.values())
+    if cache is not None:
+        print(cache.summary())
+    del gaussians
+    torch.cuda.empty_cache()
+    return {'dataset': dataset, 'scene': scene_name, 'pose_estimators': list(job['pose_files']),
+            'views': num_views, 'rendered': len(targets), 'load_time': t_load, 'render_time': t_render,
+            'views_per_second': num_views / max(t_render, 1e-9),
+            'cache': None if cache is None else cache.stats()}
+
+
+def print_report(stats):
+    print(f"{'dataset':<10} {'scene':<18} {'views':>6} {'rendered':>8} {'load(s)':>8} {'render(s)':>9} {'views/s':>8}")
+    for s in stats:
+        print(f"{s['dataset']:<10} {s['scene']:<18} {s['views']:>6} {s['rendered']:>8} {s['load_time']:>8.1f} {s['render_time']:>9.1f} {s['views_per_second']:>8.1f}")
+    views = sum(s['views'] for s in stats)
+    rendered = sum(s['rendered'] for s in stats)
+    load_time = sum(s['load_time'] for s in stats)
+    render_time = sum(s['render_time'] for s in stats)
+    print(f"{'total':<29} {views:>6} {rendered:>8} {load_time:>8.1f} {render_time:>9.1f} {views / max(render_time, 1e-9):>8.1f}")
+    print(f"{views - rendered} duplicated poses skipped, {views / max(load_time + render_time, 1e-9):.1f} views/s including scene loading")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Render the coarse poses of several pose estimators, loading each scene model once")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--dataset", type=str, default='7scenes', choices=list(DATASETS))
+    parser.add_argument("--scenes", nargs='+', default=None, help='default is every scene of the dataset')
+    parser.add_argument("--pose_estimators", nargs='+', default=None, help='default is every estimator evaluated on the dataset')
+    parser.add_argument("--jobs", type=str, default=None,
+                        help='json list of {"dataset", "scene", "pose_files": {estimator: path}} jobs, replaces --dataset/--scenes/--pose_estimators')
+    parser.add_argument("--exp_name", type=str, default='output', help='scene model folder inside data/<dataset>/scene_<scene>/train/')
+    parser.add_argument("--no_dedup", action='store_true', help='render poses that are identical across estimators again')
+    parser.add_argument("--depth_format", type=str, default='npy', choices=['npy', 'packed'], help='one .npy per view, or a single packed depth store per render set (read by utils/refine.load_depth of the refinement scripts)')
+    parser.add_argument("--writer_threads", type=int, default=2, help='background threads encoding and saving the renders, per estimator')
+    parser.add_argument("--render_cache", type=str, default=None, help='directory of a render cache shared by repeated runs, disabled by default')
+    parser.add_argument("--cache_size_gb", type=float, default=20, help='disk budget of the render cache, least recently used renders are evicted')
+    parser.add_argument("--cache_memory_entries", type=int, default=64, help='most recent renders kept on the GPU')
+    parser.add_argument("--report", type=str, default=None, help='write the throughput report to this json file')
+    parser.add_argument("--baked", action='store_true', help='render the explicit gaussians baked by bake_gaussians.py instead of the anchors')
+    # ACT colour transform, Cambridge only
+    parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
+    parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
+    args = parser.parse_args()
+
+    if args.jobs is not None:
+        with open(args.jobs) as f:
+            jobs = json.load(f)
+    else:
+        jobs = build_jobs(args.dataset, args.scenes, args.pose_estimators)
+
+    stats = []
+    with torch.no_grad():
+        for job in jobs:
+            print(f"----------render {job['dataset']}/{job['scene']} for {', '.join(job['pose_files'])}----------")
+            stats.append(run_job(job, parser, model, pipeline.extract(args), args))
+    print_report(stats)
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(stats, f, indent=2)
@@ -16,19 +16,7 @@ import time
 import root_file_io as fio
 
 from scene.cameras import Camera, VirtualCamera2
-
-def qvec2rotmat(qvec):
-    return np.array([
-        [1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
-         2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-         2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2]],
-        [2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-         1 - 2 * qvec[1]**2 - 2 * qvec[3]**2,
-         2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1]],
-        [2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-         2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-         1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
-
+from utils.pose_utils import qvec2rotmat
 
 def PILtoTorch(pil_image, resolution):
     resized_image_PIL = pil_image.resize(resolution)
@@ -208,5 +196,7 @@ if __name__ == "__main__":
     # safe_state(args.quiet)
     # render_sets(model.extract(args), args.iteration, pipeline.extract(args))
     virtual_pipeline = VirtualPipelineParams2()
+    # the training pipeline settings of cfg_args are not used for rendering, only the backend is taken from the command line
+    virtual_pipeline.rasterizer = args.rasterizer
     
     render_sets_virtual2(model.extract(args), args.iteration, virtual_pipeline)
\ No newline at end of file
@@ -15,6 +15,7 @@ import json
 from utils.system_utils import searchForMaxIteration
 from scene.dataset_readers import sceneLoadTypeCallbacks
 from scene.gaussian_model import GaussianModel
+from scene.compressed_model import COMPRESSED_FILE
 from arguments import ModelParams
 from utils.camera_utils import cameraList_from_camInfos, camera_to_JSON
 
@@ -99,13 +100,13 @@ class SceneAnchor:
         self.gaussians.set_appearance(len(scene_info.train_cameras))
         
         if self.loaded_iter:
-            self.gaussians.load_ply_sparse_gaussian(os.path.join(self.model_path,
-                                                           "point_cloud",
-                                                           "iteration_" + str(self.loaded_iter),
-                                                           "point_cloud.ply"))
-            self.gaussians.load_mlp_checkpoints(os.path.join(self.model_path,
-                                                           "point_cloud",
-                                                           "iteration_" + str(self.loaded_iter)))
+            iteration_dir = os.path.join(self.model_path, "point_cloud", "iteration_" + str(self.loaded_iter))
+            if not os.path.exists(os.path.join(iteration_dir, "point_cloud.ply")) and os.path.exists(os.path.join(iteration_dir, COMPRESSED_FILE)):
+                # distributed model written by compress_model.py
+                self.gaussians.load_compressed(os.path.join(iteration_dir, COMPRESSED_FILE))
+            else:
+                self.gaussians.load_ply_sparse_gaussian(os.path.join(iteration_dir, "point_cloud.ply"))
+                self.gaussians.load_mlp_checkpoints(iteration_dir)
         else:
             self.gaussians.create_from_pcd(scene_info.point_cloud, self.cameras_extent)
     
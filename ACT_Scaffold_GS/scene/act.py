@@ -0,0 +1,129 @@
+import torch
+from torch import nn
+
+
+class ACT(nn.Module):
+    """Appearance colour transform (ACT) used to match GS renderings to the exposure of a query image.
+
+    Standalone version of `NeRFH_NFF.exposure_embedding` + `NeRFH_NFF.affine_color_transform`:
+    a small MLP maps the Y-histogram of the query image to a 3x3 colour matrix and a bias,
+    which are applied to the rendering. Only the exposure embedding weights are read from the
+    ACT `.tar` checkpoint, so neither the NeRF networks nor tinycudann nor a GPU are needed.
+
+    Args:
+        hist_bin: number of histogram bins, input dimension of the MLP
+        n_neurons: width of the hidden layers
+        n_hidden_layers: number of hidden layers
+    """
+
+    # tinycudann pads the input and output of a FullyFusedMLP to multiples of 16
+    TCNN_ALIGNMENT = 16
+
+    def __init__(self, hist_bin=10, n_neurons=32, n_hidden_layers=3):
+        super().__init__()
+        self.hist_bin = hist_bin
+        self.n_neurons = n_neurons
+        self.n_hidden_layers = n_hidden_layers
+        widths = [self._padded(hist_bin)] + [n_neurons] * n_hidden_layers
+        layers = []
+        for w_in, w_out in zip(widths[:-1], widths[1:]):
+            layers += [nn.Linear(w_in, w_out, bias=False), nn.ReLU(True)]
+        layers.append(nn.Linear(n_neurons, 12, bias=False)) # 3x3 matrix + 3 bias
+        self.exposure_embedding = nn.Sequential(*layers)
+        for layer in self.exposure_embedding:
+            if isinstance(layer, nn.Linear):
+                nn.init.xavier_uniform_(layer.weight)
+
+    @classmethod
+    def _padded(cls, width):
+        return (width + cls.TCNN_ALIGNMENT - 1) // cls.TCNN_ALIGNMENT * cls.TCNN_ALIGNMENT
+
+    @classmethod
+    def from_checkpoint(cls, path, map_location='cpu', **kwargs):
+        """Load the exposure embedding from a checkpoint written by train_act.py."""
+        ckpt = torch.load(path, map_location=map_location)
+        state_dict = ckpt.get('network_fn_state_dict', ckpt)
+        prefix = 'exposure_embedding.'
+        params = {k.replace('module.', '', 1)[len(prefix):]: v for k, v in state_dict.items()
+                  if k.replace('module.', '', 1).startswith(prefix)}
+        if len(params) == 0:
+            raise KeyError(f"No exposure embedding weights found in {path}")
+        act = cls(**kwargs)
+        if 'params' in params:
+            act.load_tcnn_params(params['params'])
+        else:
+            act.exposure_embedding.load_state_dict(params)
+        act.global_step = ckpt.get('global_step', 0)
+        return act.to(map_location).eval()
+
+    def _linears(self):
+        return [layer for layer in self.exposure_embedding if isinstance(layer, nn.Linear)]
+
+    @torch.no_grad()
+    def load_tcnn_params(self, params):
+        # flat tinycudann parameter vector: row-major (out, in) weight matrices, one per layer, no biases
+        params = params.detach().float().flatten()
+        offset = 0
+        linears = self._linears()
+        for i, layer in enumerate(linears):
+            w_out, w_in = layer.weight.shape
+            if i == len(linears) - 1:
+                w_out = self._padded(w_out)
+            weight = params[offset:offset + w_out * w_in].reshape(w_out, w_in)
+            layer.weight.copy_(weight[:layer.weight.shape[0]])
+            offset += w_out * w_in
+        if offset != params.numel():
+            raise ValueError(f"Expected {offset} tinycudann parameters, got {params.numel()}")
+
+    def tcnn_params(self):
+        # inverse of load_tcnn_params, keeps checkpoints loadable by create_nerf
+        linears = self._linears()
+        last = linears[-1].weight
+        padding = last.new_zeros(self._padded(last.shape[0]) - last.shape[0], last.shape[1])
+        weights = [layer.weight for layer in linears[:-1]] + [torch.cat([last, padding])]
+        return torch.cat([w.flatten() for w in weights]).half()
+
+    def state_dict_tcnn(self):
+        return {'exposure_embedding.params': self.tcnn_params().detach()}
+
+    def histogram(self, images):
+        """
+        Inputs:
+            images: [B,3,H,W] or [3,H,W] query images in [0,1]
+        return:
+            hist: [B,hist_bin] rounded percentage of pixels per Y bin, same as torch.histc per image
+        """
+        if images.dim() == 3:
+            images = images[None]
+        y = (0.299 * images[:, 0] + 0.587 * images[:, 1] + 0.114 * images[:, 2]).flatten(1)
+        valid = (y >= 0) & (y <= 1)
+        bins = (y * self.hist_bin).long().clamp_(0, self.hist_bin - 1)
+        hist = torch.zeros(y.shape[0], self.hist_bin, dtype=y.dtype, device=y.device)
+        hist.scatter_add_(1, bins, valid.to(y.dtype))
+        return torch.round(hist / hist.sum(dim=1, keepdim=True) * 100)
+
+    def embed(self, hist):
+        """hist: [B,hist_bin] -> kernel [B,3,3], bias [B,3,1]"""
+        x = hist.long().float()
+        # tinycudann fills the padded input dimensions with ones
+        x = torch.cat([x, x.new_ones(x.shape[0], self._padded(self.hist_bin) - self.hist_bin)], dim=1)
+        a_embedded = self.exposure_embedding(x)
+        return a_embedded[:, :9].reshape(-1, 3, 3), a_embedded[:, 9:].reshape(-1, 3, 1)
+
+    def forward(self, rgb, images=None, hist=None):
+        """
+        Inputs:
+            rgb: [B,3,H,W] or [3,H,W] renderings
+            images: query images the renderings are matched to, used to compute hist
+            hist: [B,hist_bin] precomputed histograms
+        return:
+            rgb: colour transformed renderings, same shape as the input
+        """
+        if hist is None:
+            hist = self.histogram(images)
+        hist = hist.to(rgb.device)
+        kernel, bias = self.embed(hist)
+        batch_size = hist.shape[0]
+        # same flat (B,N,3) view of the rendering memory as affine_color_transform, which the ACT was trained with
+        out = torch.bmm(kernel, rgb.reshape(batch_size, -1, 3).transpose(1, 2)) + bias
+        return torch.sigmoid(out.transpose(1, 2)).reshape(rgb.shape)
@@ -0,0 +1,204 @@
+import os
+
+import numpy as np
+import torch
+from plyfile import PlyData, PlyElement
+
+from gaussian_renderer import decode_anchor_attributes
+from gaussian_renderer.torch_rasterizer import build_covariance_3d
+from utils.general_utils import inverse_sigmoid
+from utils.pose_utils import rotmat2qvec
+from utils.sh_utils import eval_sh
+from utils.system_utils import mkdir_p
+
+
+def sh_basis(deg, dirs):
+    # [..., (deg+1)**2] values of the SH basis used by the rasterizers (eval_sh of unit coefficients)
+    coeffs = (deg + 1) ** 2
+    eye = torch.eye(coeffs, dtype=dirs.dtype, device=dirs.device)
+    return eval_sh(deg, eye.expand(dirs.shape[:-1] + (coeffs, coeffs)), dirs)
+
+
+class BakedGaussianModel:
+    """Explicit 3DGS primitives baked from a Scaffold-GS model: no MLP runs at render time.
+
+    Stored and loaded as a standard 3DGS `point_cloud.ply` (x, y, z, normals, f_dc_*, f_rest_*,
+    opacity, scale_*, rot_*), with the usual activations: sigmoid opacity, exp scale,
+    normalized quaternion. `active_sh_degree` is the highest SH band with non-zero coefficients.
+    """
+
+    def __init__(self, max_sh_degree=3, device="cuda"):
+        self.max_sh_degree = max_sh_degree
+        self.active_sh_degree = max_sh_degree
+        self.device = torch.device(device)
+        self._xyz = torch.empty(0)
+        self._features_dc = torch.empty(0)
+        self._features_rest = torch.empty(0)
+        self._opacity = torch.empty(0)
+        self._scaling = torch.empty(0)
+        self._rotation = torch.empty(0)
+
+    @property
+    def get_xyz(self):
+        return self._xyz
+
+    @property
+    def get_features(self):
+        return torch.cat((self._features_dc, self._features_rest), dim=1)
+
+    @property
+    def get_opacity(self):
+        return torch.sigmoid(self._opacity)
+
+    @property
+    def get_scaling(self):
+        return torch.exp(self._scaling)
+
+    @property
+    def get_rotation(self):
+        return torch.nn.functional.normalize(self._rotation)
+
+    def __len__(self):
+        return self._xyz.shape[0]
+
+    def _update_active_sh_degree(self):
+        self.active_sh_degree = 0
+        for deg in range(1, self.max_sh_degree + 1):
+            if self._features_rest[:, deg ** 2 - 1:(deg + 1) ** 2 - 1].abs().max() > 0:
+                self.active_sh_degree = deg
+
+    def construct_list_of_attributes(self):
+        l = ['x', 'y', 'z', 'nx', 'ny', 'nz']
+        for i in range(self._features_dc.shape[1] * self._features_dc.shape[2]):
+            l.append('f_dc_{}'.format(i))
+        for i in range(self._features_rest.shape[1] * self._features_rest.shape[2]):
+            l.append('f_rest_{}'.format(i))
+        l.append('opacity')
+        for i in range(self._scaling.shape[1]):
+            l.append('scale_{}'.format(i))
+        for i in range(self._rotation.shape[1]):
+            l.append('rot_{}'.format(i))
+        return l
+
+    def save_ply(self, path):
+        mkdir_p(os.path.dirname(path))
+
+        xyz = self._xyz.detach().cpu().numpy()
+        normals = np.zeros_like(xyz)
+        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
+        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
+        opacities = self._opacity.detach().cpu().numpy()
+        scale = self._scaling.detach().cpu().numpy()
+        rotation = self._rotation.detach().cpu().numpy()
+
+        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
+        elements = np.empty(xyz.shape[0], dtype=dtype_full)
+        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
+        for name, column in zip(self.construct_list_of_attributes(), attributes.T):
+            elements[name] = column
+        PlyData([PlyElement.describe(elements, 'vertex')]).write(path)
+
+    @classmethod
+    def load_ply(cls, path, device="cuda"):
+        vertex = PlyData.read(path).elements[0]
+        names = [p.name for p in vertex.properties]
+
+        def columns(prefix):
+            selected = sorted([n for n in names if n.startswith(prefix)], key=lambda x: int(x.split('_')[-1]))
+            return np.stack([np.asarray(vertex[n], dtype=np.float32) for n in selected], axis=1)
+
+        xyz = np.stack([np.asarray(vertex[n], dtype=np.float32) for n in ('x', 'y', 'z')], axis=1)
+        f_dc = columns('f_dc_').reshape(xyz.shape[0], 3, 1)
+        extra = [n for n in names if n.startswith('f_rest_')]
+        f_rest = columns('f_rest_').reshape(xyz.shape[0], 3, -1) if extra else np.zeros((xyz.shape[0], 3, 0), np.float32)
+        max_sh_degree = int(round(np.sqrt(f_rest.shape[2] + 1))) - 1
+
+        model = cls(max_sh_degree, device)
+
+        def to_device(x):
+            return torch.from_numpy(np.ascontiguousarray(x)).to(model.device)
+
+        model._xyz = to_device(xyz)
+        model._features_dc = to_device(f_dc).transpose(1, 2).contiguous()
+        model._features_rest = to_device(f_rest).transpose(1, 2).contiguous()
+        model._opacity = to_device(np.asarray(vertex['opacity'], dtype=np.float32)[:, None])
+        model._scaling = to_device(columns('scale_'))
+        model._rotation = to_device(columns('rot_'))
+        model._update_active_sh_degree()
+        return model
+
+    @classmethod
+    @torch.no_grad()
+    def from_scaffold(cls, pc, camera_centers, sh_degree=1, max_sh_degree=3, chunk_size=4096, min_opacity=1.0 / 255.0,
+                      ridge=1e-2):
+        """
+        Bake the neural gaussians of a Scaffold-GS model seen from `camera_centers` [V, 3].
+
+        For every offset, the MLP outputs of all views are combined into one explicit gaussian:
+        the opacity is the mean over the views (gaussians masked out in a view count as 0), the
+        covariance is the opacity weighted mean of the per-view covariances, and the colour is the
+        opacity weighted least squares fit of degree `sh_degree` SH to the per-view colours, along the
+        camera -> gaussian directions (the convention of the rasterizers). `ridge` regularizes the
+        higher bands for gaussians seen from few directions. The coefficients are stored up to
+        `max_sh_degree` (3 for standard 3DGS files), the higher bands are zero.
+        """
+        device = pc.get_anchor.device
+        camera_centers = torch.as_tensor(camera_centers, dtype=torch.float32, device=device).reshape(-1, 3)
+        num_views = camera_centers.shape[0]
+        num_coeffs = (sh_degree + 1) ** 2
+        k = pc.n_offsets
+        penalty = torch.full((num_coeffs,), ridge, device=device)
+        penalty[0] = 0  # only the higher bands are regularized
+
+        outputs = []
+        for start in range(0, pc.get_anchor.shape[0], chunk_size):
+            feat = pc._anchor_feat[start:start + chunk_size]
+            anchor = pc.get_anchor[start:start + chunk_size]
+            grid_scaling = pc.get_scaling[start:start + chunk_size]
+            n = anchor.shape[0]
+            scaling_repeat = grid_scaling.repeat_interleave(k, dim=0)
+            xyz = anchor.repeat_interleave(k, dim=0) + pc._offset[start:start + chunk_size].reshape(-1, 3) * scaling_repeat[:, :3]
+
+            opacity_sum = torch.zeros(n * k, device=device)
+            cov_sum = torch.zeros(n * k, 3, 3, device=device)
+            normal_matrix = torch.zeros(n * k, num_coeffs, num_coeffs, device=device)
+            normal_rhs = torch.zeros(n * k, num_coeffs, 3, device=device)
+            for center in camera_centers:
+                ob_view = anchor - center
+                ob_dist = ob_view.norm(dim=1, keepdim=True)
+                neural_opacity, color, scale_rot = decode_anchor_attributes(pc, feat, ob_view / ob_dist, ob_dist)
+                weight = neural_opacity[:, 0].clamp(min=0)
+                scaling = scaling_repeat[:, 3:] * torch.sigmoid(scale_rot[:, :3])
+                rotation = pc.rotation_activation(scale_rot[:, 3:7])
+
+                opacity_sum += weight
+                cov_sum += weight[:, None, None] * build_covariance_3d(scaling, rotation)
+                basis = sh_basis(sh_degree, torch.nn.functional.normalize(xyz - center, dim=1))
+                weighted_basis = basis * weight[:, None]
+                normal_matrix += weighted_basis[:, :, None] * basis[:, None, :]
+                normal_rhs += weighted_basis[:, :, None] * (color - 0.5)[:, None, :]
+
+            opacity = opacity_sum / num_views
+            keep = opacity >= min_opacity
+            weight_sum = opacity_sum[keep]
+            cov = cov_sum[keep] / weight_sum[:, None, None]
+            normal_matrix = normal_matrix[keep] + torch.diag(penalty) * weight_sum[:, None, None]
+            sh = torch.linalg.solve(normal_matrix + 1e-8 * torch.eye(num_coeffs, device=device), normal_rhs[keep])
+
+            eigvals, eigvecs = torch.linalg.eigh(cov)
+            # right-handed eigenbasis so that it is a rotation
+            eigvecs[..., 2] *= torch.sign(torch.linalg.det(eigvecs))[:, None]
+            outputs.append((xyz[keep], sh, opacity[keep], eigvals.clamp(min=1e-12).sqrt(), rotmat2qvec(eigvecs)))
+
+        xyz, sh, opacity, scaling, rotation = [torch.cat(x) for x in zip(*outputs)]
+        model = cls(max_sh_degree, device)
+        model._xyz = xyz
+        model._features_dc = sh[:, :1].contiguous()
+        rest = torch.zeros(xyz.shape[0], (max_sh_degree + 1) ** 2 - 1, 3, device=device)
+        rest[:, :num_coeffs - 1] = sh[:, 1:]
+        model._features_rest = rest
+        model._opacity = inverse_sigmoid(opacity.clamp(max=1 - 1e-6))[:, None]
+        model._scaling = torch.log(scaling)
+        model._rotation = rotation
+        model.active_sh_degree = sh_degree
+        return model
@@ -87,3 +87,84 @@ class MiniCam:
         view_inv = torch.inverse(self.world_view_transform)
         self.camera_center = view_inv[3][:3]
 
+
+class CameraView:
+    """Lightweight view of one camera of a CameraBatch, usable wherever a VirtualCamera2 is."""
+    __slots__ = ('uid', 'colmap_id', 'R', 'T', 'FoVx', 'FoVy', 'image_width', 'image_height', 'image_name',
+                 'world_view_transform', 'projection_matrix', 'full_proj_transform', 'camera_center')
+
+    def __init__(self, batch, idx):
+        self.uid = 0
+        self.colmap_id = 1
+        self.R = batch.R[idx]
+        self.T = batch.T[idx]
+        self.FoVx = float(batch.FoVx[idx])
+        self.FoVy = float(batch.FoVy[idx])
+        self.image_width = int(batch.width[idx])
+        self.image_height = int(batch.height[idx])
+        self.image_name = batch.image_names[idx]
+        # row views into the batched device tensors, no allocation per view
+        self.world_view_transform = batch.world_view_transform[idx]
+        self.projection_matrix = batch.projection_matrix[idx]
+        self.full_proj_transform = batch.full_proj_transform[idx]
+        self.camera_center = batch.camera_center[idx]
+
+class CameraBatch:
+    """Struct-of-arrays set of virtual cameras, the batched counterpart of a list of VirtualCamera2.
+
+    R (N,3,3) and T (N,3) follow the VirtualCamera2 convention (R is the transposed w2c rotation,
+    T the w2c translation); FoV, width and height are scalars or (N,) arrays. All derived
+    matrices are computed for the whole batch at once and moved to the device in one copy,
+    indexing or iterating yields CameraView objects.
+    """
+
+    def __init__(self, R, T, FoVx, FoVy, width, height, image_names=None, znear=0.01, zfar=100.0, data_device="cuda"):
+        self.R = np.asarray(R, dtype=np.float64).reshape(-1, 3, 3)
+        self.T = np.asarray(T, dtype=np.float64).reshape(-1, 3)
+        n = len(self.R)
+        self.FoVx = np.broadcast_to(np.asarray(FoVx, dtype=np.float64), (n,))
+        self.FoVy = np.broadcast_to(np.asarray(FoVy, dtype=np.float64), (n,))
+        self.width = np.broadcast_to(np.asarray(width), (n,))
+        self.height = np.broadcast_to(np.asarray(height), (n,))
+        self.image_names = list(image_names) if image_names is not None else [''] * n
+        self.znear = znear
+        self.zfar = zfar
+
+        # getWorld2View2 for the whole batch: [R^T | T], stored transposed like the per-view cameras
+        world_view = np.zeros((n, 4, 4))
+        world_view[:, :3, :3] = self.R
+        world_view[:, 3, :3] = self.T
+        world_view[:, 3, 3] = 1.0
+        # closed form camera centre -R T instead of a 4x4 inverse per view
+        camera_center = -np.einsum('nij,nj->ni', self.R, self.T)
+
+        # getProjectionMatrix for the whole batch, also transposed
+        tan_half_fovx = np.tan(self.FoVx / 2)
+        tan_half_fovy = np.tan(self.FoVy / 2)
+        projection = np.zeros((n, 4, 4))
+        projection[:, 0, 0] = 1.0 / tan_half_fovx
+        projection[:, 1, 1] = 1.0 / tan_half_fovy
+        projection[:, 2, 3] = 1.0
+        projection[:, 2, 2] = zfar / (zfar - znear)
+        projection[:, 3, 2] = -(zfar * znear) / (zfar - znear)
+
+        packed = torch.from_numpy(np.concatenate([world_view.reshape(n, 16), projection.reshape(n, 16), camera_center], axis=1).astype(np.float32))
+        packed = packed.to(data_device)
+        self.world_view_transform = packed[:, :16].reshape(n, 4, 4)
+        self.projection_matrix = packed[:, 16:32].reshape(n, 4, 4)
+        self.camera_center = packed[:, 32:]
+        self.full_proj_transform = torch.bmm(self.world_view_transform, self.projection_matrix)
+
+    def __len__(self):
+        return len(self.R)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return CameraView(self, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield CameraView(self, idx)
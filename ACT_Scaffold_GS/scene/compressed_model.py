@@ -0,0 +1,172 @@
+import io
+import json
+import lzma
+import os
+
+import numpy as np
+import torch
+
+# bump when the layout of the arrays changes
+FORMAT_VERSION = 1
+COMPRESSED_FILE = 'point_cloud.gsc'
+
+
+def assign(x, codebook, chunk_size=16384):
+    """Index of the nearest code of every row of x [N, D] in codebook [K, D]."""
+    codebook_sq = (codebook ** 2).sum(dim=1)
+    indices = torch.empty(x.shape[0], dtype=torch.long, device=x.device)
+    for start in range(0, x.shape[0], chunk_size):
+        chunk = x[start:start + chunk_size]
+        # |x - c|^2 without the |x|^2 term, which does not change the argmin
+        indices[start:start + chunk_size] = (codebook_sq[None] - 2 * chunk @ codebook.T).argmin(dim=1)
+    return indices
+
+
+def kmeans(x, num_codes, iters=10, sample_size=1 << 18, chunk_size=16384, seed=0):
+    """
+    Codebook [K, D] fitted by k-means on at most `sample_size` rows of x [N, D], and the code of every row [N].
+    Codes that lose all their points are moved to random points.
+    """
+    generator = torch.Generator(device='cpu').manual_seed(seed)
+    num_codes = min(num_codes, x.shape[0])
+    sample = x[torch.randperm(x.shape[0], generator=generator)[:sample_size].to(x.device)]
+    codebook = sample[torch.randperm(sample.shape[0], generator=generator)[:num_codes].to(x.device)].clone()
+    for _ in range(iters):
+        indices = assign(sample, codebook, chunk_size)
+        sums = torch.zeros_like(codebook).index_add_(0, indices, sample)
+        counts = torch.bincount(indices, minlength=num_codes).to(x.dtype)
+        empty = counts == 0
+        codebook = torch.where(empty[:, None], codebook, sums / counts.clamp(min=1)[:, None])
+        if empty.any():
+            codebook[empty] = sample[torch.randint(sample.shape[0], (int(empty.sum()),), generator=generator).to(x.device)]
+    return codebook, assign(x, codebook, chunk_size)
+
+
+def product_quantize(x, num_codes, groups=1, **kwargs):
+    """Split the D columns of x [N, D] into `groups` sub-vectors with a codebook each: codebooks [G, K, D/G], indices [N, G]."""
+    if x.shape[1] % groups != 0:
+        raise ValueError(f"{x.shape[1]} columns cannot be split into {groups} groups")
+    codebooks, indices = zip(*[kmeans(part.contiguous(), num_codes, **kwargs) for part in x.chunk(groups, dim=1)])
+    return torch.stack(codebooks), torch.stack(indices, dim=1)
+
+
+def product_dequantize(codebooks, indices):
+    return torch.cat([codebooks[g][indices[:, g]] for g in range(codebooks.shape[0])], dim=1)
+
+
+def morton_code(coords):
+    # interleaved bits of non-negative int64 coordinates [N, 3], 21 bits per axis
+    code = np.zeros(coords.shape[0], dtype=np.int64)
+    for bit in range(21):
+        for axis in range(3):
+            code |= ((coords[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return code
+
+
+def index_dtype(num_codes):
+    return np.uint8 if num_codes <= 1 << 8 else np.uint16 if num_codes <= 1 << 16 else np.int32
+
+
+def compress_model(gaussians, voxel_size=None, anchor_subdivisions=1, feat_codes=4096, feat_groups=4, offset_codes=4096,
+                   kmeans_iters=10):
+    """
+    Arrays of the compressed scene model and the quantization errors.
+
+    Anchors are stored as integer coordinates on the voxel grid (step `voxel_size / anchor_subdivisions`),
+    in Morton order and delta coded, so that the lzma pass of save_compressed sees small numbers.
+    The anchor features are product quantized (`feat_groups` sub-vectors, `feat_codes` codes each), every
+    offset vector is quantized with one codebook of `offset_codes` codes. Scales are stored in float16,
+    the MLPs in float32.
+    """
+    voxel_size = gaussians.voxel_size if voxel_size is None else voxel_size
+    if voxel_size <= 0:
+        raise ValueError("The voxel size of the model is not known (voxel_size <= 0 at training), pass it explicitly")
+    step = voxel_size / anchor_subdivisions
+
+    with torch.no_grad():
+        anchor = gaussians.get_anchor.detach().double().cpu().numpy()
+        grid = np.round(anchor / step).astype(np.int64)
+        order = np.argsort(morton_code(grid - grid.min(axis=0)), kind='stable')
+        grid = grid[order]
+        deltas = np.diff(grid, axis=0, prepend=np.zeros((1, 3), dtype=np.int64))
+        order_t = torch.from_numpy(order).to(gaussians.get_anchor.device)
+
+        feat = gaussians._anchor_feat.detach()[order_t].float()
+        feat_codebooks, feat_indices = product_quantize(feat, feat_codes, feat_groups, iters=kmeans_iters)
+        feat_codebooks = feat_codebooks.half().float()  # stored in float16
+        offset = gaussians._offset.detach()[order_t].float()
+        offset_codebook, offset_indices = kmeans(offset.reshape(-1, 3), offset_codes, iters=kmeans_iters)
+
+        errors = {
+            'anchor_max': float(np.abs(grid * step - anchor[order]).max()),
+            'feat_rmse': float((product_dequantize(feat_codebooks, feat_indices) - feat).pow(2).mean().sqrt()),
+            'offset_rmse': float((offset_codebook[offset_indices] - offset.reshape(-1, 3)).pow(2).mean().sqrt()),
+        }
+
+    config = {'version': FORMAT_VERSION, 'feat_dim': gaussians.feat_dim, 'n_offsets': gaussians.n_offsets,
+              'voxel_size': voxel_size, 'step': step, 'use_feat_bank': gaussians.use_feat_bank,
+              'appearance_dim': gaussians.appearance_dim, 'add_opacity_dist': gaussians.add_opacity_dist,
+              'add_cov_dist': gaussians.add_cov_dist, 'add_color_dist': gaussians.add_color_dist}
+    arrays = {
+        'config': np.frombuffer(json.dumps(config).encode(), dtype=np.uint8),
+        # first row is the absolute coordinate, the coordinates are smaller than 2^31 voxels
+        'anchor_deltas': deltas.astype(np.int32),
+        'feat_codebooks': feat_codebooks.cpu().numpy().astype(np.float16),
+        'feat_indices': feat_indices.cpu().numpy().astype(index_dtype(feat_codes)),
+        'offset_codebook': offset_codebook.cpu().numpy().astype(np.float32),
+        'offset_indices': offset_indices.reshape(-1, gaussians.n_offsets).cpu().numpy().astype(index_dtype(offset_codes)),
+        'scaling': gaussians._scaling.detach()[order_t].cpu().numpy().astype(np.float16),
+        # constant after initialization, lzma reduces them to almost nothing
+        'rotation': gaussians._rotation.detach()[order_t].cpu().numpy().astype(np.float16),
+        'opacity': gaussians._opacity.detach()[order_t].cpu().numpy().astype(np.float16),
+    }
+    for name, module in gaussians.mlps().items():
+        for key, value in module.state_dict().items():
+            arrays[f'mlp/{name}/{key}'] = value.detach().float().cpu().numpy()
+    return arrays, errors
+
+
+def save_compressed(path, arrays, preset=9):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(lzma.compress(buffer.getvalue(), preset=preset))
+    os.replace(path + '.tmp', path)
+
+
+def read_compressed(path):
+    with open(path, 'rb') as f:
+        data = np.load(io.BytesIO(lzma.decompress(f.read())))
+        arrays = {name: data[name] for name in data.files}
+    config = json.loads(arrays.pop('config').tobytes().decode())
+    if config['version'] != FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {config['version']}, expected {FORMAT_VERSION}")
+    return config, arrays
+
+
+def decode_compressed(config, arrays, device):
+    """Tensors of the scene model on `device`: the codebooks and indices are uploaded, the lookups run on the device."""
+    def upload(name, dtype=None):
+        array = arrays[name]
+        if array.dtype == np.uint16:
+            array = array.astype(np.int32)  # no uint16 tensors in older torch
+        tensor = torch.from_numpy(np.ascontiguousarray(array)).to(device)
+        return tensor if dtype is None else tensor.to(dtype)
+
+    grid = upload('anchor_deltas', torch.long).cumsum(dim=0)
+    feat_codebooks = upload('feat_codebooks', torch.float)
+    offset_codebook = upload('offset_codebook', torch.float)
+    tensors = {
+        'anchor': (grid.double() * config['step']).float(),
+        'anchor_feat': product_dequantize(feat_codebooks, upload('feat_indices', torch.long)),
+        'offset': offset_codebook[upload('offset_indices', torch.long)],
+        'scaling': upload('scaling', torch.float),
+        'rotation': upload('rotation', torch.float),
+        'opacity': upload('opacity', torch.float),
+    }
+    mlps = {}
+    for name in arrays:
+        if name.startswith('mlp/'):
+            _, module, key = name.split('/', 2)
+            mlps.setdefault(module, {})[key] = upload(name)
+    return tensors, mlps
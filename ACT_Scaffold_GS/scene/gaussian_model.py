@@ -18,10 +18,18 @@ from torch import nn
 import os
 from utils.system_utils import mkdir_p
 from plyfile import PlyData, PlyElement
-from simple_knn._C import distCUDA2
+try:
+    from simple_knn._C import distCUDA2
+except ImportError:
+    # CUDA only, needed to initialize training from a point cloud but not to render trained models
+    distCUDA2 = None
 from utils.graphics_utils import BasicPointCloud
 from utils.general_utils import strip_symmetric, build_scaling_rotation
 from scene.embedding import Embedding
+from scene.compressed_model import decode_compressed, read_compressed
+
+# inference storage of the anchor attributes and MLP weights, see GaussianModel.set_storage_dtype
+STORAGE_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
 
     
 class GaussianModel:
@@ -57,6 +65,8 @@ class GaussianModel:
                  add_opacity_dist : bool = False,
                  add_cov_dist : bool = False,
                  add_color_dist : bool = False,
+                 device = "cuda",
+                 storage_dtype = "float32",
                  ):
 
         self.feat_dim = feat_dim
@@ -66,6 +76,8 @@ class GaussianModel:
         self.update_init_factor = update_init_factor
         self.update_hierachy_factor = update_hierachy_factor
         self.use_feat_bank = use_feat_bank
+        self.device = torch.device(device)
+        self.storage_dtype = STORAGE_DTYPES[storage_dtype] if isinstance(storage_dtype, str) else storage_dtype
 
         self.appearance_dim = appearance_dim
         self.embedding_appearance = None
@@ -101,7 +113,7 @@ class GaussianModel:
                 nn.ReLU(True),
                 nn.Linear(feat_dim, 3),
                 nn.Softmax(dim=1)
-            ).cuda()
+            ).to(self.device)
 
         self.opacity_dist_dim = 1 if self.add_opacity_dist else 0
         self.mlp_opacity = nn.Sequential(
@@ -109,7 +121,7 @@ class GaussianModel:
             nn.ReLU(True),
             nn.Linear(feat_dim, n_offsets),
             nn.Tanh()
-        ).cuda()
+        ).to(self.device)
 
         self.add_cov_dist = add_cov_dist
         self.cov_dist_dim = 1 if self.add_cov_dist else 0
@@ -117,7 +129,7 @@ class GaussianModel:
             nn.Linear(feat_dim+3+self.cov_dist_dim, feat_dim),
             nn.ReLU(True),
             nn.Linear(feat_dim, 7*self.n_offsets),
-        ).cuda()
+        ).to(self.device)
 
         self.color_dist_dim = 1 if self.add_color_dist else 0
         self.mlp_color = nn.Sequential(
@@ -125,7 +137,7 @@ class GaussianModel:
             nn.ReLU(True),
             nn.Linear(feat_dim, 3*self.n_offsets),
             nn.Sigmoid()
-        ).cuda()
+        ).to(self.device)
 
 
     def eval(self):
@@ -178,7 +190,7 @@ class GaussianModel:
 
     def set_appearance(self, num_cameras):
         if self.appearance_dim > 0:
-            self.embedding_appearance = Embedding(num_cameras, self.appearance_dim).cuda()
+            self.embedding_appearance = Embedding(num_cameras, self.appearance_dim).to(self.device)
 
     @property
     def get_appearance(self):
@@ -186,7 +198,7 @@ class GaussianModel:
 
     @property
     def get_scaling(self):
-        return 1.0*self.scaling_activation(self._scaling)
+        return 1.0*self.scaling_activation(self._scaling.float())
     
     @property
     def get_featurebank_mlp(self):
@@ -206,7 +218,7 @@ class GaussianModel:
     
     @property
     def get_rotation(self):
-        return self.rotation_activation(self._rotation)
+        return self.rotation_activation(self._rotation.float())
     
     @property
     def get_anchor(self):
@@ -221,10 +233,55 @@ class GaussianModel:
     
     @property
     def get_opacity(self):
-        return self.opacity_activation(self._opacity)
+        return self.opacity_activation(self._opacity.float())
     
     def get_covariance(self, scaling_modifier = 1):
         return self.covariance_activation(self.get_scaling, scaling_modifier, self._rotation)
+
+    def mlps(self):
+        modules = {'opacity_mlp': self.mlp_opacity, 'cov_mlp': self.mlp_cov, 'color_mlp': self.mlp_color}
+        if self.use_feat_bank:
+            modules['feature_bank_mlp'] = self.mlp_feature_bank
+        if self.appearance_dim > 0 and self.embedding_appearance is not None:
+            modules['appearance'] = self.embedding_appearance
+        return modules
+
+    def set_storage_dtype(self, dtype):
+        """
+        Store the anchor attributes and MLP weights in `dtype` (torch.float16 / torch.bfloat16, or their names),
+        for inference only. Anchor positions stay in float32, and the getters and the renderer
+        compose positions, scales and covariances in float32.
+        """
+        self.storage_dtype = STORAGE_DTYPES[dtype] if isinstance(dtype, str) else dtype
+        with torch.no_grad():
+            for name in ('_anchor_feat', '_offset', '_scaling', '_rotation', '_opacity'):
+                tensor = getattr(self, name)
+                if tensor.numel() > 0 and tensor.dtype != self.storage_dtype:
+                    setattr(self, name, nn.Parameter(tensor.to(self.storage_dtype), requires_grad=tensor.requires_grad))
+            for module in self.mlps().values():
+                module.to(self.storage_dtype)
+
+    def to(self, device):
+        """Move the anchors and MLPs to `device`, e.g. to park an inactive scene in host memory."""
+        self.device = torch.device(device)
+        with torch.no_grad():
+            for name in ('_anchor', '_anchor_feat', '_offset', '_scaling', '_rotation', '_opacity'):
+                tensor = getattr(self, name)
+                if tensor.device != self.device:
+                    setattr(self, name, nn.Parameter(tensor.to(self.device), requires_grad=tensor.requires_grad))
+            for module in self.mlps().values():
+                module.to(self.device)
+        return self
+
+    def memory_report(self):
+        """Bytes held by the anchor attributes and the MLPs, per group."""
+        def nbytes(tensors):
+            return sum(t.numel() * t.element_size() for t in tensors)
+        report = {'anchor': nbytes([self._anchor]), 'anchor_feat': nbytes([self._anchor_feat]), 'offset': nbytes([self._offset]),
+                  'scaling': nbytes([self._scaling]), 'rotation_opacity': nbytes([self._rotation, self._opacity]),
+                  'mlps': nbytes([t for module in self.mlps().values() for t in list(module.parameters()) + list(module.buffers())])}
+        report['total'] = sum(report.values())
+        return report
     
     def voxelize_sample(self, data=None, voxel_size=0.01):
         np.random.shuffle(data)
@@ -429,38 +486,61 @@ class GaussianModel:
 
         scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
         scale_names = sorted(scale_names, key = lambda x: int(x.split('_')[-1]))
-        scales = np.zeros((anchor.shape[0], len(scale_names)))
+        scales = np.zeros((anchor.shape[0], len(scale_names)), dtype=np.float32)
         for idx, attr_name in enumerate(scale_names):
             scales[:, idx] = np.asarray(plydata.elements[0][attr_name]).astype(np.float32)
 
         rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
         rot_names = sorted(rot_names, key = lambda x: int(x.split('_')[-1]))
-        rots = np.zeros((anchor.shape[0], len(rot_names)))
+        rots = np.zeros((anchor.shape[0], len(rot_names)), dtype=np.float32)
         for idx, attr_name in enumerate(rot_names):
             rots[:, idx] = np.asarray(plydata.elements[0][attr_name]).astype(np.float32)
         
         # anchor_feat
         anchor_feat_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_anchor_feat")]
         anchor_feat_names = sorted(anchor_feat_names, key = lambda x: int(x.split('_')[-1]))
-        anchor_feats = np.zeros((anchor.shape[0], len(anchor_feat_names)))
+        anchor_feats = np.zeros((anchor.shape[0], len(anchor_feat_names)), dtype=np.float32)
         for idx, attr_name in enumerate(anchor_feat_names):
             anchor_feats[:, idx] = np.asarray(plydata.elements[0][attr_name]).astype(np.float32)
 
         offset_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_offset")]
         offset_names = sorted(offset_names, key = lambda x: int(x.split('_')[-1]))
-        offsets = np.zeros((anchor.shape[0], len(offset_names)))
+        offsets = np.zeros((anchor.shape[0], len(offset_names)), dtype=np.float32)
         for idx, attr_name in enumerate(offset_names):
             offsets[:, idx] = np.asarray(plydata.elements[0][attr_name]).astype(np.float32)
         offsets = offsets.reshape((offsets.shape[0], 3, -1))
         
-        self._anchor_feat = nn.Parameter(torch.tensor(anchor_feats, dtype=torch.float, device="cuda").requires_grad_(True))
-
-        self._offset = nn.Parameter(torch.tensor(offsets, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._anchor = nn.Parameter(torch.tensor(anchor, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(True))
-
+        # anchor positions stay in float32, the other attributes are cast to the storage dtype
+        dtype = self.storage_dtype
+        self._anchor_feat = nn.Parameter(torch.from_numpy(anchor_feats).to(self.device, dtype).requires_grad_(True))
+
+        self._offset = nn.Parameter(torch.from_numpy(offsets).to(self.device, dtype).transpose(1, 2).contiguous().requires_grad_(True))
+        self._anchor = nn.Parameter(torch.from_numpy(anchor).to(self.device, torch.float).requires_grad_(True))
+        self._opacity = nn.Parameter(torch.from_numpy(opacities).to(self.device, dtype).requires_grad_(True))
+        self._scaling = nn.Parameter(torch.from_numpy(scales).to(self.device, dtype).requires_grad_(True))
+        self._rotation = nn.Parameter(torch.from_numpy(rots).to(self.device, dtype).requires_grad_(True))
+
+
+    def load_compressed(self, path):
+        """Anchors and MLPs from a file written by compress_model.py, decoded on the device."""
+        config, arrays = read_compressed(path)
+        for key in ('feat_dim', 'n_offsets', 'use_feat_bank', 'appearance_dim', 'add_opacity_dist', 'add_cov_dist', 'add_color_dist'):
+            if config[key] != getattr(self, key):
+                raise ValueError(f"{path} was compressed from a model with {key}={config[key]}, this model has {getattr(self, key)}")
+        tensors, mlps = decode_compressed(config, arrays, self.device)
+
+        self._anchor = nn.Parameter(tensors['anchor'].requires_grad_(True))
+        self._anchor_feat = nn.Parameter(tensors['anchor_feat'].requires_grad_(True))
+        self._offset = nn.Parameter(tensors['offset'].requires_grad_(True))
+        self._scaling = nn.Parameter(tensors['scaling'].requires_grad_(True))
+        self._rotation = nn.Parameter(tensors['rotation'].requires_grad_(True))
+        self._opacity = nn.Parameter(tensors['opacity'].requires_grad_(True))
+        if self.appearance_dim > 0:
+            self.set_appearance(mlps['appearance']['embedding.weight'].shape[0])
+        modules = self.mlps()
+        for name, state_dict in mlps.items():
+            modules[name].float().load_state_dict(state_dict)
+        self.set_storage_dtype(self.storage_dtype)
 
     def replace_tensor_to_optimizer(self, tensor, name):
         optimizable_tensors = {}
@@ -792,15 +872,15 @@ class GaussianModel:
 
     def load_mlp_checkpoints(self, path, mode = 'split'):#split or unite
         if mode == 'split':
-            self.mlp_opacity = torch.jit.load(os.path.join(path, 'opacity_mlp.pt')).cuda()
-            self.mlp_cov = torch.jit.load(os.path.join(path, 'cov_mlp.pt')).cuda()
-            self.mlp_color = torch.jit.load(os.path.join(path, 'color_mlp.pt')).cuda()
+            self.mlp_opacity = torch.jit.load(os.path.join(path, 'opacity_mlp.pt'), map_location=self.device)
+            self.mlp_cov = torch.jit.load(os.path.join(path, 'cov_mlp.pt'), map_location=self.device)
+            self.mlp_color = torch.jit.load(os.path.join(path, 'color_mlp.pt'), map_location=self.device)
             if self.use_feat_bank:
-                self.mlp_feature_bank = torch.jit.load(os.path.join(path, 'feature_bank_mlp.pt')).cuda()
+                self.mlp_feature_bank = torch.jit.load(os.path.join(path, 'feature_bank_mlp.pt'), map_location=self.device)
             if self.appearance_dim > 0:
-                self.embedding_appearance = torch.jit.load(os.path.join(path, 'embedding_appearance.pt')).cuda()
+                self.embedding_appearance = torch.jit.load(os.path.join(path, 'embedding_appearance.pt'), map_location=self.device)
         elif mode == 'unite':
-            checkpoint = torch.load(os.path.join(path, 'checkpoints.pth'))
+            checkpoint = torch.load(os.path.join(path, 'checkpoints.pth'), map_location=self.device)
             self.mlp_opacity.load_state_dict(checkpoint['opacity_mlp'])
             self.mlp_cov.load_state_dict(checkpoint['cov_mlp'])
             self.mlp_color.load_state_dict(checkpoint['color_mlp'])
@@ -810,3 +890,6 @@ class GaussianModel:
                 self.embedding_appearance.load_state_dict(checkpoint['appearance'])
         else:
             raise NotImplementedError
+        if self.storage_dtype != torch.float32:
+            for module in self.mlps().values():
+                module.to(self.storage_dtype)
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+
+class ResidentScene:
+    """A loaded scene: Scaffold-GS model, background colour, ACT module (Cambridge only) and its loading parameters."""
+
+    def __init__(self, scene_id, gaussians, background, act=None, params=None):
+        self.scene_id = scene_id
+        self.gaussians = gaussians
+        self.background = background
+        self.act = act
+        self.params = params
+        self.device = background.device
+        act_bytes = 0 if act is None else sum(t.numel() * t.element_size() for t in list(act.parameters()) + list(act.buffers()))
+        self.bytes = gaussians.memory_report()['total'] + act_bytes
+
+    def to(self, device, pin_memory=False):
+        self.device = torch.device(device)
+        self.gaussians.to(device)
+        if pin_memory and self.device.type == 'cpu':
+            for name in ('_anchor', '_anchor_feat', '_offset', '_scaling', '_rotation', '_opacity'):
+                tensor = getattr(self.gaussians, name)
+                setattr(self.gaussians, name, torch.nn.Parameter(tensor.pin_memory(), requires_grad=tensor.requires_grad))
+        self.background = self.background.to(device)
+        if self.act is not None:
+            self.act.to(device)
+        return self
+
+
+class ScenePool:
+    """
+    Scenes loaded on demand by `loader(scene_id) -> ResidentScene`, kept on `device` within `device_budget` bytes.
+
+    When a scene does not fit, the least recently used scenes are demoted to host memory, as long as
+    they fit in `host_budget` bytes (0 disables demotion), otherwise dropped. A demoted scene is moved back
+    to the device by the next `get`, which is much faster than loading it again. Scenes used inside
+    `with pool.use(scene_id)` are never moved or dropped. Thread safe.
+    """
+
+    def __init__(self, loader, device='cuda', device_budget=8 * 1024 ** 3, host_budget=0, pin_memory=False):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.device_budget = device_budget
+        self.host_budget = host_budget
+        self.pin_memory = pin_memory
+        self.on_device = OrderedDict()  # scene_id -> ResidentScene, least recently used first
+        self.on_host = OrderedDict()
+        self.pinned = {}  # scene_id -> number of users
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.promotions = 0
+        self.loads = 0
+        self.demotions = 0
+        self.evictions = 0
+
+    @property
+    def device_bytes(self):
+        return sum(scene.bytes for scene in self.on_device.values())
+
+    @property
+    def host_bytes(self):
+        return sum(scene.bytes for scene in self.on_host.values())
+
+    def __contains__(self, scene_id):
+        return scene_id in self.on_device or scene_id in self.on_host
+
+    def get(self, scene_id):
+        """The scene on the device, loaded or promoted from host memory if needed."""
+        with self.lock:
+            if scene_id in self.on_device:
+                self.on_device.move_to_end(scene_id)
+                self.hits += 1
+                return self.on_device[scene_id]
+            if scene_id in self.on_host:
+                scene = self.on_host.pop(scene_id).to(self.device)
+                self.promotions += 1
+            else:
+                scene = self.loader(scene_id)
+                self.loads += 1
+            self.on_device[scene_id] = scene
+            self._fit(keep=scene_id)
+            return scene
+
+    @contextmanager
+    def use(self, scene_id):
+        with self.lock:
+            scene = self.get(scene_id)
+            self.pinned[scene_id] = self.pinned.get(scene_id, 0) + 1
+        try:
+            yield scene
+        finally:
+            with self.lock:
+                self.pinned[scene_id] -= 1
+                if self.pinned[scene_id] == 0:
+                    del self.pinned[scene_id]
+                self._fit()
+
+    def evict(self, scene_id):
+        with self.lock:
+            self.on_device.pop(scene_id, None)
+            self.on_host.pop(scene_id, None)
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    def _fit(self, keep=None):
+        # least recently used first; the scene just requested and the scenes in use stay on the device
+        freed = False
+        for scene_id in list(self.on_device):
+            if self.device_bytes <= self.device_budget:
+                break
+            if scene_id == keep or scene_id in self.pinned:
+                continue
+            scene = self.on_device.pop(scene_id)
+            if scene.bytes <= self.host_budget:
+                self.on_host[scene_id] = scene.to('cpu', pin_memory=self.pin_memory)
+                self.demotions += 1
+            else:
+                self.evictions += 1
+            freed = True
+        for scene_id in list(self.on_host):
+            if self.host_bytes <= self.host_budget:
+                break
+            del self.on_host[scene_id]
+            self.evictions += 1
+        if freed and self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    def stats(self):
+        with self.lock:
+            return {'on_device': list(self.on_device), 'on_host': list(self.on_host), 'device_bytes': self.device_bytes,
+                    'host_bytes': self.host_bytes, 'hits': self.hits, 'promotions': self.promotions, 'loads': self.loads,
+                    'demotions': self.demotions, 'evictions': self.evictions,
+                    'scenes': {scene.scene_id: scene.bytes for scene in list(self.on_device.values()) + list(self.on_host.values())}}
+
+    def summary(self):
+        s = self.stats()
+        return (f"scene pool: {len(s['on_device'])} scenes / {s['device_bytes'] / 1024 ** 2:.0f} MB on {self.device}, "
+                f"{len(s['on_host'])} / {s['host_bytes'] / 1024 ** 2:.0f} MB on the host; {s['hits']} hits, {s['promotions']} promotions, "
+                f"{s['loads']} loads, {s['demotions']} demotions, {s['evictions']} evictions")
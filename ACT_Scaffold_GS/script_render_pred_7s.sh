@@ -1,16 +1,3 @@
 #!/bin/bash
-pes=('ace' 'marepo' 'dfnet' 'glace')
-scenes=('chess' 'fire' 'heads' 'office' 'pumpkin' 'redkitchen' 'stairs')
-
-for pe in "${pes[@]}"
-do
-    for scene in "${scenes[@]}"
-    do
-        scene_path="7scenes/scene_${scene}/test"
-        model_path="7scenes/scene_${scene}/train"
-        exp_name='output'
-
-        python render_pred_7s.py -s "data/${scene_path}" -m "data/${model_path}/${exp_name}" \
-        --render_scene "${scene}" --pose_estimator "${pe}"
-    done
-done
+# every scene model is loaded once and renders the poses of all estimators
+python render_pred_jobs.py --dataset 7scenes --pose_estimators ace marepo dfnet glace --report data/7scenes/render_report.json
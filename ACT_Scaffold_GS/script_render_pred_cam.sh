@@ -1,14 +1,3 @@
-pes=('dfnet' 'ace' 'glace')
-scenes=('KingsCollege' 'ShopFacade' 'OldHospital' 'StMarysChurch')
-
-for pe in "${pes[@]}"
-do
-    for scene in "${scenes[@]}"
-    do
-    scene_path="cambridge/scene_${scene}/test"
-    model_path="cambridge/scene_${scene}/train"
-    exp_name='output' 
-    python render_pred_cam_act.py -s data/${scene_path} -m data/${model_path}/${exp_name} \
-        --render_scene "${scene}" --pose_estimator "${pe}"
-    done
-done
\ No newline at end of file
+#!/bin/bash
+# every scene model is loaded once and renders the poses of all estimators, with the ACT colour transform
+python render_pred_jobs.py --dataset cambridge --pose_estimators dfnet ace glace --report data/cambridge/render_report.json
@@ -45,8 +45,7 @@ from utils.image_utils import psnr
 from argparse import ArgumentParser, Namespace
 from arguments import ModelParams, PipelineParams, OptimizationParams
 
-from scene.nerfh_nff import create_nerf
-from dataset_loaders.utils.color import rgb_to_yuv
+from scene.act import ACT
 
 # torch.set_num_threads(32)
 lpips_fn = lpips.LPIPS(net='vgg').to('cuda')
@@ -83,6 +82,29 @@ def saveRuntimeCode(dst: str) -> None:
     print('Backup Finished!')
 
 
+def find_act_checkpoint(args):
+    """
+    ACT checkpoint to resume from, as the previous create_nerf: --ft_path is a .tar file or a directory (its
+    <render_scene> subdirectory if there is one), in which the latest .tar is taken. Without --ft_path, the latest
+    .tar of basedir/expname/<render_scene> or basedir/expname, None if there is none.
+    """
+    if args.ft_path is not None and args.ft_path != 'None':
+        if os.path.isfile(args.ft_path):
+            return args.ft_path
+        if not os.path.isdir(args.ft_path):
+            raise FileNotFoundError(f"--ft_path {args.ft_path} is neither an ACT checkpoint (.tar) nor a directory of checkpoints")
+        directories = [os.path.join(args.ft_path, args.render_scene), args.ft_path]
+    else:
+        directories = [os.path.join(args.basedir, args.expname, args.render_scene), os.path.join(args.basedir, args.expname)]
+    for directory in directories:
+        ckpts = sorted(f for f in os.listdir(directory) if f.endswith('.tar')) if os.path.isdir(directory) else []
+        if len(ckpts) > 0:
+            return os.path.join(directory, ckpts[-1])
+    if args.ft_path is not None and args.ft_path != 'None':
+        raise FileNotFoundError(f"no ACT checkpoint (.tar) in {args.ft_path}")
+    return None
+
+
 def training(dataset, opt, pipe, dataset_name, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from, wandb=None, logger=None, ply_path=None):
     first_iter = 0
     tb_writer = prepare_output_and_logger(dataset)
@@ -90,32 +112,37 @@ def training(dataset, opt, pipe, dataset_name, testing_iterations, saving_iterat
                               dataset.appearance_dim, dataset.ratio, dataset.add_opacity_dist, dataset.add_cov_dist, dataset.add_color_dist)
     scene = Scene(dataset, gaussians, ply_path=ply_path, shuffle=False)
 
-    render_kwargs_train, render_kwargs_test, start, grad_vars, optimizer = create_nerf(args)
-    scaler = torch.cuda.amp.GradScaler(enabled=(args.ffmlp or args.tcnn))
+    # only the exposure embedding of the ACT is trained, the NeRF networks of create_nerf were never used
+    act = ACT(hist_bin=args.hist_bin).cuda()
+    optimizer = torch.optim.Adam(params=act.parameters(), lr=args.lrate, betas=(0.9, 0.999))
+    start = 0
+    ckpt_path = None if args.no_reload else find_act_checkpoint(args)
+    if ckpt_path is not None:
+        print('Reloading from', ckpt_path)
+        act = ACT.from_checkpoint(ckpt_path, hist_bin=args.hist_bin).cuda().train()
+        optimizer = torch.optim.Adam(params=act.parameters(), lr=args.lrate, betas=(0.9, 0.999))
+        # full precision weights and Adam moments of the interrupted run (network_fn_state_dict is the half precision
+        # tinycudann layout read by the renderers), so that the resumed run follows the same trajectory
+        ckpt = torch.load(ckpt_path, map_location='cuda')
+        if 'act_state_dict' in ckpt:
+            act.load_state_dict(ckpt['act_state_dict'])
+        try:
+            if 'optimizer_state_dict' in ckpt:
+                optimizer.load_state_dict(ckpt['optimizer_state_dict'])
+        except ValueError:
+            # checkpoints of the tinycudann ACT store the moments of its flat parameter vector
+            print('Optimizer state of', ckpt_path, 'does not match the ACT parameters, starting with fresh Adam moments')
+        start = act.global_step
     global_step = start
-    '''
-    if args.dataset_type == 'Cambridge':
-        bds = load_Cambridge_dataloader_GS(args)
-        near = bds[0]
-        far = bds[1]
-        if args.set_near_far:
-            print('use customized near_far')
-            near = args.near_far[0]
-            far = args.near_far[1]
-
-    bds_dict = {
-        'near' : near,
-        'far' : far,
-    }
-    render_kwargs_train.update(bds_dict)
-    render_kwargs_test.update(bds_dict)
-    '''
-    if args.reduce_embedding==2:
-        render_kwargs_train['i_epoch'] = global_step
-        render_kwargs_test['i_epoch'] = global_step
     basedir = args.basedir
     expname = args.expname
     gaussians.training_setup(opt)
+    if not checkpoint and start > 0:
+        # the scene model is trained with the ACT: take its checkpoint (--checkpoint_iterations) of the same iteration
+        checkpoint = os.path.join(dataset.model_path, "chkpnt" + str(start) + ".pth")
+        if not os.path.exists(checkpoint):
+            print(f'No scene model checkpoint at iteration {start} ({checkpoint}), the scene model starts from iteration 0')
+            checkpoint = None
     if checkpoint:
         (model_params, first_iter) = torch.load(checkpoint)
         gaussians.restore(model_params, opt)
@@ -168,16 +195,10 @@ def training(dataset, opt, pipe, dataset_name, testing_iterations, saving_iterat
         
         image, viewspace_point_tensor, visibility_filter, offset_selection_mask, radii, scaling, opacity = render_pkg["render"], render_pkg["viewspace_points"], render_pkg["visibility_filter"], render_pkg["selection_mask"], render_pkg["radii"], render_pkg["scaling"], render_pkg["neural_opacity"]
         gt_image = viewpoint_cam.original_image.cuda()
-        yuv = rgb_to_yuv(gt_image)
-        y_img = yuv[0] # extract y channel only
-        hist = torch.histc(y_img, bins=10, min=0., max=1.) # compute intensity histogram
-        hist = hist/(hist.sum())*100 # convert to histogram density, in terms of percentage per bin
-        hist = torch.round(hist).unsqueeze(0).cuda()
+        hist = act.histogram(gt_image) # rounded Y histogram in percentage per bin
         #print("hist shape: ",hist.shape)
         if args.encode_hist:
-            affine_color_transform = render_kwargs_train['network_fn'].affine_color_transform
-            rgb = affine_color_transform(args, image, hist, 1)
-        image = rgb.reshape(3,900,1600)
+            image = act(image, hist=hist)
         '''
         if not os.path.exists('./render_train/'):
             # 如果目录不存在，创建目录
@@ -243,8 +264,7 @@ def training(dataset, opt, pipe, dataset_name, testing_iterations, saving_iterat
                 torch.cuda.empty_cache()
 
             try:
-                scaler.step(optimizer)
-                scaler.update()
+                optimizer.step()
             except:
                 print("loss.backward() error")
                 breakpoint()
@@ -258,13 +278,13 @@ def training(dataset, opt, pipe, dataset_name, testing_iterations, saving_iterat
                 torch.save((gaussians.capture(), iteration), scene.model_path + "/chkpnt" + str(iteration) + ".pth")
 
             if iteration%args.i_weights==0 and iteration!=0:
+                global_step = iteration
                 path = os.path.join(basedir, expname, args.render_scene , '{:06d}.tar'.format(iteration))
 
                 model_save_dict={'global_step': global_step,
-                                'network_fn_state_dict': render_kwargs_train['network_fn'].state_dict(),
+                                'network_fn_state_dict': act.state_dict_tcnn(),
+                                'act_state_dict': act.state_dict(),
                                 'optimizer_state_dict': optimizer.state_dict(),}
-                if args.N_importance > 0: # have fine sample network
-                    model_save_dict['network_fine_state_dict'] = render_kwargs_train['network_fine'].state_dict()
                 if not os.path.exists(os.path.join(basedir, expname, args.render_scene)):
                     os.makedirs(os.path.join(basedir, expname, args.render_scene))
                 torch.save(model_save_dict, path)
@@ -560,41 +580,13 @@ if __name__ == "__main__":
     parser.add_argument("--gpu", type=str, default = '-1')
 
     # for act training
-    parser.add_argument("--multires_views", type=int, default=4, help='log2 of max freq for positional encoding (2D direction)')
-    parser.add_argument("--multires", type=int, default=10, help='log2 of max freq for positional encoding (3D location)')
-    parser.add_argument("--i_embed", type=int, default=0, help='set 0 for default positional encoding, -1 for none')
-    parser.add_argument("--reduce_embedding", type=int, default=-1, help='fourier embedding mode: -1: paper default, \
-                                                                        0: reduce by half, 1: remove embedding, 2: DNeRF embedding')
-    parser.add_argument("--use_viewdirs", action='store_true', default=True, help='use full 5D input instead of 3D')
-    parser.add_argument("--netdepth", type=int, default=8, help='layers in network')
-    parser.add_argument("--netwidth", type=int, default=128, help='channels per layer')
-    parser.add_argument("--use_fusion_res", default=False, action='store_true', help='add residual connection to the fusion block')
-    parser.add_argument("--no_fusion_BN", default=False, action='store_true', help='no batchnorm for fusion block')
-    parser.add_argument("--multi_gpu", action='store_true', help='use multiple gpu on the server')
-    parser.add_argument("--N_importance", type=int, default=64,help='number of additional fine samples per ray')
-    parser.add_argument("--N_samples", type=int, default=64, help='number of coarse samples per ray')
-    parser.add_argument("--NeRFW", action='store_true', default=True, help='new implementation for NeRFW')
-    parser.add_argument("--in_channels_a", type=int, default=50, help='appearance embedding dimension, hist_bin*N_a when embedding histogram')
-    parser.add_argument("--in_channels_t", type=int, default=20, help='transient embedding dimension, hist_bin*N_tau when embedding histogram')
-    parser.add_argument("--netchunk", type=int, default=2097152, help='number of pts sent through network in parallel, defualt is 2^21, consider reduce this if GPU OOM')
-    parser.add_argument("--no_grad_update", default=False, help='do not update nerf in training')
     parser.add_argument("--basedir", type=str, default='./logs/', help='where to store ckpts and logs')
     parser.add_argument("--expname", type=str, default='paper_models', help='experiment name')
-    parser.add_argument("--ft_path", type=str, default=None, help='specific weights npy file to reload for coarse network')
-    parser.add_argument("--perturb", type=float, default=1.,help='set to 0. for no jitter, 1. for jitter')
-    parser.add_argument("--white_bkgd", action='store_true', help='set to render synthetic data on a white bkgd (always use for dvoxels)')
-    parser.add_argument("--raw_noise_std", type=float, default=0., help='std dev of noise added to regularize sigma_a output, 1e0 recommended')
-    parser.add_argument("--dataset_type", type=str, default='Cambridge', help='options: llff / blender / deepvoxels')
-    parser.add_argument("--lindisp", action='store_true', help='sampling linearly in disparity rather than depth')
-    #parser.add_argument("--datadir", type=str, default='./data/Cambridge/ShopFacade', help='input data directory')
-    parser.add_argument("--df", type=float, default=2., help='image downscale factor')
+    parser.add_argument("--ft_path", type=str, default=None, help='ACT checkpoint (.tar) or directory of checkpoints to resume from (the latest .tar), default is the latest of basedir/expname')
     parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
-    parser.add_argument("--semantic", action='store_true', default=False, help='using semantic segmentation mask to remove temporal noise at training time')
     parser.add_argument("--encode_hist", default=True, action='store_true', help='encode histogram instead of frame index')
     parser.add_argument("--i_weights", type=int, default=10000, help='frequency of weight ckpt saving')
     parser.add_argument("--lrate", type=float, default=5e-4, help='learning rate')
-    parser.add_argument("--ffmlp", action='store_true', default=False, help='using NeRF with tiny-cuda-nn acceleration on mlp')
-    parser.add_argument("--tcnn", action='store_true', default=False, help='using NeRF with tiny-cuda-nn acceleration, with hash encoding')
     parser.add_argument("--no_reload", action='store_true', help='do not reload weights from saved ckpt')
     args = parser.parse_args(sys.argv[1:])
     args.save_iterations.append(args.iterations)
@@ -0,0 +1,80 @@
+"""
+Matching and PnP helpers of the refinement server.
+
+Copies of the functions of GS-CPR/utils/refine.py used by refine_server.py, kept local so that ACT_Scaffold_GS does
+not depend on the layout of the parent repository. Keep both files in sync.
+"""
+import cv2
+import numpy as np
+
+# PnP inlier threshold in pixels
+REPROJECTION_ERROR = {'7scenes': 1.0, '12scenes': 1.0, 'cambridge': 2.5}
+
+
+def input_geometry(original_size, size=512):
+    """
+    Scale and (x, y) crop offset of load_images(size) for images of original_size (H, W), such that an input pixel
+    maps to (pixel + offset) * scale. size=512 resizes the long side to 512 and crops to multiples of 16 (12Scenes:
+    968x1296 -> 382x512 -> 368x512, square images to 4:3), size=224 resizes the short side to 224 and crops the center
+    square.
+    """
+    H, W = original_size
+    long_edge = round(size * max(W / H, H / W)) if size == 224 else size
+    cx, cy = (int(round(x * long_edge / max(W, H))) // 2 for x in (W, H))
+    if size == 224:
+        offset = (cx - min(cx, cy), cy - min(cx, cy))
+    else:
+        halfw, halfh = ((2 * cx) // 16) * 8, ((2 * cy) // 16) * 8
+        if W == H:
+            halfh = 3 * halfw / 4
+        offset = (cx - halfw, cy - halfh)
+    return max(W, H) / long_edge, np.array(offset)
+
+
+def inside_border(matches_im0, matches_im1, shape0, shape1, border=3):
+    """Matches farther than `border` pixels from the edges of both MASt3R inputs (true shapes H, W)."""
+    H0, W0 = int(shape0[0]), int(shape0[1])
+    H1, W1 = int(shape1[0]), int(shape1[1])
+    return ((matches_im0[:, 0] >= border) & (matches_im0[:, 0] < W0 - border) & (matches_im0[:, 1] >= border) & (matches_im0[:, 1] < H0 - border) &
+            (matches_im1[:, 0] >= border) & (matches_im1[:, 0] < W1 - border) & (matches_im1[:, 1] >= border) & (matches_im1[:, 1] < H1 - border))
+
+
+def scale_matches(matches, original_size, size=512):
+    """Input pixels of load_images(size) to original_size pixels, truncated like the in-place scaling of gs_cpr_*.py."""
+    scale, offset = input_geometry(original_size, size)
+    return ((matches + offset) * scale).astype(np.int64)
+
+
+def filter_and_scale_matches(matches_im0, matches_im1, shape0, shape1, original_size, border=3):
+    """
+    Drop the matches within `border` pixels of the edges of the MASt3R inputs (true shapes H, W) and scale them to
+    `original_size` (H, W), undoing the crop of load_images.
+    """
+    valid = inside_border(matches_im0, matches_im1, shape0, shape1, border)
+    return scale_matches(matches_im0[valid], original_size), scale_matches(matches_im1[valid], original_size)
+
+
+def solve_pose(matches_im0, matches_im1, depth_map, K, c2w_ini, reprojection_error):
+    """
+    Refined c2w and number of inliers: the matched rendering pixels are lifted to scene coordinates with the rendered
+    depth and the coarse pose, then PnP RANSAC is run against the query pixels, as in gs_cpr_*.py.
+    """
+    if matches_im1.shape[0] < 4:
+        return c2w_ini, 0
+    fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
+    depth = depth_map[matches_im0[:, 1], matches_im0[:, 0]]
+    points_camera = np.stack([(matches_im0[:, 0] - cx) / fx * depth, (matches_im0[:, 1] - cy) / fy * depth, depth], axis=1)
+    points_world = points_camera @ c2w_ini[:3, :3].T + c2w_ini[:3, 3]
+    initial_rvec, _ = cv2.Rodrigues(c2w_ini[:3, :3].astype(np.float32))
+    success, rvec, tvec, inliers = cv2.solvePnPRansac(points_world.astype(np.float32), matches_im1.astype(np.float32), K,
+                                                      np.zeros(4, dtype=np.float32), rvec=initial_rvec,
+                                                      tvec=c2w_ini[:3, 3].astype(np.float32), useExtrinsicGuess=True,
+                                                      reprojectionError=reprojection_error, iterationsCount=2000,
+                                                      flags=cv2.SOLVEPNP_EPNP)
+    if not success:
+        return c2w_ini, 0
+    R, _ = cv2.Rodrigues(rvec)
+    c2w_refine = np.eye(4)
+    c2w_refine[:3, :3] = R.T
+    c2w_refine[:3, 3] = (-R.T @ tvec).reshape(3)
+    return c2w_refine, 0 if inliers is None else len(inliers)
@@ -0,0 +1,227 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+def depth_file_name(image_name):
+    # frame-000000.color.png -> frame-000000.color.npy, as the refinement scripts expect
+    return os.path.splitext(image_name)[0] + '.npy'
+
+
+def quantize_image(image):
+    # same rounding as torchvision.utils.save_image, done before the device->host copy: 4x less to transfer
+    return image.mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 0).to(torch.uint8)
+
+
+class RenderSink:
+    """Destination of rendered views. `write` is called from the writer threads with host arrays:
+    image as (H, W, 3) uint8 (or the float rendering if the writer does not quantize) and depth as rendered."""
+
+    def write(self, name, image, depth):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileSink(RenderSink):
+    """Image file + `.npy` depth per view in `render_path`, the layout read by gs_cpr_*.py."""
+
+    def __init__(self, render_path, save_image=True, save_depth=True):
+        self.render_path = render_path
+        self.save_image = save_image
+        self.save_depth = save_depth
+
+    def write(self, name, image, depth):
+        path = os.path.join(self.render_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.save_image and image is not None:
+            # the format follows the extension, like save_image (12Scenes renders are .jpg)
+            Image.fromarray(image).save(path)
+        if self.save_depth and depth is not None:
+            np.save(depth_file_name(path), depth)
+
+
+class MemorySink(RenderSink):
+    """Keeps copies of the outputs in dictionaries, e.g. to feed the refinement in the same process."""
+
+    def __init__(self):
+        self.images = {}
+        self.depths = {}
+        self._lock = threading.Lock()
+
+    def write(self, name, image, depth):
+        with self._lock:
+            if image is not None:
+                self.images[name] = image.copy()
+            if depth is not None:
+                self.depths[name] = depth.copy()
+
+
+class PackedDepthStore(RenderSink):
+    """All depth maps of a render set in one flat binary file plus a JSON index, instead of one `.npy` per view.
+
+    `PackedDepthStore(path)` writes `path.bin`/`path.json`, `PackedDepthStore(path, mode='r')`
+    memory-maps them and `store[name]` returns the depth map of the view without copying.
+    GS-CPR/utils/refine.load_depth reads the same files, keep it in sync with the format.
+    """
+
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.mode = mode
+        self.index = {}
+        self._lock = threading.Lock()
+        if mode == 'w':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path + '.bin', 'wb')
+            self._offset = 0
+        else:
+            with open(path + '.json') as f:
+                self.index = json.load(f)
+            self._data = np.memmap(path + '.bin', dtype=np.uint8, mode='r') if self.index else None
+
+    def write(self, name, image, depth):
+        if depth is None:
+            return
+        depth = np.ascontiguousarray(depth)
+        with self._lock:
+            self._file.write(depth.tobytes())
+            self.index[name] = {'offset': self._offset, 'shape': list(depth.shape), 'dtype': depth.dtype.str}
+            self._offset += depth.nbytes
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, name):
+        entry = self.index[name]
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        return np.frombuffer(self._data, dtype=dtype, count=count, offset=entry['offset']).reshape(entry['shape'])
+
+    def close(self):
+        if self.mode != 'w' or self._file.closed:
+            return
+        self._file.close()
+        with open(self.path + '.json', 'w') as f:
+            json.dump(self.index, f)
+
+
+class AsyncRenderWriter:
+    """Writes rendered views to one or more sinks from background threads.
+
+    `submit` starts an asynchronous device->host copy into a pinned buffer and returns
+    immediately; the writer threads wait for the copy and run the sinks (PNG encoding,
+    np.save, ...). At most `max_pending` views are in flight, `submit` blocks beyond that
+    so a slow disk bounds the memory use instead of growing the queue.
+    """
+
+    def __init__(self, sinks, num_workers=2, max_pending=8, quantize_images=True):
+        self.sinks = sinks if isinstance(sinks, (list, tuple)) else [sinks]
+        self.quantize_images = quantize_images
+        self._slots = threading.Semaphore(max_pending)
+        self._queue = queue.Queue()
+        self._free_buffers = {}
+        self._buffer_lock = threading.Lock()
+        self._error = None
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _get_buffer(self, tensor):
+        key = (tuple(tensor.shape), tensor.dtype)
+        with self._buffer_lock:
+            free = self._free_buffers.setdefault(key, [])
+            if free:
+                return free.pop()
+        return torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=tensor.is_cuda)
+
+    def _release_buffer(self, buffer):
+        with self._buffer_lock:
+            self._free_buffers[(tuple(buffer.shape), buffer.dtype)].append(buffer)
+
+    def _to_host(self, tensor):
+        if tensor is None:
+            return None
+        buffer = self._get_buffer(tensor)
+        buffer.copy_(tensor.detach(), non_blocking=tensor.is_cuda)
+        return buffer
+
+    def submit(self, name, image=None, depth=None):
+        """image: (3, H, W) rendering in [0, 1], depth: depth rendering, both on any device."""
+        self._check()
+        self._slots.acquire()
+        with torch.no_grad():
+            if image is not None and self.quantize_images:
+                image = quantize_image(image)
+            buffers = (self._to_host(image), self._to_host(depth))
+        event = None
+        if any(b is not None and b.is_pinned() for b in buffers):
+            event = torch.cuda.Event()
+            event.record()
+        self._queue.put((name, buffers, event))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            name, buffers, event = job
+            try:
+                if event is not None:
+                    event.synchronize()
+                image, depth = [None if b is None else b.numpy() for b in buffers]
+                if self._error is None:
+                    for sink in self.sinks:
+                        sink.write(name, image, depth)
+            except Exception as e:
+                self._error = e
+            finally:
+                for buffer in buffers:
+                    if buffer is not None:
+                        self._release_buffer(buffer)
+                self._slots.release()
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("Writing render outputs failed") from self._error
+
+    def flush(self):
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.join()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        for sink in self.sinks:
+            sink.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def make_sinks(render_path, depth_format='npy'):
+    # 'npy': image + .npy per view (default), 'packed': image per view + one PackedDepthStore for the depths
+    if depth_format == 'packed':
+        return [FileSink(render_path, save_depth=False), PackedDepthStore(os.path.join(render_path, 'depth'))]
+    return [FileSink(render_path)]
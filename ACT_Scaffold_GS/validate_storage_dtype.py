@@ -0,0 +1,86 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from arguments import ModelParams, PipelineParams
+from gaussian_renderer import render_dof
+from render_pred_jobs import DATASETS, build_jobs, load_scene, load_view_params
+from scene.cameras import CameraBatch
+from utils.render_io import quantize_image
+from validate_torch_rasterizer import compare
+
+
+def render_views(views, gaussians, pipe, background):
+    outputs, render_time = [], 0.0
+    for view in views:
+        t_start = time.time()
+        render_pkg = render_dof(view, gaussians, pipe, background)
+        outputs.append((quantize_image(render_pkg["render"]).cpu().numpy(), render_pkg["depth"].cpu().numpy()))
+        render_time += time.time() - t_start
+    return outputs, render_time / max(len(views), 1)
+
+
+def validate_job(job, parser, model, pipe, args):
+    """Memory and renders of the scene model stored in float32 and in each of `args.dtypes`."""
+    dataset, scene_name = job['dataset'], job['scene']
+    width, height = DATASETS[dataset]['size']
+    pose_file = next(iter(job['pose_files'].values()))
+    view_params = load_view_params(dataset, scene_name, pose_file)[::args.stride][:args.max_views]
+
+    results, reference = [], None
+    for dtype in ['float32'] + args.dtypes:
+        scene_params, scene, gaussians, background, _ = load_scene(job, parser, model, args, storage_dtype=dtype)
+        views = CameraBatch([p[1] for p in view_params], [p[2] for p in view_params], [p[3] for p in view_params],
+                            [p[4] for p in view_params], width, height, [p[0] for p in view_params],
+                            data_device=scene_params.data_device)
+        outputs, render_time = render_views(views, gaussians, pipe, background)
+        stats = {'scene': scene_name, 'dtype': dtype, 'memory': gaussians.memory_report(), 'render_time': render_time}
+        if reference is None:
+            reference = outputs
+        else:
+            per_view = [compare(image, depth, ref_image, ref_depth) for (image, depth), (ref_image, ref_depth) in zip(outputs, reference)]
+            stats['psnr'] = float(np.mean([s['psnr'] for s in per_view]))
+            stats['psnr_min'] = float(np.min([s['psnr'] for s in per_view]))
+            stats['depth_rel_median'] = float(np.median([s['depth_rel_median'] for s in per_view]))
+        results.append(stats)
+        del gaussians, scene
+        if background.is_cuda:
+            torch.cuda.empty_cache()
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare the memory and the renders of scene models stored in float16/bfloat16 with float32")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--dataset", type=str, default='7scenes', choices=list(DATASETS))
+    parser.add_argument("--scenes", nargs='+', default=None)
+    parser.add_argument("--pose_estimators", nargs='+', default=None, help='the poses of the first estimator are rendered')
+    parser.add_argument("--exp_name", type=str, default='output')
+    parser.add_argument("--dtypes", nargs='+', default=['float16', 'bfloat16'], choices=['float16', 'bfloat16'])
+    parser.add_argument("--max_views", type=int, default=20, help='views compared per scene')
+    parser.add_argument("--stride", type=int, default=1, help='take every n-th pose')
+    parser.add_argument("--report", type=str, default=None)
+    parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
+    parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
+    args = parser.parse_args()
+
+    results = []
+    with torch.no_grad():
+        for job in build_jobs(args.dataset, args.scenes, args.pose_estimators):
+            results += validate_job(job, parser, model, pipeline.extract(args), args)
+
+    print(f"{'scene':<18} {'dtype':<9} {'anchors(MB)':>11} {'mlps(MB)':>9} {'total(MB)':>9} {'PSNR':>7} {'min':>7} {'depth':>9} {'ms/view':>8}")
+    for r in results:
+        memory = r['memory']
+        print(f"{r['scene']:<18} {r['dtype']:<9} {(memory['total'] - memory['mlps']) / 1024 ** 2:>11.1f} {memory['mlps'] / 1024 ** 2:>9.2f} "
+              f"{memory['total'] / 1024 ** 2:>9.1f} {r.get('psnr', float('inf')):>7.2f} {r.get('psnr_min', float('inf')):>7.2f} "
+              f"{r.get('depth_rel_median', 0.0):>9.2e} {r['render_time'] * 1000:>8.1f}")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
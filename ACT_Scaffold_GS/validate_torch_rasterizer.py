@@ -0,0 +1,121 @@
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+from PIL import Image
+
+from arguments import ModelParams, PipelineParams
+from gaussian_renderer import render_dof
+from render_pred_jobs import DATASETS, apply_act, build_jobs, load_scene, load_view_params, render_path_for
+from scene.cameras import CameraBatch
+from utils.render_io import PackedDepthStore, depth_file_name, quantize_image
+
+
+def load_reference(render_path, image_name, packed_depths):
+    # render written by render_pred_jobs.py / render_pred_*.py with the CUDA rasterizer, None if missing
+    image_path = os.path.join(render_path, image_name)
+    if not os.path.exists(image_path):
+        return None, None
+    image = np.asarray(Image.open(image_path).convert('RGB'))
+    if packed_depths is not None:
+        depth = packed_depths[image_name] if image_name in packed_depths else None
+    else:
+        depth_path = depth_file_name(image_path)
+        depth = np.load(depth_path) if os.path.exists(depth_path) else None
+    return image, depth
+
+
+def compare(image, depth, ref_image, ref_depth):
+    diff = np.abs(image.astype(np.float64) - ref_image.astype(np.float64))
+    mse = (diff ** 2).mean()
+    stats = {'psnr': float(10 * np.log10(255 ** 2 / max(mse, 1e-12))), 'max_error': float(diff.max()),
+             'bad_pixels': float((diff.max(axis=-1) > 8).mean())}
+    if ref_depth is not None:
+        ref_depth = ref_depth.reshape(depth.shape)
+        valid = ref_depth > 0
+        rel = np.abs(depth[valid] - ref_depth[valid]) / ref_depth[valid]
+        stats['depth_rel_median'] = float(np.median(rel)) if rel.size else 0.0
+        stats['depth_rel_p99'] = float(np.percentile(rel, 99)) if rel.size else 0.0
+    return stats
+
+
+def validate_job(job, parser, model, pipeline, args):
+    dataset, scene_name = job['dataset'], job['scene']
+    width, height = DATASETS[dataset]['size']
+    scene_params, scene, gaussians, background, act = load_scene(job, parser, model, args)
+
+    results = []
+    for pe, pose_file in job['pose_files'].items():
+        render_path = render_path_for(scene_params.source_path, scene_params.model_path, pe)
+        packed_depths = None
+        if os.path.exists(os.path.join(render_path, 'depth.json')):
+            packed_depths = PackedDepthStore(os.path.join(render_path, 'depth'), mode='r')
+        view_params = load_view_params(dataset, scene_name, pose_file)[::args.stride][:args.max_views]
+        views = CameraBatch([p[1] for p in view_params], [p[2] for p in view_params], [p[3] for p in view_params],
+                            [p[4] for p in view_params], width, height, [p[0] for p in view_params],
+                            data_device=scene_params.data_device)
+        for view in views:
+            t_start = time.time()
+            render_pkg = render_dof(view, gaussians, pipeline, background)
+            render_time = time.time() - t_start
+            rendering, depth = render_pkg["render"], render_pkg["depth"]
+            image_name = view.image_name
+            if act is not None:
+                image_name, rendering = apply_act(act, rendering, scene_params.source_path, image_name)
+            ref_image, ref_depth = load_reference(render_path, image_name, packed_depths)
+            if ref_image is None:
+                print(f"no CUDA render of {image_name} in {render_path}, skipped")
+                continue
+            stats = compare(quantize_image(rendering).cpu().numpy(), depth.cpu().numpy(), ref_image, ref_depth)
+            stats.update({'scene': scene_name, 'pose_estimator': pe, 'image': image_name, 'render_time': render_time})
+            results.append(stats)
+    del gaussians
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare renders of the torch rasterizer with saved renders of the CUDA rasterizer")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--dataset", type=str, default='7scenes', choices=list(DATASETS))
+    parser.add_argument("--scenes", nargs='+', default=None)
+    parser.add_argument("--pose_estimators", nargs='+', default=None)
+    parser.add_argument("--exp_name", type=str, default='output')
+    parser.add_argument("--max_views", type=int, default=20, help='views compared per scene and pose estimator')
+    parser.add_argument("--stride", type=int, default=1, help='take every n-th pose')
+    parser.add_argument("--min_psnr", type=float, default=40.0, help='tolerance on the PSNR of the 8 bit colour renders')
+    parser.add_argument("--max_depth_error", type=float, default=0.01, help='tolerance on the median relative depth error')
+    parser.add_argument("--report", type=str, default=None)
+    parser.add_argument("--act_itr", type=str, default='30000', help='act_models_iteration')
+    parser.add_argument("--ft_path", type=str, default='./logs/paper_models/', help='directory of the per-scene ACT checkpoints')
+    parser.add_argument("--hist_bin", type=int, default=10, help='image histogram bin size')
+    args = parser.parse_args()
+
+    pipe = pipeline.extract(args)
+    pipe.rasterizer = "torch"
+    results = []
+    with torch.no_grad():
+        for job in build_jobs(args.dataset, args.scenes, args.pose_estimators):
+            results += validate_job(job, parser, model, pipe, args)
+    if len(results) == 0:
+        raise SystemExit("No CUDA renders found, run render_pred_jobs.py first")
+
+    failed = [r for r in results if r['psnr'] < args.min_psnr or r.get('depth_rel_median', 0.0) > args.max_depth_error]
+    psnr = np.array([r['psnr'] for r in results])
+    depth_error = np.array([r.get('depth_rel_median', 0.0) for r in results])
+    render_time = np.array([r['render_time'] for r in results])
+    print(f"{len(results)} views: PSNR min {psnr.min():.2f} / mean {psnr.mean():.2f} dB, "
+          f"median relative depth error max {depth_error.max():.2e}, "
+          f"torch rasterizer {1 / render_time.mean():.2f} fps ({torch.get_num_threads()} threads)")
+    for r in failed:
+        print(f"FAILED {r['scene']}/{r['pose_estimator']}/{r['image']}: PSNR {r['psnr']:.2f} dB, "
+              f"depth error {r.get('depth_rel_median', 0.0):.2e}")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        raise SystemExit(f"{len(failed)} of {len(results)} views outside the tolerance")
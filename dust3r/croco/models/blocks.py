@@ -14,8 +14,10 @@
 # https://github.com/rwightman/pytorch-image-models/blob/master/timm/models/layers/patch_embed.py
 
 
+import os
 import torch
 import torch.nn as nn 
+import torch.nn.functional as F
 
 from itertools import repeat
 import collections.abc
@@ -78,6 +80,53 @@ class Mlp(nn.Module):
         x = self.drop2(x)
         return x
 
+# Attention kernel of Attention and CrossAttention, chosen with set_attention_backend or the CROCO_ATTENTION environment variable:
+#   'math'    softmax(q k^T) v with the full N x N attention matrix of every head (reference implementation)
+#   'sdpa'    torch.nn.functional.scaled_dot_product_attention (flash / memory-efficient kernels, torch >= 2.0)
+#   'chunked' the same softmax over blocks of ATTENTION_CHUNK_SIZE queries, at most chunk x N scores are alive (CPU fallback)
+#   'auto'    sdpa when available, chunked otherwise
+ATTENTION_BACKENDS = ('math', 'sdpa', 'chunked', 'auto')
+ATTENTION_CHUNK_SIZE = 256
+_attention_backend = os.environ.get('CROCO_ATTENTION', 'math')
+# the scale argument of scaled_dot_product_attention exists since torch 2.1
+_SDPA_HAS_SCALE = tuple(int(v) for v in torch.__version__.split('+')[0].split('.')[:2]) >= (2, 1)
+
+def set_attention_backend(backend):
+    global _attention_backend
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f'Unknown attention backend {backend}, expected one of {ATTENTION_BACKENDS}')
+    _attention_backend = backend
+
+def get_attention_backend():
+    """ the backend actually used, 'auto' resolved """
+    if _attention_backend == 'auto':
+        return 'sdpa' if hasattr(F, 'scaled_dot_product_attention') else 'chunked'
+    return _attention_backend
+
+def attention(q, k, v, scale, attn_drop):
+    """ softmax(q k^T * scale) v for q: B x nheads x Nq x D and k, v: B x nheads x Nk x D, with the selected backend """
+    backend = get_attention_backend()
+    if backend == 'sdpa':
+        dropout_p = attn_drop.p if attn_drop.training else 0.
+        if _SDPA_HAS_SCALE:
+            return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, scale=scale)
+        # torch 2.0 always scales by D^-0.5, the rest of the scale is folded into q
+        return F.scaled_dot_product_attention(q * (scale * q.shape[-1] ** 0.5), k, v, dropout_p=dropout_p)
+    if backend == 'chunked':
+        kt = k.transpose(-2, -1)
+        out = q.new_empty(q.shape[:-1] + (v.shape[-1],))
+        for start in range(0, q.shape[2], ATTENTION_CHUNK_SIZE):
+            attn = (q[:, :, start:start+ATTENTION_CHUNK_SIZE] @ kt) * scale
+            attn = attn_drop(attn.softmax(dim=-1))
+            out[:, :, start:start+ATTENTION_CHUNK_SIZE] = attn @ v
+        return out
+    if backend != 'math':
+        raise ValueError(f'Unknown attention backend {backend}, expected one of {ATTENTION_BACKENDS}')
+    attn = (q @ k.transpose(-2, -1)) * scale
+    attn = attn.softmax(dim=-1)
+    attn = attn_drop(attn)
+    return attn @ v
+
 class Attention(nn.Module):
 
     def __init__(self, dim, rope=None, num_heads=8, qkv_bias=False, attn_drop=0., proj_drop=0.):
@@ -102,11 +151,7 @@ class Attention(nn.Module):
             q = self.rope(q, xpos)
             k = self.rope(k, xpos)
                
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = attention(q, k, v, self.scale, self.attn_drop).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -159,11 +204,7 @@ class CrossAttention(nn.Module):
             q = self.rope(q, qpos)
             k = self.rope(k, kpos)
             
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, Nq, C)
+        x = attention(q, k, v, self.scale, self.attn_drop).transpose(1, 2).reshape(B, Nq, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -202,7 +243,8 @@ class PositionGetter(object):
         if not (h,w) in self.cache_positions:
             x = torch.arange(w, device=device)
             y = torch.arange(h, device=device)
-            self.cache_positions[h,w] = torch.cartesian_prod(y, x) # (h, w, 2)
+            # same as torch.cartesian_prod(y, x), which has no ONNX export
+            self.cache_positions[h,w] = torch.stack(torch.meshgrid(y, x, indexing='ij'), dim=-1).view(h*w, 2) # (h*w, 2)
         pos = self.cache_positions[h,w].view(1, h*w, 2).expand(b, -1, 2).clone()
         return pos
 
@@ -8,6 +8,8 @@
 
 
 
+import os
+
 import numpy as np
 
 import torch
@@ -103,57 +105,125 @@ def interpolate_pos_embed(model, checkpoint_model):
 # RoPE2D: RoPE implementation in 2D
 #----------------------------------------------------------
 
+class PyTorchRoPE2D(torch.nn.Module):
+    """ reference pytorch RoPE2D, recomputes the max position (host sync) and gathers the tables at every call """
+    
+    def __init__(self, freq=100.0, F0=1.0):
+        super().__init__()
+        self.base = freq 
+        self.F0 = F0
+        self.cache = {}
+
+    def get_cos_sin(self, D, seq_len, device, dtype):
+        if (D,seq_len,device,dtype) not in self.cache:
+            inv_freq = 1.0 / (self.base ** (torch.arange(0, D, 2).float().to(device) / D))
+            t = torch.arange(seq_len, device=device, dtype=inv_freq.dtype)
+            freqs = torch.einsum("i,j->ij", t, inv_freq).to(dtype)
+            freqs = torch.cat((freqs, freqs), dim=-1)
+            cos = freqs.cos() # (Seq, Dim)
+            sin = freqs.sin()
+            self.cache[D,seq_len,device,dtype] = (cos,sin)
+        return self.cache[D,seq_len,device,dtype]
+        
+    @staticmethod
+    def rotate_half(x):
+        x1, x2 = x[..., : x.shape[-1] // 2], x[..., x.shape[-1] // 2 :]
+        return torch.cat((-x2, x1), dim=-1)
+        
+    def apply_rope1d(self, tokens, pos1d, cos, sin):
+        assert pos1d.ndim==2
+        cos = torch.nn.functional.embedding(pos1d, cos)[:, None, :, :]
+        sin = torch.nn.functional.embedding(pos1d, sin)[:, None, :, :]
+        return (tokens * cos) + (self.rotate_half(tokens) * sin)
+        
+    def forward(self, tokens, positions):
+        """
+        input:
+            * tokens: batch_size x nheads x ntokens x dim
+            * positions: batch_size x ntokens x 2 (y and x position of each token)
+        output:
+            * tokens after appplying RoPE2D (batch_size x nheads x ntokens x dim)
+        """
+        assert tokens.size(3)%2==0, "number of dimensions should be a multiple of two"
+        D = tokens.size(3) // 2
+        assert positions.ndim==3 and positions.shape[-1] == 2 # Batch, Seq, 2
+        cos, sin = self.get_cos_sin(D, int(positions.max())+1, tokens.device, tokens.dtype)
+        # split features into two along the feature dimension, and apply rope1d on each half
+        y, x = tokens.chunk(2, dim=-1)
+        y = self.apply_rope1d(y, positions[:,:,0], cos, sin)
+        x = self.apply_rope1d(x, positions[:,:,1], cos, sin)
+        tokens = torch.cat((y, x), dim=-1)
+        return tokens
+
+
+class FastRoPE2D(torch.nn.Module):
+    """
+    Pytorch RoPE2D with the same output as PyTorchRoPE2D, for when cuRoPE2D is not compiled:
+      * the cos/sin of every token are computed once per positions tensor (the encoder and decoder pass the same
+        positions to all their blocks) and per head dim / dtype / device, without reading the positions on the host
+      * both axes are rotated at once with fused multiply-adds, in place when no gradient is needed (as cuRoPE2D)
+      * only standard ops, so that it also exports to ONNX (see mast3r/onnx_export.py)
+    Set CROCO_ROPE_COMPILE=1 to torch.compile the rotation.
+    """
+
+    def __init__(self, freq=100.0, F0=1.0, max_cached=8):
+        super().__init__()
+        self.base = freq
+        self.F0 = F0
+        self.max_cached = max_cached
+        self.cache = {}  # (id(positions), D, device, dtype) -> (positions, cos, sin); positions kept alive so that the id stays unique
+        self.rotate = torch.compile(self._rotate, dynamic=False) if os.environ.get('CROCO_ROPE_COMPILE', '0') == '1' else self._rotate
+
+    def get_cos_sin(self, D, positions, device, dtype):
+        if torch.compiler.is_compiling():
+            # no id()-keyed cache inside a compiled graph, the tables are recomputed per layer and fused by the compiler
+            return self.cos_sin(D, positions, device, dtype)
+        key = (id(positions), D, device, dtype)
+        if key not in self.cache:
+            if len(self.cache) >= self.max_cached:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[key] = (positions, *self.cos_sin(D, positions, device, dtype))
+        return self.cache[key][1:]
+
+    def cos_sin(self, D, positions, device, dtype):
+        inv_freq = 1.0 / (self.base ** (torch.arange(0, D, 2, device=device).float() / D))
+        freqs = positions.to(device=device, dtype=torch.float32)[..., None] * inv_freq  # B x N x 2 x D/2
+        cos = freqs.cos().to(dtype)[:, None]  # B x 1 x N x 2 (axes) x D/2
+        sin = freqs.sin().to(dtype)[:, None]
+        return cos, sin
+
+    @staticmethod
+    def _rotate(tokens, cos, sin, inplace):
+        # tokens: B x nheads x N x 2 (axes) x 2 (halves) x D/2, rotate_half(t) = (-t2, t1)
+        t1, t2 = tokens[..., 0, :], tokens[..., 1, :]
+        if inplace:
+            t1_copy = t1.clone()
+            t1.mul_(cos).addcmul_(t2, sin, value=-1)
+            t2.mul_(cos).addcmul_(t1_copy, sin)
+            return tokens
+        return torch.stack((torch.addcmul(t1 * cos, t2, sin, value=-1), torch.addcmul(t2 * cos, t1, sin)), dim=-2)
+
+    def forward(self, tokens, positions):
+        """
+        input:
+            * tokens: batch_size x nheads x ntokens x dim
+            * positions: batch_size x ntokens x 2 (y and x position of each token)
+        output:
+            * tokens after appplying RoPE2D (batch_size x nheads x ntokens x dim), modified in place when no gradient is needed
+        """
+        assert tokens.size(3)%4==0, "number of dimensions should be a multiple of four"
+        assert positions.ndim==3 and positions.shape[-1] == 2 # Batch, Seq, 2
+        D = tokens.size(3) // 2
+        cos, sin = self.get_cos_sin(D, positions, tokens.device, tokens.dtype)
+        # out of place while exporting to ONNX, which has no in-place slice updates
+        inplace = not (torch.onnx.is_in_onnx_export() or (torch.is_grad_enabled() and tokens.requires_grad))
+        rotated = self.rotate(tokens.unflatten(-1, (2, 2, D // 2)), cos, sin, inplace)
+        return tokens if inplace else rotated.flatten(-3)
+
+
 try:
     from models.curope import cuRoPE2D
     RoPE2D = cuRoPE2D
 except ImportError:
-    print('Warning, cannot find cuda-compiled version of RoPE2D, using a slow pytorch version instead')
-
-    class RoPE2D(torch.nn.Module):
-        
-        def __init__(self, freq=100.0, F0=1.0):
-            super().__init__()
-            self.base = freq 
-            self.F0 = F0
-            self.cache = {}
-
-        def get_cos_sin(self, D, seq_len, device, dtype):
-            if (D,seq_len,device,dtype) not in self.cache:
-                inv_freq = 1.0 / (self.base ** (torch.arange(0, D, 2).float().to(device) / D))
-                t = torch.arange(seq_len, device=device, dtype=inv_freq.dtype)
-                freqs = torch.einsum("i,j->ij", t, inv_freq).to(dtype)
-                freqs = torch.cat((freqs, freqs), dim=-1)
-                cos = freqs.cos() # (Seq, Dim)
-                sin = freqs.sin()
-                self.cache[D,seq_len,device,dtype] = (cos,sin)
-            return self.cache[D,seq_len,device,dtype]
-            
-        @staticmethod
-        def rotate_half(x):
-            x1, x2 = x[..., : x.shape[-1] // 2], x[..., x.shape[-1] // 2 :]
-            return torch.cat((-x2, x1), dim=-1)
-            
-        def apply_rope1d(self, tokens, pos1d, cos, sin):
-            assert pos1d.ndim==2
-            cos = torch.nn.functional.embedding(pos1d, cos)[:, None, :, :]
-            sin = torch.nn.functional.embedding(pos1d, sin)[:, None, :, :]
-            return (tokens * cos) + (self.rotate_half(tokens) * sin)
-            
-        def forward(self, tokens, positions):
-            """
-            input:
-                * tokens: batch_size x nheads x ntokens x dim
-                * positions: batch_size x ntokens x 2 (y and x position of each token)
-            output:
-                * tokens after appplying RoPE2D (batch_size x nheads x ntokens x dim)
-            """
-            assert tokens.size(3)%2==0, "number of dimensions should be a multiple of two"
-            D = tokens.size(3) // 2
-            assert positions.ndim==3 and positions.shape[-1] == 2 # Batch, Seq, 2
-            cos, sin = self.get_cos_sin(D, int(positions.max())+1, tokens.device, tokens.dtype)
-            # split features into two along the feature dimension, and apply rope1d on each half
-            y, x = tokens.chunk(2, dim=-1)
-            y = self.apply_rope1d(y, positions[:,:,0], cos, sin)
-            x = self.apply_rope1d(x, positions[:,:,1], cos, sin)
-            tokens = torch.cat((y, x), dim=-1)
-            return tokens
\ No newline at end of file
+    print('Warning, cannot find cuda-compiled version of RoPE2D, using a pytorch version instead')
+    RoPE2D = FastRoPE2D
@@ -29,7 +29,12 @@ def make_batch_symmetric(batch):
     return view1, view2
 
 
+# autocast dtype of the precisions of inference(); fp16 needs a GPU, bf16 also runs on CPU
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
 def loss_of_one_batch(batch, model, criterion, device, symmetrize_batch=False, use_amp=False, ret=None):
+    # use_amp: False, True (float16) or a key of PRECISIONS
     view1, view2 = batch
     ignore_keys = set(['depthmap', 'dataset', 'label', 'instance', 'idx', 'true_shape', 'rng'])
     for view in batch:
@@ -41,19 +46,38 @@ def loss_of_one_batch(batch, model, criterion, device, symmetrize_batch=False, u
     if symmetrize_batch:
         view1, view2 = make_batch_symmetric(batch)
 
-    with torch.cuda.amp.autocast(enabled=bool(use_amp)):
+    amp_dtype = PRECISIONS[use_amp] if isinstance(use_amp, str) else torch.float16 if use_amp else None
+    device_type = torch.device(device).type
+    with torch.autocast(device_type, dtype=amp_dtype or torch.float16, enabled=amp_dtype is not None):
         pred1, pred2 = model(view1, view2)
 
         # loss is supposed to be symmetric
-        with torch.cuda.amp.autocast(enabled=False):
+        with torch.autocast(device_type, enabled=False):
             loss = criterion(view1, view2, pred1, pred2) if criterion is not None else None
 
     result = dict(view1=view1, view2=view2, pred1=pred1, pred2=pred2, loss=loss)
     return result[ret] if ret else result
 
 
+def _cast_predictions(pred, desc_dtype):
+    # reduced precision outputs back to float32 for the numpy consumers, the descriptors to desc_dtype
+    for key, value in pred.items():
+        if isinstance(value, torch.Tensor) and value.is_floating_point():
+            pred[key] = value.to(desc_dtype if key == 'desc' else torch.float32)
+    return pred
+
+
 @torch.no_grad()
-def inference(pairs, model, device, batch_size=8, verbose=True):
+def inference(pairs, model, device, batch_size=8, verbose=True, precision='fp32'):
+    """
+    precision: 'fp32', or 'bf16' / 'fp16' to run the encoder and decoder under autocast. The heads follow
+    model.head_precision. With reduced precision, the descriptors ('desc') are returned in float16 for matching,
+    the other outputs in float32.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}, expected one of {list(PRECISIONS)}')
+    if precision == 'fp16' and torch.device(device).type != 'cuda':
+        raise ValueError('fp16 inference needs a GPU, use bf16 on CPU')
     if verbose:
         print(f'>> Inference with model on {len(pairs)} image pairs')
     result = []
@@ -64,7 +88,11 @@ def inference(pairs, model, device, batch_size=8, verbose=True):
         batch_size = 1
 
     for i in tqdm.trange(0, len(pairs), batch_size, disable=not verbose):
-        res = loss_of_one_batch(collate_with_cat(pairs[i:i + batch_size]), model, None, device)
+        res = loss_of_one_batch(collate_with_cat(pairs[i:i + batch_size]), model, None, device,
+                                use_amp=precision if precision != 'fp32' else False)
+        if precision != 'fp32':
+            res['pred1'] = _cast_predictions(res['pred1'], torch.float16)
+            res['pred2'] = _cast_predictions(res['pred2'], torch.float16)
         result.append(to_cpu(res))
 
     result = collate_with_cat(result, lists=multiple_shapes)
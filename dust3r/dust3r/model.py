@@ -52,6 +52,8 @@ class AsymmetricCroCo3DStereo (
     The goal is to output 3d points directly, both images in view1's frame
     (hence the asymmetry).   
     """
+    # per head (head1, head2): 'fp32', or 'amp' to run it in the autocast dtype of inference(precision=...)
+    head_precision = ('fp32', 'fp32')
 
     def __init__(self,
                  output_mode='pts3d',
@@ -186,9 +188,19 @@ class AsymmetricCroCo3DStereo (
     def _downstream_head(self, head_num, decout, img_shape):
         B, S, D = decout[-1].shape
         # img_shape = tuple(map(int, img_shape))
+        if isinstance(img_shape, tuple):
+            # static (H, W) of a landscape batch (compiled forward), without the host syncs of the transpose wrapper
+            return getattr(self, f'downstream_head{head_num}')(decout, img_shape)
         head = getattr(self, f'head{head_num}')
         return head(decout, img_shape)
 
+    def _head_forward(self, head_num, decout, img_shape):
+        # float32 unless head_precision allows this head to run in the autocast dtype of the encoder / decoder
+        if self.head_precision[head_num - 1] == 'amp':
+            return self._downstream_head(head_num, list(decout), img_shape)
+        with torch.autocast(decout[-1].device.type, enabled=False):
+            return self._downstream_head(head_num, [tok.float() for tok in decout], img_shape)
+
     def forward(self, view1, view2):
         # encode the two images --> B,S,D
         (shape1, shape2), (feat1, feat2), (pos1, pos2) = self._encode_symmetrized(view1, view2)
@@ -196,9 +208,8 @@ class AsymmetricCroCo3DStereo (
         # combine all ref images into object-centric representation
         dec1, dec2 = self._decoder(feat1, pos1, feat2, pos2)
 
-        with torch.cuda.amp.autocast(enabled=False):
-            res1 = self._downstream_head(1, [tok.float() for tok in dec1], shape1)
-            res2 = self._downstream_head(2, [tok.float() for tok in dec2], shape2)
+        res1 = self._head_forward(1, dec1, shape1)
+        res2 = self._head_forward(2, dec2, shape2)
 
         res2['pts3d_in_other_view'] = res2.pop('pts3d')  # predict view2's pts3d in view1's frame
         return res1, res2
@@ -0,0 +1,46 @@
+from argparse import ArgumentParser
+import os
+
+import numpy as np
+
+from utils.evaluation import *
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Re-evaluate GS-CPR refined poses against the ground truth")
+    parser.add_argument("--datasets", nargs='+', default=list(DATASETS), choices=list(DATASETS))
+    parser.add_argument("--pose_estimators", nargs='+', default=["ace", "marepo", "glace", "dfnet"])
+    parser.add_argument("--methods", nargs='+', default=["GS_CPR", "GS_CPR_rel"], choices=["GS_CPR", "GS_CPR_rel"])
+    parser.add_argument("--matcher", default="mast3r", choices=["mast3r","mast3r_c2f","mast3r_knownK","dust3r","orb","sift"], type=str, help='matcher of the refinement runs (gs_cpr_*.py --matcher, mast3r_c2f for gs_cpr_cam.py --max_crops, mast3r_knownK for gs_cpr_*_rel.py without --pair_viewer)')
+    parser.add_argument("--scenes", nargs='+', default=None, help='restrict to these scenes, default is every scene of the dataset')
+    parser.add_argument("--thresholds", default=','.join(t[0] for t in DEFAULT_THRESHOLDS), type=str,
+                        help="comma separated 'XXcm/YYdeg' or 'X.Xm/YYdeg' accuracy thresholds")
+    parser.add_argument("--output_dir", default="./outputs/evaluation/", type=str)
+    args = parser.parse_args()
+    thresholds = parse_thresholds(args.thresholds)
+
+    runs = collect_runs(args.datasets, args.pose_estimators, args.methods, args.scenes, args.matcher)
+    if len(runs) == 0:
+        print("No refine_predictions files found for the requested datasets/estimators.")
+        exit(1)
+
+    keys, rot_errors, trans_errors = [], [], []
+    for run in runs:
+        _, (ini_rot, ini_trans), (ref_rot, ref_trans) = evaluate_prediction_file(
+            run['refined_path'], run['coarse_path'], run['gt_path'], run['gt_suffix'],
+            relative=run['method'] == 'GS_CPR_rel')
+        key = {k: run[k] for k in ('dataset', 'method', 'estimator', 'scene')}
+        keys += [dict(key, stage='initial'), dict(key, stage='refined')]
+        rot_errors += [ini_rot, ref_rot]
+        trans_errors += [ini_trans, ref_trans]
+
+    rows = evaluate_groups(keys, rot_errors, trans_errors, thresholds)
+    rows += average_over_scenes(rows, thresholds)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    save_csv(rows, os.path.join(args.output_dir, 'results.csv'))
+    save_json(rows, os.path.join(args.output_dir, 'results.json'))
+    table = comparison_table(rows, thresholds)
+    with open(os.path.join(args.output_dir, 'comparison.txt'), 'w') as f:
+        f.write(table + '\n')
+    print(table)
+    print(f"Evaluated {len(runs)} runs ({int(np.sum([len(r) for r in rot_errors[::2]]))} frames), results in {args.output_dir}")
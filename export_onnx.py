@@ -0,0 +1,57 @@
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from mast3r.model import AsymmetricMASt3R
+from mast3r.onnx_export import EXPORT_SHAPES, export_onnx
+
+
+def compare(model, path, image_size, threads):
+    # the exported graph against the pytorch model on a random pair
+    from mast3r.onnx_model import OnnxMASt3R
+    session = OnnxMASt3R(path, threads=threads)
+    img1, img2 = torch.rand(2, 1, 3, *image_size) * 2 - 1
+    t_start = time.time()
+    with torch.no_grad():
+        ref1, ref2 = model(dict(img=img1, instance=['0_1']), dict(img=img2, instance=['0_2']))
+    t_torch = time.time() - t_start
+    session.run(img1.numpy(), img2.numpy())  # warm-up, the first run also finishes the graph optimizations
+    t_start = time.time()
+    pred1, pred2 = session.run(img1.numpy(), img2.numpy())
+    t_ort = time.time() - t_start
+    for name, ref, pred in [('pred1', ref1, pred1), ('pred2', ref2, pred2)]:
+        for key in ref:
+            print(f'  {name}.{key}: max abs diff {np.abs(ref[key].numpy() - pred[key]).max():.2e}')
+    print(f'  pair forward: pytorch {t_torch:.2f}s, onnxruntime {t_ort:.2f}s')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="ONNX export of MASt3R, one graph per input size "
+                                        "(load the output with AsymmetricMASt3R.from_pretrained(<output>/model.onnx))")
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str, help='model name or local checkpoint')
+    parser.add_argument("--datasets", default=list(EXPORT_SHAPES), nargs='+', choices=list(EXPORT_SHAPES))
+    parser.add_argument("--output_dir", default="./checkpoints/onnx", type=str)
+    parser.add_argument("--static_batch", action='store_true', default=False, help='fix the batch size to 1 in the graph')
+    parser.add_argument("--check", action='store_true', default=False, help='compare each export with the pytorch model')
+    parser.add_argument("--threads", default=None, type=int, help='onnxruntime threads of --check')
+    args = parser.parse_args()
+
+    model = AsymmetricMASt3R.from_pretrained(args.model).cpu().eval()
+    exported = {}
+    for dataset in args.datasets:
+        H, W = EXPORT_SHAPES[dataset]
+        # the weights exceed 2GB and go to external data files next to the graph, hence one directory per size
+        path = os.path.join(args.output_dir, f'{W}x{H}', 'model.onnx')
+        if path not in exported.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            t_start = time.time()
+            export_onnx(model, path, (H, W), dynamic_batch=not args.static_batch)
+            print(f'exported in {time.time() - t_start:.1f}s')
+            if args.check:
+                compare(model, path, (H, W), args.threads)
+        exported[dataset] = path
+    for dataset, path in exported.items():
+        print(f'{dataset}: --model {path}')
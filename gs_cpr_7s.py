@@ -1,4 +1,5 @@
 from mast3r.model import AsymmetricMASt3R
+from mast3r.compiled import CompiledMASt3R
 from mast3r.fast_nn import fast_reciprocal_NNs
 import mast3r.utils.path_to_dust3r
 from dust3r.inference import inference
@@ -9,15 +10,20 @@ from tqdm import tqdm
 import numpy as np
 import math
 import cv2
+import time
 import os
 
 from utils.functions import *
+from utils.journal import ResultJournal
+from utils.matchers import load_matcher
+from utils.evaluation import log_accuracy
+from utils.pose_utils import invert_pose
+from utils.refine import load_depth
 
 import logging
 _logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
-    device = 'cuda'
     batch_size = 1
     schedule = 'cosine'
     lr = 0.01
@@ -25,7 +31,15 @@ if __name__ == '__main__':
     parser.add_argument("--pose_estimator", default="ace",choices=["ace","marepo","glace","dfnet"], type=str)
     parser.add_argument("--scene", default="chess", type=str)
     parser.add_argument("--test_all", action='store_true', default=False)
+    parser.add_argument("--overwrite", action='store_true', default=False, help='discard the per-frame journal of a previous run instead of resuming it')
+    parser.add_argument("--precision", default="fp32", choices=["fp32","bf16","fp16"], help='MASt3R encoder / decoder precision, fp16 needs a GPU')
+    parser.add_argument("--head_precision", default=["fp32"], nargs='+', choices=["fp32","amp"], help='per head (one value for both): fp32, or amp to run it in --precision')
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str, help='model name or local checkpoint, e.g. the int8 output of quantize_mast3r.py')
+    parser.add_argument("--device", default="cuda", type=str)
+    parser.add_argument("--compile", action='store_true', default=False, help='compile the MASt3R forward for the input size (CUDA graph on GPU), cached in ./checkpoints/compile_cache')
+    parser.add_argument("--matcher", default="mast3r", choices=["mast3r","dust3r","orb","sift"], type=str, help='2D-2D matcher between the rendering and the query, see utils/matchers.py')
     args = parser.parse_args()
+    device = args.device
     original_size = (480, 640)
     pe = args.pose_estimator
     if args.test_all:
@@ -34,10 +48,18 @@ if __name__ == '__main__':
         SCENES = [args.scene]
         
     focal_length_dict = {'chess':526.22, 'fire':526.903, 'heads':527.745, 'office':525.143, 'pumpkin':525.647, 'redkitchen':525.505, 'stairs':525.505}
-    model_name = "naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric"
+    model_name = args.model
     
     # you can put the path to a local checkpoint in model_name if needed
-    model = AsymmetricMASt3R.from_pretrained(model_name).to(device).eval()
+    model = None
+    if args.matcher == 'mast3r':
+        model = AsymmetricMASt3R.from_pretrained(model_name).to(device).eval()
+        model.head_precision = tuple(args.head_precision * 2)[:2]
+        if args.compile:
+            model = CompiledMASt3R(model)
+            # load_images(size=512) of every query and rendering
+            model.warmup([(384, 512)], precision=args.precision)
+    matcher = load_matcher(args.matcher, device, model=model, precision=args.precision)
     log_path = f"./outputs/7scenes/GS_CPR_{pe}_results/" 
     if not os.path.exists(log_path):
         os.makedirs(log_path)
@@ -59,6 +81,7 @@ if __name__ == '__main__':
         rendered_path = f'./ACT_Scaffold_GS/data/7scenes/scene_{SCENE}/test/evaluate_{pe}/train_output/render_single_view/'
 
         predict_pose_w2c_path = f'./coarse_poses/{pe}/7Scenes_pgt/poses_pgt_7scenes_{SCENE}_.txt'
+        predict_pose_w2c_all = getPredictPoses(predict_pose_w2c_path)
         gt_pose_c2w_path = f'./datasets/pgt_7scenes_{SCENE}/test/poses/'
         gs_depth_path = rendered_path
 
@@ -75,14 +98,12 @@ if __name__ == '__main__':
             c2w_pose = np.loadtxt(pose_file_name)
             gt_pose_c2w_dict[img_name] = c2w_pose
             if pe == 'dfnet':
-                predict_w2c_ini= getPredictPos(img_name.replace('-frame','/frame'),predict_pose_w2c_path)
+                predict_w2c_ini= predict_pose_w2c_all[img_name.replace('-frame','/frame')]
             else:
-                predict_w2c_ini= getPredictPos(img_name,predict_pose_w2c_path)
+                predict_w2c_ini= predict_pose_w2c_all[img_name]
             predict_pose_w2c_dict[img_name] = predict_w2c_ini
             
         
-        results_ini = []
-        results_final = []
         
 
         refine_results_path = log_path +  "refine_predictions/" 
@@ -92,52 +113,24 @@ if __name__ == '__main__':
         else:
             print(f"Directory {refine_results_path} already exists.")
         ransac_time = 0
-        with open(refine_results_path + f'{pe}_refinew2c_mast3r_{SCENE}.txt', 'w') as f:
-            for image in tqdm(images_list):   
-                try: 
-                    image1 = rendered_path + image
-                    image2 = query_path + image
-                    images = load_images([image1, image2], size=512)
-                except:
+        refine_txt_path = refine_results_path + f'{pe}_refinew2c_{matcher.name}_{SCENE}.txt'
+        with ResultJournal(refine_txt_path.replace('.txt', '.jsonl'), resume=not args.overwrite) as journal:
+            for image in tqdm(images_list):
+                if image in journal:
+                    continue
+                t_start = time.time()
+                image1 = rendered_path + image
+                image2 = query_path + image
+                if not os.path.exists(image1):
                     image1 = rendered_path + image.replace('-frame','/frame')
-                    image2 = query_path + image
-                    images = load_images([image1, image2], size=512)
-
-                images = load_images([image1, image2], size=512)
-                output = inference([tuple(images)], model, device, batch_size=1, verbose=False)
-                view1, pred1 = output['view1'], output['pred1']
-                view2, pred2 = output['view2'], output['pred2']
-
-                desc1, desc2 = pred1['desc'].squeeze(0).detach(), pred2['desc'].squeeze(0).detach()
-
-                # find 2D-2D matches between the two images
-                matches_im0, matches_im1 = fast_reciprocal_NNs(desc1, desc2, subsample_or_initxy1=8,
-                                                            device=device, dist='dot', block_size=2**13)
 
-                # ignore small border around the edge
-                H0, W0 = view1['true_shape'][0]
-                
-                valid_matches_im0 = (matches_im0[:, 0] >= 3) & (matches_im0[:, 0] < int(W0) - 3) & (
-                    matches_im0[:, 1] >= 3) & (matches_im0[:, 1] < int(H0) - 3)
-
-                H1, W1 = view2['true_shape'][0]
-                valid_matches_im1 = (matches_im1[:, 0] >= 3) & (matches_im1[:, 0] < int(W1) - 3) & (
-                    matches_im1[:, 1] >= 3) & (matches_im1[:, 1] < int(H1) - 3)
-
-                valid_matches = valid_matches_im0 & valid_matches_im1
-                matches_im0, matches_im1 = matches_im0[valid_matches], matches_im1[valid_matches]
-                scale_x = original_size[1] / W0.item()
-                scale_y = original_size[0] / H0.item()
-                for pixel in matches_im1:
-                    pixel[0] *= scale_x
-                    pixel[1] *= scale_y
-                for pixel in matches_im0:
-                    pixel[0] *= scale_x
-                    pixel[1] *= scale_y
+                # find 2D-2D matches between the two images, in original_size pixels
+                matches_im0, matches_im1, _ = matcher.match(image1, image2, original_size)
+                t_match = time.time()
                 try:
-                    depth_map = np.load(gs_depth_path+image.replace('png','npy').replace('-frame','/frame'))
+                    depth_map = load_depth(gs_depth_path+image.replace('png','npy').replace('-frame','/frame'))
                 except:
-                    depth_map = np.load(gs_depth_path+image.replace('png','npy'))
+                    depth_map = load_depth(gs_depth_path+image.replace('png','npy'))
                 fx, fy, cx, cy = fl, fl, original_size[1]/2, original_size[0]/2  # Example values for focal lengths and principal point
                 K = np.array([
                     [fx, 0, cx],
@@ -145,7 +138,7 @@ if __name__ == '__main__':
                     [0, 0, 1]
                 ])
                 dist_eff = np.array([0,0,0,0], dtype=np.float32)
-                predict_c2w_ini = np.linalg.inv(predict_pose_w2c_dict[image])
+                predict_c2w_ini = invert_pose(predict_pose_w2c_dict[image])
                 predict_w2c_ini = predict_pose_w2c_dict[image]
                 initial_rvec, _ = cv2.Rodrigues(predict_c2w_ini[:3,:3].astype(np.float32))
                 initial_tvec = predict_c2w_ini[:3,3].astype(np.float32)
@@ -179,78 +172,28 @@ if __name__ == '__main__':
                     predict_c2w_refine = np.eye(4)
                     predict_c2w_refine[:3,:3] = R.T
                     predict_c2w_refine[:3,3] = trans.reshape(3)
-                    ini_rot_error,ini_translation_error=cal_campose_error(predict_c2w_ini, gt_c2w_pose)
-                    results_ini.append([ini_rot_error,ini_translation_error])
-                    refine_rot_error,refine_translation_error=cal_campose_error(predict_c2w_refine, gt_c2w_pose)
-                    results_final.append([refine_rot_error,refine_translation_error])
-                    combined_list = [image] + rotmat2qvec(np.linalg.inv(predict_c2w_refine)[:3,:3]).tolist() + np.linalg.inv(predict_c2w_refine)[:3,3].tolist()
-                    output_line = ' '.join(map(str, combined_list))
-                    f.write(output_line + '\n')
+                    num_inliers = 0 if inliers is None else len(inliers)
                 else:
-                    ini_rot_error,ini_translation_error=cal_campose_error(predict_c2w_ini, gt_c2w_pose)
-                    results_ini.append([ini_rot_error,ini_translation_error])
-                    refine_rot_error,refine_translation_error=cal_campose_error(predict_c2w_ini, gt_c2w_pose)
-                    results_final.append([refine_rot_error,refine_translation_error])
-                    combined_list = [image] + rotmat2qvec(np.linalg.inv(predict_c2w_ini)[:3,:3]).tolist() + np.linalg.inv(predict_c2w_ini)[:3,3].tolist()
-                    output_line = ' '.join(map(str, combined_list))
-                    f.write(output_line + '\n')
-                    
+                    predict_c2w_refine = predict_c2w_ini
+                    num_inliers = 0
+                t_pnp = time.time()
+                ini_rot_error,ini_translation_error=cal_campose_error(predict_c2w_ini, gt_c2w_pose)
+                refine_rot_error,refine_translation_error=cal_campose_error(predict_c2w_refine, gt_c2w_pose)
+                predict_w2c_refine = invert_pose(predict_c2w_refine)
+                journal.append(image, rotmat2qvec(predict_w2c_refine[:3,:3]), predict_w2c_refine[:3,3],
+                               [ini_rot_error,ini_translation_error], [refine_rot_error,refine_translation_error],
+                               num_matches=matches_im1.shape[0], num_inliers=num_inliers,
+                               timings={'match': t_match - t_start, 'pnp': t_pnp - t_match, 'total': t_pnp - t_start})
+            journal.export_txt(refine_txt_path, images_list)
+        # summary statistics are rebuilt from the journal, so resumed frames are included
+        results_ini, results_final = journal.errors(images_list)
         median_result_ini = np.median(results_ini,axis=0)
         mean_result_ini = np.mean(results_ini,axis=0)
 
         median_result = np.median(results_final,axis=0)
         mean_result = np.mean(results_final,axis=0)
-        pct10_5 = 0
-        pct5 = 0
-        pct2 = 0
-        pct1 = 0
-        for err in results_ini:
-            r_err = err[0]
-            t_err = err[1]
-            if r_err < 5 and t_err < 0.1:  # 10cm/5deg
-                pct10_5 += 1
-            if r_err < 5 and t_err < 0.05:  # 5cm/5deg
-                pct5 += 1
-            if r_err < 2 and t_err < 0.02:  # 2cm/2deg
-                pct2 += 1
-            if r_err < 1 and t_err < 0.01:  # 1cm/1deg
-                pct1 += 1
-        total_frames = len(results_ini)
-        pct10_5 = pct10_5 / total_frames * 100
-        pct5 = pct5 / total_frames * 100
-        pct2 = pct2 / total_frames * 100
-        pct1 = pct1 / total_frames * 100
-        _logger.info('Ini Accuracy:')
-        _logger.info(f'\t10cm/5deg: {pct10_5:.1f}%')
-        _logger.info(f'\t5cm/5deg: {pct5:.1f}%')
-        _logger.info(f'\t2cm/2deg: {pct2:.1f}%')
-        _logger.info(f'\t1cm/1deg: {pct1:.1f}%')
-
-        pct10_5 = 0
-        pct5 = 0
-        pct2 = 0
-        pct1 = 0
-        for err in results_final:
-            r_err = err[0]
-            t_err = err[1]
-            if r_err < 5 and t_err < 0.1:  # 10cm/5deg
-                pct10_5 += 1
-            if r_err < 5 and t_err < 0.05:  # 5cm/5deg
-                pct5 += 1
-            if r_err < 2 and t_err < 0.02:  # 2cm/2deg
-                pct2 += 1
-            if r_err < 1 and t_err < 0.01:  # 1cm/1deg
-                pct1 += 1
-        total_frames = len(results_final)
-        pct10_5 = pct10_5 / total_frames * 100
-        pct5 = pct5 / total_frames * 100
-        pct2 = pct2 / total_frames * 100
-        pct1 = pct1 / total_frames * 100
-        _logger.info('After refine Accuracy:')
-        _logger.info(f'\t10cm/5deg: {pct10_5:.1f}%')
-        _logger.info(f'\t5cm/5deg: {pct5:.1f}%')
-        _logger.info(f'\t2cm/2deg: {pct2:.1f}%')
-        _logger.info(f'\t1cm/1deg: {pct1:.1f}%')
+        log_accuracy(_logger, 'Ini', results_ini)
+        log_accuracy(_logger, 'After refine', results_final)
 
         # standard log
         _logger.info(f"--------------GS-CPR for {pe}:{SCENE}--------------")
@@ -1,4 +1,5 @@
 from mast3r.model import AsymmetricMASt3R
+from mast3r.compiled import CompiledMASt3R
 import mast3r.utils.path_to_dust3r
 from dust3r.inference import inference
 from dust3r.utils.image import load_images
@@ -10,15 +11,19 @@ from tqdm import tqdm
 import numpy as np
 import math
 import cv2
+import time
 import os
 from utils.functions import *
+from utils.journal import ResultJournal
+from utils.evaluation import log_accuracy
+from utils.pose_utils import invert_pose
+from utils.refine import QUERIES, RELATIVE_CONF_THR, load_depth, relative_scale, solve_relative_pose
 
 import logging
 _logger = logging.getLogger(__name__)
 
 
 if __name__ == '__main__':
-    device = 'cuda'
     batch_size = 1
     schedule = 'cosine'
     lr = 0.01
@@ -26,7 +31,17 @@ if __name__ == '__main__':
     parser.add_argument("--pose_estimator", default="dfnet",choices=["ace","dfnet"], type=str)
     parser.add_argument("--scene", default="chess", type=str)
     parser.add_argument("--test_all", action='store_true', default=False)
+    parser.add_argument("--overwrite", action='store_true', default=False, help='discard the per-frame journal of a previous run instead of resuming it')
+    parser.add_argument("--precision", default="fp32", choices=["fp32","bf16","fp16"], help='MASt3R encoder / decoder precision, fp16 needs a GPU')
+    parser.add_argument("--head_precision", default=["fp32"], nargs='+', choices=["fp32","amp"], help='per head (one value for both): fp32, or amp to run it in --precision')
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str, help='model name or local checkpoint, e.g. the int8 output of quantize_mast3r.py')
+    parser.add_argument("--device", default="cuda", type=str)
+    parser.add_argument("--compile", action='store_true', default=False, help='compile the MASt3R forward for the input size (CUDA graph on GPU), cached in ./checkpoints/compile_cache')
+    parser.add_argument("--subsample", default=8, type=int, help='PnP and depth scale on every n-th pixel of the MASt3R input')
+    parser.add_argument("--conf_thr", default=RELATIVE_CONF_THR, type=float, help='minimum MASt3R confidence of the PnP and depth scale points')
+    parser.add_argument("--pair_viewer", action='store_true', default=False, help='previous solver: symmetrized pair, focal estimation and dense PnP of dust3r PairViewer')
     args = parser.parse_args()
+    device = args.device
     original_size = (480, 640)
     pe = args.pose_estimator
     if args.test_all:
@@ -34,10 +49,15 @@ if __name__ == '__main__':
     else:
         SCENES = [args.scene]
     
-    model_name = "naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric"
+    model_name = args.model
     
     # you can put the path to a local checkpoint in model_name if needed
     model = AsymmetricMASt3R.from_pretrained(model_name).to(device).eval()
+    model.head_precision = tuple(args.head_precision * 2)[:2]
+    if args.compile:
+        model = CompiledMASt3R(model)
+        # load_images(size=512) of every query and rendering
+        model.warmup([(384, 512)], precision=args.precision)
     log_path = f"./outputs/7scenes/GS_CPR_rel_{pe}_results/"
     if not os.path.exists(log_path):
         os.makedirs(log_path)
@@ -58,6 +78,7 @@ if __name__ == '__main__':
         rendered_path = f'./ACT_Scaffold_GS/data/7scenes/scene_{SCENE}/test/evaluate_{pe}/train_output/render_single_view/'
 
         predict_pose_w2c_path = f'./coarse_poses/{pe}/7Scenes_pgt/poses_pgt_7scenes_{SCENE}_.txt'
+        predict_pose_w2c_all = getPredictPoses(predict_pose_w2c_path)
         gt_pose_c2w_path = f'./datasets/pgt_7scenes_{SCENE}/test/poses/'
         gs_depth_path = rendered_path
 
@@ -74,14 +95,12 @@ if __name__ == '__main__':
             c2w_pose = np.loadtxt(pose_file_name)
             gt_pose_c2w_dict[img_name] = c2w_pose
             if pe == 'dfnet':
-                predict_w2c_ini= getPredictPos(img_name.replace('-frame','/frame'),predict_pose_w2c_path)
+                predict_w2c_ini= predict_pose_w2c_all[img_name.replace('-frame','/frame')]
             else:
-                predict_w2c_ini= getPredictPos(img_name.replace('/frame','_frame'),predict_pose_w2c_path)
+                predict_w2c_ini= predict_pose_w2c_all[img_name.replace('/frame','_frame')]
             predict_pose_w2c_dict[img_name] = predict_w2c_ini
             
         
-        results_ini = []
-        results_final = []
         
 
         refine_results_path = log_path +  "refine_predictions/" 
@@ -91,8 +110,14 @@ if __name__ == '__main__':
         else:
             print(f"Directory {refine_results_path} already exists.")
         ransac_time = 0
-        with open(refine_results_path + f'{pe}_refinew2c_mast3r_{SCENE}.txt', 'w') as f:
-            for image in tqdm(images_list):  
+        # the PairViewer runs keep the file names of the published GS-CPR_rel results
+        solver = 'mast3r' if args.pair_viewer else 'mast3r_knownK'
+        refine_txt_path = refine_results_path + f'{pe}_refinew2c_{solver}_{SCENE}.txt'
+        with ResultJournal(refine_txt_path.replace('.txt', '.jsonl'), resume=not args.overwrite) as journal:
+            for image in tqdm(images_list):
+                if image in journal:
+                    continue
+                t_start = time.time()
                 try: 
                     image1 = rendered_path + image
                     image2 = query_path + image
@@ -102,93 +127,60 @@ if __name__ == '__main__':
                     image2 = query_path + image
                     images = load_images([image1, image2], size=512)
 
-                pairs = make_pairs(images, scene_graph='complete', prefilter=None, symmetrize=True)
-                output = inference(pairs, model, device, batch_size=batch_size)
-                scene = global_aligner(output, device=device, mode=GlobalAlignerMode.PairViewer)
-                poses = scene.get_im_poses()
-                P_rel = poses[1].detach().cpu().numpy()
-                T_rel = P_rel[:3,3]
-                R_rel = P_rel[:3,:3]
-                array_to_check = np.array([0, 0, 0])
-                P_ini = np.eye(4)
-                if np.array_equal(array_to_check, T_rel):
-                    P_rel = np.linalg.inv(poses[0].detach().cpu().numpy())
+                if args.pair_viewer:
+                    pairs = make_pairs(images, scene_graph='complete', prefilter=None, symmetrize=True)
+                    output = inference(pairs, model, device, batch_size=batch_size, precision=args.precision)
+                    scene = global_aligner(output, device=device, mode=GlobalAlignerMode.PairViewer)
+                    poses = scene.get_im_poses()
+                    num_inliers = None
+                    t_match = time.time()
+                    P_rel = poses[1].detach().cpu().numpy()
+                    T_rel = P_rel[:3,3]
+                    R_rel = P_rel[:3,:3]
+                    array_to_check = np.array([0, 0, 0])
+                    P_ini = np.eye(4)
+                    if np.array_equal(array_to_check, T_rel):
+                        P_rel = invert_pose(poses[0].detach().cpu().numpy())
+                else:
+                    # single (rendering, query) forward, PnP with the known intrinsics
+                    output = inference([tuple(images)], model, device, batch_size=1, verbose=False, precision=args.precision)
+                    fx, cx, cy = QUERIES['7scenes']['focal_length'][SCENE], original_size[1]/2, original_size[0]/2
+                    K = np.array([[fx, 0, cx], [0, fx, cy], [0, 0, 1]])
+                    P_rel, num_inliers = solve_relative_pose(output, K, original_size, args.subsample, args.conf_thr)
+                    P_ini = np.eye(4)
+                    t_match = time.time()
                 try:
-                    depth_map = np.load(gs_depth_path+image.replace('png','npy').replace('-frame','/frame'))
+                    depth_map = load_depth(gs_depth_path+image.replace('png','npy').replace('-frame','/frame'))
                 except:
-                    depth_map = np.load(gs_depth_path+image.replace('png','npy'))
-                depth_map_mast3r = output["pred1"]["pts3d"][0, ..., 2].cpu().numpy()
-                depth_map_resized = cv2.resize(depth_map, (512, 384), interpolation=cv2.INTER_LINEAR)
-                scale_factor = getScale(depth_map_mast3r,depth_map_resized)
+                    depth_map = load_depth(gs_depth_path+image.replace('png','npy'))
+                if args.pair_viewer:
+                    depth_map_mast3r = output["pred1"]["pts3d"][0, ..., 2].cpu().numpy()
+                    depth_map_resized = cv2.resize(depth_map, (512, 384), interpolation=cv2.INTER_LINEAR)
+                    scale_factor = getScale(depth_map_mast3r,depth_map_resized)
+                else:
+                    scale_factor = relative_scale(output, depth_map, original_size, args.subsample, args.conf_thr)
                 predict_w2c_ini = predict_pose_w2c_dict[image]
                 gt_c2w_pose = gt_pose_c2w_dict[image]
                 predict_c2w_refine = P_rel.copy()
                 predict_c2w_refine[:3,3] = P_rel[:3,:3]@P_ini[:3,3] + scale_factor*P_rel[:3,3]
                 
-                ini_rot_error,ini_translation_error=cal_campose_error(np.linalg.inv(predict_w2c_ini), gt_c2w_pose)
-                results_ini.append([ini_rot_error,ini_translation_error])
+                t_scale = time.time()
+                ini_rot_error,ini_translation_error=cal_campose_error(invert_pose(predict_w2c_ini), gt_c2w_pose)
                 refine_rot_error,refine_translation_error=cal_campose_error(predict_c2w_refine, predict_w2c_ini@gt_c2w_pose)
-                results_final.append([refine_rot_error,refine_translation_error])
-                combined_list = [image.replace('_frame','/frame')] + rotmat2qvec(np.linalg.inv(predict_c2w_refine)[:3,:3]).tolist() + np.linalg.inv(predict_c2w_refine)[:3,3].tolist()
-                output_line = ' '.join(map(str, combined_list))
-                f.write(output_line + '\n')
-                    
+                predict_w2c_refine = invert_pose(predict_c2w_refine)
+                journal.append(image, rotmat2qvec(predict_w2c_refine[:3,:3]), predict_w2c_refine[:3,3],
+                               [ini_rot_error,ini_translation_error], [refine_rot_error,refine_translation_error], num_inliers=num_inliers,
+                               timings={'match': t_match - t_start, 'scale': t_scale - t_match, 'total': t_scale - t_start})
+            journal.export_txt(refine_txt_path, images_list)
+        # summary statistics are rebuilt from the journal, so resumed frames are included
+        results_ini, results_final = journal.errors(images_list)
         median_result_ini = np.median(results_ini,axis=0)
         mean_result_ini = np.mean(results_ini,axis=0)
 
         median_result = np.median(results_final,axis=0)
         mean_result = np.mean(results_final,axis=0)
-        pct10_5 = 0
-        pct5 = 0
-        pct2 = 0
-        pct1 = 0
-        for err in results_ini:
-            r_err = err[0]
-            t_err = err[1]
-            if r_err < 5 and t_err < 0.1:  # 10cm/5deg
-                pct10_5 += 1
-            if r_err < 5 and t_err < 0.05:  # 5cm/5deg
-                pct5 += 1
-            if r_err < 2 and t_err < 0.02:  # 2cm/2deg
-                pct2 += 1
-            if r_err < 1 and t_err < 0.01:  # 1cm/1deg
-                pct1 += 1
-        total_frames = len(results_ini)
-        pct10_5 = pct10_5 / total_frames * 100
-        pct5 = pct5 / total_frames * 100
-        pct2 = pct2 / total_frames * 100
-        pct1 = pct1 / total_frames * 100
-        _logger.info('Ini Accuracy:')
-        _logger.info(f'\t10cm/5deg: {pct10_5:.1f}%')
-        _logger.info(f'\t5cm/5deg: {pct5:.1f}%')
-        _logger.info(f'\t2cm/2deg: {pct2:.1f}%')
-        _logger.info(f'\t1cm/1deg: {pct1:.1f}%')
-
-        pct10_5 = 0
-        pct5 = 0
-        pct2 = 0
-        pct1 = 0
-        for err in results_final:
-            r_err = err[0]
-            t_err = err[1]
-            if r_err < 5 and t_err < 0.1:  # 10cm/5deg
-                pct10_5 += 1
-            if r_err < 5 and t_err < 0.05:  # 5cm/5deg
-                pct5 += 1
-            if r_err < 2 and t_err < 0.02:  # 2cm/2deg
-                pct2 += 1
-            if r_err < 1 and t_err < 0.01:  # 1cm/1deg
-                pct1 += 1
-        total_frames = len(results_final)
-        pct10_5 = pct10_5 / total_frames * 100
-        pct5 = pct5 / total_frames * 100
-        pct2 = pct2 / total_frames * 100
-        pct1 = pct1 / total_frames * 100
-        _logger.info('After refine Accuracy:')
-        _logger.info(f'\t10cm/5deg: {pct10_5:.1f}%')
-        _logger.info(f'\t5cm/5deg: {pct5:.1f}%')
-        _logger.info(f'\t2cm/2deg: {pct2:.1f}%')
-        _logger.info(f'\t1cm/1deg: {pct1:.1f}%')
+        log_accuracy(_logger, 'Ini', results_ini)
+        log_accuracy(_logger, 'After refine', results_final)
 
         # standard log
         _logger.info(f"--------------GS-CPR_rel for {pe}:{SCENE}--------------")
@@ -0,0 +1,87 @@
+import base64
+import json
+import time
+import urllib.error
+import urllib.request
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+
+import numpy as np
+
+from utils.evaluation import evaluate
+from utils.pose_utils import invert_pose, pose_error
+from utils.refine import QUERIES, load_queries
+
+
+def send(url, scene_id, query, timeout):
+    name, image_path, w2c, fx, _ = query
+    with open(image_path, 'rb') as f:
+        image = base64.b64encode(f.read()).decode()
+    body = json.dumps({'scene': scene_id, 'image': image, 'pose_w2c': np.asarray(w2c).tolist(),
+                       'intrinsics': {'fx': fx, 'fy': fx}}).encode()
+    request = urllib.request.Request(url + '/refine', data=body, headers={'Content-Type': 'application/json'})
+    t_start = time.time()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            result = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        result = {'error': e.read().decode()}
+    result['latency'] = time.time() - t_start
+    return result
+
+
+def percentiles(values):
+    values = np.asarray(values) * 1000
+    return {'p50': float(np.percentile(values, 50)), 'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)), 'mean': float(values.mean())}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Load generator for the GS-CPR refinement server (ACT_Scaffold_GS/refine_server.py)")
+    parser.add_argument("--url", default="http://127.0.0.1:8765", type=str)
+    parser.add_argument("--dataset", default="7scenes", choices=list(QUERIES), type=str)
+    parser.add_argument("--scenes", nargs='+', default=['chess'], help='queries of all scenes are interleaved')
+    parser.add_argument("--pose_estimator", default="ace", type=str)
+    parser.add_argument("--concurrency", default=4, type=int, help='requests in flight')
+    parser.add_argument("--num_requests", default=None, type=int, help='default is every test image')
+    parser.add_argument("--timeout", default=120, type=float)
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+
+    per_scene = [[(f"{args.dataset}/{scene}", q) for q in load_queries(args.dataset, scene, args.pose_estimator)] for scene in args.scenes]
+    # round robin over the scenes, so that the scene pool is exercised, until every scene is exhausted
+    requests = [item for group in zip_longest(*per_scene) for item in group if item is not None][:args.num_requests]
+
+    t_start = time.time()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(lambda item: send(args.url, item[0], item[1], args.timeout), requests))
+    elapsed = time.time() - t_start
+
+    ok = [(item, r) for item, r in zip(requests, results) if 'error' not in r]
+    for item, r in zip(requests, results):
+        if 'error' in r:
+            print(f"FAILED {item[0]}/{item[1][0]}: {r['error']}")
+    if len(ok) == 0:
+        raise SystemExit("No request succeeded")
+    gt_c2w = np.stack([q[4] for (_, q), _ in ok])
+    ini_errors = pose_error(invert_pose(np.stack([q[2] for (_, q), _ in ok])), gt_c2w)
+    refined_errors = pose_error(invert_pose(np.array([r['pose_w2c'] for _, r in ok])), gt_c2w)
+
+    report = {'requests': len(requests), 'failed': len(requests) - len(ok), 'concurrency': args.concurrency,
+              'elapsed': elapsed, 'throughput': len(ok) / elapsed,
+              'latency_ms': percentiles([r['latency'] for _, r in ok]),
+              'server_ms': {stage: percentiles([r['timings'][stage] for _, r in ok]) for stage in ok[0][1]['timings']},
+              'mean_batch_size': float(np.mean([r['batch_size'] for _, r in ok])),
+              'initial': evaluate(*ini_errors), 'refined': evaluate(*refined_errors)}
+    print(f"{len(ok)}/{len(requests)} requests in {elapsed:.1f}s: {report['throughput']:.2f} queries/s with {args.concurrency} in flight, "
+          f"mean MASt3R batch {report['mean_batch_size']:.2f}")
+    latency = report['latency_ms']
+    print(f"latency p50 {latency['p50']:.0f} ms, p90 {latency['p90']:.0f} ms, p99 {latency['p99']:.0f} ms")
+    print('server stages (mean ms): ' + ', '.join(f"{stage} {p['mean']:.0f}" for stage, p in report['server_ms'].items()))
+    for stage in ('initial', 'refined'):
+        row = report[stage]
+        print(f"{stage}: " + ', '.join(f"{k} {v:.4g}" if isinstance(v, float) else f"{k} {v}" for k, v in row.items()))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,117 @@
+# --------------------------------------------------------
+# Compiled fixed-shape MASt3R forward (torch.compile, CUDA graph of the batch-1 forward)
+# --------------------------------------------------------
+import os
+import warnings
+
+import torch
+import torch.nn as nn
+
+from mast3r.model import use_fast_rope
+import mast3r.utils.path_to_dust3r  # noqa
+from dust3r.inference import PRECISIONS  # noqa
+from dust3r.utils.misc import is_symmetrized  # noqa
+
+COMPILE_CACHE_DIR = './checkpoints/compile_cache'
+
+
+def compile_cache_path(cache_dir):
+    return os.path.join(cache_dir, f'mast3r_torch{torch.__version__}.bin')
+
+
+def load_compile_cache(cache_dir):
+    # torch >= 2.7, compiled artifacts of a previous run (any device / shape they were saved for)
+    path = compile_cache_path(cache_dir)
+    if hasattr(torch.compiler, 'load_cache_artifacts') and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            torch.compiler.load_cache_artifacts(f.read())
+
+
+def save_compile_cache(cache_dir):
+    artifacts = torch.compiler.save_cache_artifacts() if hasattr(torch.compiler, 'save_cache_artifacts') else None
+    if artifacts is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(compile_cache_path(cache_dir), 'wb') as f:
+            f.write(artifacts[0])
+
+
+class CompiledMASt3R(nn.Module):
+    """
+    MASt3R whose pair forward is compiled once per input shape, batch size and precision:
+      * encoder, decoder and heads in one graph with static shapes, the heads get the landscape (H, W) as python ints
+        instead of the true_shape tensor, and the blocks use FastRoPE2D instead of the cuRoPE2D kernel
+      * on CUDA, the batch-1 forward is captured in a CUDA graph (mode='reduce-overhead') and replayed
+      * symmetrized batches and portrait or mismatched images run the eager model
+    The compiled artifacts are loaded from / saved to cache_dir (see warmup), so that a new run skips the kernel
+    compilation, the graph is still traced. When compiling fails (e.g. no C++ compiler for the CPU backend), it falls
+    back to the eager model.
+    """
+
+    def __init__(self, net, cache_dir=COMPILE_CACHE_DIR):
+        super().__init__()
+        self.net = net
+        use_fast_rope(net)
+        self.cache_dir = cache_dir
+        self.enabled = True
+        self.compiled = torch.compile(self._static_forward, dynamic=False)
+        self.graphed = torch.compile(self._static_forward, dynamic=False, mode='reduce-overhead')
+        load_compile_cache(cache_dir)
+
+    @property
+    def head_precision(self):
+        return self.net.head_precision
+
+    @head_precision.setter
+    def head_precision(self, head_precision):
+        self.net.head_precision = head_precision
+
+    def _static_forward(self, img1, img2):
+        B, _, H, W = img1.shape
+        shape = torch.tensor([[H, W]], device=img1.device).expand(B, 2)  # only read by ManyAR_PatchEmbed
+        feat1, feat2, pos1, pos2 = self.net._encode_image_pairs(img1, img2, shape, shape)
+        dec1, dec2 = self.net._decoder(feat1, pos1, feat2, pos2)
+        res1 = self.net._head_forward(1, dec1, (H, W))
+        res2 = self.net._head_forward(2, dec2, (H, W))
+        res2['pts3d_in_other_view'] = res2.pop('pts3d')  # predict view2's pts3d in view1's frame
+        return res1, res2
+
+    def _is_static(self, view1, view2):
+        B, _, H, W = view1['img'].shape
+        if not self.enabled or view2['img'].shape != view1['img'].shape or H > W:
+            return False
+        if 'instance' in view1 and is_symmetrized(view1, view2):
+            return False
+        return all((view['true_shape'].cpu() == torch.tensor([H, W])).all() for view in (view1, view2) if 'true_shape' in view)
+
+    def forward(self, view1, view2):
+        if not self._is_static(view1, view2):
+            return self.net(view1, view2)
+        img1, img2 = view1['img'], view2['img']
+        graphed = img1.device.type == 'cuda' and img1.shape[0] == 1
+        try:
+            res1, res2 = (self.graphed if graphed else self.compiled)(img1, img2)
+        except torch._dynamo.exc.BackendCompilerFailed as e:
+            warnings.warn(f'compiling MASt3R failed, running the eager model instead: {e}')
+            self.enabled = False
+            return self.net(view1, view2)
+        if graphed:
+            # the outputs of a CUDA graph are overwritten by its next replay
+            res1, res2 = ({key: value.clone() for key, value in res.items()} for res in (res1, res2))
+        return res1, res2
+
+    @torch.no_grad()
+    def warmup(self, image_sizes, batch_size=1, precision='fp32'):
+        """
+        Compile (or load from the cache) the forward of every (H, W) in image_sizes for batches of batch_size pairs
+        in `precision`, as dust3r.inference.inference will call it, then save the compiled artifacts to the cache.
+        """
+        device = next(self.net.parameters()).device
+        for H, W in image_sizes:
+            view1, view2 = (dict(img=torch.zeros(batch_size, 3, H, W, device=device), true_shape=torch.tensor([[H, W]] * batch_size),
+                                 instance=[f'{i}_{v}' for i in range(batch_size)]) for v in (1, 2))
+            with torch.autocast(device.type, dtype=PRECISIONS[precision] or torch.float16, enabled=precision != 'fp32'):
+                # CUDA graphs are recorded on the first calls after compilation
+                for _ in range(3 if device.type == 'cuda' else 1):
+                    self(view1, view2)
+        if self.enabled:
+            save_compile_cache(self.cache_dir)
@@ -137,6 +137,12 @@ def fast_reciprocal_NNs(pts1, pts2, subsample_or_initxy1=8, ret_xy=True, pixel_t
         pts2 = pts2.to(device)
         tree1 = cdistMatcher(pts1, device=device)
         tree2 = cdistMatcher(pts2, device=device)
+    elif matcher_kw:
+        # brute force options (dist, block_size) that KDTree does not take: same matcher on the CPU, in float32
+        pts1 = pts1.float().to(device)
+        pts2 = pts2.float().to(device)
+        tree1 = cdistMatcher(pts1, device=device)
+        tree2 = cdistMatcher(pts2, device=device)
     else:
         pts1, pts2 = to_numpy((pts1, pts2))
         tree1 = KDTree(pts1)
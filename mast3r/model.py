@@ -7,12 +7,14 @@
 import torch
 import torch.nn.functional as F
 import os
+import zipfile
 
 from mast3r.catmlp_dpt_head import mast3r_head_factory
 
 import mast3r.utils.path_to_dust3r  # noqa
 from dust3r.model import AsymmetricCroCo3DStereo  # noqa
 from dust3r.utils.misc import transpose_to_landscape  # noqa
+from models.pos_embed import FastRoPE2D  # noqa
 
 
 inf = float('inf')
@@ -21,7 +23,16 @@ inf = float('inf')
 def load_model(model_path, device, verbose=True):
     if verbose:
         print('... loading model from', model_path)
-    ckpt = torch.load(model_path, map_location='cpu')
+    # memory-mapped when the checkpoint is a zip archive, the weights are read from the file on first use
+    ckpt = torch.load(model_path, map_location='cpu', weights_only=False, mmap=zipfile.is_zipfile(model_path))
+    if 'packed' in ckpt:
+        # written by pack_mast3r.py
+        from mast3r.packing import load_packed
+        return load_packed(ckpt, device, verbose=verbose)
+    if 'quantization' in ckpt:
+        # int8 artifact written by quantize_mast3r.py
+        from mast3r.quantization import load_quantized
+        return load_quantized(ckpt, verbose=verbose).to(device)
     args = ckpt['args'].model.replace("ManyAR_PatchEmbed", "PatchEmbedDust3R")
     if 'landscape_only' not in args:
         args = args[:-1] + ', landscape_only=False)'
@@ -37,6 +48,27 @@ def load_model(model_path, device, verbose=True):
     return net.to(device)
 
 
+def model_config(net):
+    """Constructor arguments of a MASt3R network, to build it again without its original checkpoint."""
+    return dict(net.croco_args, output_mode=net.output_mode, head_type=net.head_type, depth_mode=net.depth_mode,
+                conf_mode=net.conf_mode, landscape_only=net.head1.__name__ == 'wrapper_yes', patch_embed_cls=net.patch_embed_cls,
+                desc_mode=net.desc_mode, two_confs=net.two_confs, desc_conf_mode=net.desc_conf_mode)
+
+
+def use_fast_rope(net):
+    """
+    Replace the rope of every block of `net` by a FastRoPE2D, made of standard ops that export to ONNX and compile,
+    unlike the cuRoPE2D kernel. Returns the replaced ropes by module name, to restore them.
+    """
+    ropes = {name: module.rope for name, module in net.named_modules() if getattr(module, 'rope', None) is not None}
+    # one FastRoPE2D per original rope, the blocks share the rope of the network
+    fast_ropes = {id(rope): FastRoPE2D(freq=rope.base, F0=rope.F0) for rope in ropes.values()}
+    for name, module in net.named_modules():
+        if name in ropes:
+            module.rope = fast_ropes[id(ropes[name])]
+    return ropes
+
+
 class AsymmetricMASt3R(AsymmetricCroCo3DStereo):
     def __init__(self, desc_mode=('norm'), two_confs=False, desc_conf_mode=None, **kwargs):
         self.desc_mode = desc_mode
@@ -46,6 +78,10 @@ class AsymmetricMASt3R(AsymmetricCroCo3DStereo):
 
     @classmethod
     def from_pretrained(cls, pretrained_model_name_or_path, **kw):
+        if os.path.isfile(pretrained_model_name_or_path) and pretrained_model_name_or_path.endswith('.onnx'):
+            # exported by export_onnx.py, run with ONNX Runtime
+            from mast3r.onnx_model import OnnxMASt3R
+            return OnnxMASt3R(pretrained_model_name_or_path, **kw)
         if os.path.isfile(pretrained_model_name_or_path):
             return load_model(pretrained_model_name_or_path, device='cpu')
         else:
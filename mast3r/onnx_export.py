@@ -0,0 +1,86 @@
+# --------------------------------------------------------
+# ONNX export of the MASt3R pair model (encoder, decoder and both heads)
+# --------------------------------------------------------
+import contextlib
+
+import torch
+import torch.nn as nn
+
+from mast3r.model import use_fast_rope
+import mast3r.utils.path_to_dust3r  # noqa
+import dust3r.utils.path_to_croco  # noqa: F401
+import models.blocks as croco_blocks  # noqa
+
+# (H, W) of the images fed to MASt3R by the refinement scripts, load_images(size=512); 968x1296 12Scenes frames are
+# resized to 382x512 and cropped to a multiple of 16
+EXPORT_SHAPES = {'7scenes': (384, 512), '12scenes': (368, 512), 'cambridge': (288, 512)}
+OPSET_VERSION = 17
+
+
+def _expm1_symbolic(g, x):
+    # exp(x) - 1, for the depth of the pts3d postprocess; ONNX has no expm1
+    return g.op('Sub', g.op('Exp', x), g.op('Constant', value_t=torch.tensor(1.0)))
+
+
+class ExportableMASt3R(nn.Module):
+    """ AsymmetricMASt3R on two image tensors, with its two prediction dicts flattened to a tuple of outputs """
+
+    def __init__(self, net, output_keys):
+        super().__init__()
+        self.net = net
+        self.output_keys = output_keys  # [(1 or 2, key)] in output order
+
+    def forward(self, img1, img2):
+        B = img1.shape[0]
+        # distinct instances, the pair is never taken for a symmetrized batch
+        pred1, pred2 = self.net(dict(img=img1, instance=[f'{i}_1' for i in range(B)]),
+                                dict(img=img2, instance=[f'{i}_2' for i in range(B)]))
+        preds = {1: pred1, 2: pred2}
+        return tuple(preds[view][key] for view, key in self.output_keys)
+
+
+def output_name(view, key):
+    return f'pred{view}.{key}'
+
+
+@contextlib.contextmanager
+def exportable(net):
+    """
+    Temporarily switch `net` to ops that export to ONNX: the reference attention, whose matmul / softmax pattern
+    ONNX Runtime fuses, and the pytorch RoPE2D instead of the cuRoPE2D kernel.
+    """
+    backend = croco_blocks._attention_backend
+    croco_blocks.set_attention_backend('math')
+    ropes = use_fast_rope(net)
+    try:
+        yield net
+    finally:
+        croco_blocks.set_attention_backend(backend)
+        for name, module in net.named_modules():
+            if name in ropes:
+                module.rope = ropes[name]
+
+
+@torch.no_grad()
+def export_onnx(net, path, image_size, batch_size=1, dynamic_batch=True, opset_version=OPSET_VERSION, verbose=True):
+    """
+    Trace `net` on pairs of `image_size` (H, W) images to the ONNX file `path`. The image size is fixed in the graph,
+    the batch dimension stays dynamic unless dynamic_batch=False. The float32 model is exported, on the CPU.
+    Outputs are named pred1.<key> / pred2.<key> after the keys of the prediction dicts of the model.
+    """
+    net = net.cpu().float().eval()
+    torch.onnx.register_custom_op_symbolic('aten::expm1', _expm1_symbolic, opset_version)
+    H, W = image_size
+    img1 = torch.randn(batch_size, 3, H, W)
+    img2 = torch.randn(batch_size, 3, H, W)
+    with exportable(net):
+        pred1, pred2 = net(dict(img=img1, instance=['0_1']), dict(img=img2, instance=['0_2']))
+        output_keys = [(1, key) for key in pred1] + [(2, key) for key in pred2]
+        output_names = [output_name(view, key) for view, key in output_keys]
+        dynamic_axes = {name: {0: 'batch'} for name in ['img1', 'img2'] + output_names} if dynamic_batch else None
+        torch.onnx.export(ExportableMASt3R(net, output_keys), (img1, img2), path, input_names=['img1', 'img2'],
+                          output_names=output_names, dynamic_axes=dynamic_axes, opset_version=opset_version, dynamo=False)
+    if verbose:
+        print(f'exported {path}: {H}x{W} images, outputs {", ".join(output_names)}')
+    return output_names
+
@@ -0,0 +1,60 @@
+# --------------------------------------------------------
+# ONNX Runtime execution of the MASt3R pair model exported by export_onnx.py
+# --------------------------------------------------------
+import os
+
+import numpy as np
+import onnxruntime as ort
+
+
+class OnnxMASt3R(object):
+    """
+    ONNX Runtime session of an exported MASt3R, a drop-in for AsymmetricMASt3R in dust3r.inference.inference and
+    the refinement scripts: AsymmetricMASt3R.from_pretrained(<model.onnx>) returns one.
+      * float32, on pairs of images of the exported size only; the batch size is free
+      * threads: intra-op threads of the session, default MAST3R_ORT_THREADS or the ONNX Runtime default (all cores)
+    run() works on numpy arrays and does not need torch.
+    """
+    head_precision = ('fp32', 'fp32')  # the exported heads always run in float32
+
+    def __init__(self, path, threads=None, providers=('CPUExecutionProvider',)):
+        self.path = path
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = threads or int(os.environ.get('MAST3R_ORT_THREADS', 0))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=list(providers))
+        self.image_size = tuple(self.session.get_inputs()[0].shape[-2:])
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.device = 'cpu'
+
+    def to(self, device):
+        # the session stays where its providers run, only the outputs of __call__ are moved to device
+        self.device = device
+        return self
+
+    def cpu(self):
+        return self.to('cpu')
+
+    def eval(self):
+        return self
+
+    def run(self, img1, img2):
+        """ img1, img2: B x 3 x H x W float arrays -> (pred1, pred2) dicts of numpy arrays """
+        for img in (img1, img2):
+            if tuple(img.shape[-2:]) != self.image_size:
+                raise ValueError(f'{self.path} was exported for {self.image_size[0]}x{self.image_size[1]} images, '
+                                 f'got {img.shape[-2]}x{img.shape[-1]}; export it for this size with export_onnx.py')
+        outputs = self.session.run(self.output_names, {'img1': np.ascontiguousarray(img1, dtype=np.float32),
+                                                       'img2': np.ascontiguousarray(img2, dtype=np.float32)})
+        preds = ({}, {})
+        for name, value in zip(self.output_names, outputs):
+            view, key = name.split('.', 1)  # pred1.<key> / pred2.<key>
+            preds[view == 'pred2'][key] = value
+        return preds
+
+    def __call__(self, view1, view2):
+        import torch  # only the dust3r inference path works on tensors
+        pred1, pred2 = self.run(view1['img'].detach().float().cpu().numpy(), view2['img'].detach().float().cpu().numpy())
+        return tuple({key: torch.from_numpy(value).to(self.device) for key, value in pred.items()} for pred in (pred1, pred2))
@@ -0,0 +1,37 @@
+# --------------------------------------------------------
+# Pre-packed MASt3R checkpoints: model config + weights, memory-mapped at load time
+# --------------------------------------------------------
+import torch
+import torch.nn as nn
+
+from mast3r.model import AsymmetricMASt3R, model_config
+
+
+def pack_model(net, path):
+    """
+    Save the constructor arguments and the weights of `net` in one torch zip archive. No pickled classes, so that it
+    loads with weights_only=True, and every tensor is stored contiguous so that it can be memory-mapped.
+    """
+    state_dict = {key: value.detach().cpu().contiguous() for key, value in net.state_dict().items()}
+    # norm_layer is the croco default partial(nn.LayerNorm, eps=1e-6), which weights_only cannot load
+    config = {key: value for key, value in model_config(net).items() if key != 'norm_layer'}
+    torch.save({'packed': {'torch': str(torch.__version__)}, 'config': config, 'model': state_dict}, path)
+
+
+def load_packed(ckpt, device='cpu', verbose=True):
+    """
+    Build the network on the meta device, without allocating or initializing its weights, then assign the tensors of
+    the checkpoint to it. With a path (or a checkpoint loaded with mmap=True), the weights stay backed by the
+    file until they are moved to `device`, so the host never holds a second copy of the model.
+    """
+    if isinstance(ckpt, str):
+        ckpt = torch.load(ckpt, map_location='cpu', mmap=True, weights_only=True)
+    if verbose:
+        print(f"instantiating : AsymmetricMASt3R({', '.join(f'{k}={v!r}' for k, v in ckpt['config'].items())}) on meta")
+    with torch.device('meta'):
+        net = AsymmetricMASt3R(**ckpt['config'])
+    # not the dust3r override, the packed weights always hold dec_blocks2
+    s = nn.Module.load_state_dict(net, ckpt['model'], assign=True)
+    if verbose:
+        print(s)
+    return net.eval().to(device)
@@ -0,0 +1,44 @@
+# --------------------------------------------------------
+# Int8 dynamic quantization of MASt3R for CPU inference
+# --------------------------------------------------------
+import torch
+import torch.nn as nn
+from torch.ao.quantization import per_channel_dynamic_qconfig, quantize_dynamic
+
+from mast3r.model import AsymmetricMASt3R, model_config
+
+# Linear layers of the encoder and the decoders (qkv, proj, Mlp, cross attention), which dominate the CPU runtime
+BACKBONE_PREFIXES = ('enc_blocks.', 'decoder_embed', 'dec_blocks.', 'dec_blocks2.')
+HEAD_PREFIXES = ('downstream_head1.', 'downstream_head2.')
+
+
+def quantizable_layers(net, heads=False):
+    prefixes = BACKBONE_PREFIXES + (HEAD_PREFIXES if heads else ())
+    return [name for name, module in net.named_modules() if isinstance(module, nn.Linear) and name.startswith(prefixes)]
+
+
+def quantize_int8(net, layers, inplace=False):
+    """
+    Dynamic int8 quantization of the Linear `layers` of `net`: int8 weights with one scale per output channel,
+    activations quantized on the fly per batch. The quantized layers only run on the CPU.
+    """
+    return quantize_dynamic(net.cpu().eval(), {name: per_channel_dynamic_qconfig for name in layers}, dtype=torch.qint8,
+                            inplace=inplace)
+
+
+def save_quantized(net, layers, path):
+    torch.save({'quantization': {'dtype': 'qint8', 'qscheme': 'per_channel_affine', 'layers': layers},
+                'config': model_config(net), 'model': net.state_dict()}, path)
+
+
+def load_quantized(ckpt, verbose=True):
+    if isinstance(ckpt, str):
+        ckpt = torch.load(ckpt, map_location='cpu', weights_only=False)
+    if verbose:
+        print(f"instantiating : AsymmetricMASt3R with {len(ckpt['quantization']['layers'])} int8 Linear layers")
+    net = quantize_int8(AsymmetricMASt3R(**ckpt['config']).eval(), ckpt['quantization']['layers'], inplace=True)
+    # not the dust3r override, its copy of the state dict drops the _metadata versions the quantized layers need
+    s = nn.Module.load_state_dict(net, ckpt['model'])
+    if verbose:
+        print(s)
+    return net
@@ -0,0 +1,30 @@
+import os
+import resource
+import time
+from argparse import ArgumentParser
+
+from mast3r.model import AsymmetricMASt3R
+from mast3r.packing import pack_model
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Pack MASt3R into a local checkpoint that loads offline, memory-mapped "
+                                        "(load the output with AsymmetricMASt3R.from_pretrained(<output>))")
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str, help='model name or local checkpoint')
+    parser.add_argument("--output", default="./checkpoints/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric_packed.pth", type=str)
+    args = parser.parse_args()
+
+    t_start = time.time()
+    model = AsymmetricMASt3R.from_pretrained(args.model).cpu().eval()
+    print(f"{args.model} loaded in {time.time() - t_start:.1f}s")
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    pack_model(model, args.output)
+    print(f"saved {args.output} ({os.path.getsize(args.output) / 1024 ** 2:.0f} MB)")
+    del model
+
+    # the page cache is warm now, this is the time of a warm start on this machine
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t_start = time.time()
+    model = AsymmetricMASt3R.from_pretrained(args.output)
+    print(f"{args.output} loaded in {time.time() - t_start:.1f}s, "
+          f"peak resident memory {rss / 1024:.0f} MB -> {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
@@ -0,0 +1,36 @@
+import os
+import time
+from argparse import ArgumentParser
+
+import torch
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+
+from mast3r.model import AsymmetricMASt3R
+from mast3r.quantization import quantizable_layers, quantize_int8, save_quantized
+
+
+def model_bytes(net):
+    # float parameters and buffers, plus the int8 weights packed inside the quantized Linear layers
+    packed = [m for m in net.modules() if isinstance(m, DynamicQuantizedLinear)]
+    return sum(t.numel() * t.element_size() for t in net.state_dict().values() if isinstance(t, torch.Tensor)) + \
+        sum(m.weight().numel() * m.weight().element_size() + (m.bias().numel() * 4 if m.bias() is not None else 0) for m in packed)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Int8 dynamic quantization of MASt3R for CPU refinement "
+                                        "(load the output with AsymmetricMASt3R.from_pretrained(<output>))")
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str, help='model name or local checkpoint')
+    parser.add_argument("--output", default="./checkpoints/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric_int8.pth", type=str)
+    parser.add_argument("--quantize_heads", action='store_true', default=False, help='also quantize the Linear layers of the heads')
+    args = parser.parse_args()
+
+    model = AsymmetricMASt3R.from_pretrained(args.model).cpu().eval()
+    fp32_bytes = model_bytes(model)
+    layers = quantizable_layers(model, heads=args.quantize_heads)
+    t_start = time.time()
+    model = quantize_int8(model, layers, inplace=True)
+    print(f"{len(layers)} Linear layers quantized in {time.time() - t_start:.1f}s, "
+          f"{fp32_bytes / 1024 ** 2:.0f} MB -> {model_bytes(model) / 1024 ** 2:.0f} MB of weights")
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    save_quantized(model, layers, args.output)
+    print(f"saved {args.output} ({os.path.getsize(args.output) / 1024 ** 2:.0f} MB)")
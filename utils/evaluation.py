@@ -0,0 +1,230 @@
+import csv
+import json
+import os
+import re
+
+import numpy as np
+
+from utils.pose_utils import load_pose_file, qvec_tvec_to_pose, invert_pose, compose_poses, pose_error
+
+# (name, translation threshold in meters, rotation threshold in degrees)
+DEFAULT_THRESHOLDS = [('10cm/5deg', 0.1, 5), ('5cm/5deg', 0.05, 5), ('2cm/2deg', 0.02, 2), ('1cm/1deg', 0.01, 1)]
+
+# where the refinement scripts read their inputs from and write their outputs to
+DATASETS = {
+    '7scenes': {
+        'scenes': ['chess', 'fire', 'heads', 'office', 'pumpkin', 'redkitchen', 'stairs'],
+        'gt_path': './datasets/pgt_7scenes_{scene}/test/poses/',
+        'gt_suffix': ('.color.png', '.pose.txt'),
+        'coarse_path': './coarse_poses/{pe}/7Scenes_pgt/poses_pgt_7scenes_{scene}_.txt',
+        'log_path': './outputs/7scenes/',
+    },
+    '12scenes': {
+        'scenes': ['apt1_kitchen', 'apt1_living', 'apt2_bed', 'apt2_kitchen', 'apt2_living', 'apt2_luke',
+                   'office1_gates362', 'office1_gates381', 'office1_lounge', 'office1_manolis', 'office2_5a', 'office2_5b'],
+        'gt_path': './datasets/pgt_12scenes_{scene}/test/poses/',
+        'gt_suffix': ('.color.jpg', '.pose.txt'),
+        'coarse_path': './coarse_poses/{pe}/12Scenes_pgt/poses_pgt_12scenes_{scene}_.txt',
+        'log_path': './outputs/12scenes/',
+    },
+    'cambridge': {
+        'scenes': ['KingsCollege', 'ShopFacade', 'OldHospital', 'StMarysChurch'],
+        'gt_path': './datasets/Cambridge_{scene}/test/poses/',
+        'gt_suffix': ('.png', '.txt'),
+        'coarse_path': './coarse_poses/{pe}/Cambridge/poses_Cambridge_{scene}_.txt',
+        'log_path': './outputs/cambridge/',
+    },
+}
+
+
+def parse_threshold(text):
+    # '10cm/5deg', '0.25m/2deg' -> ('10cm/5deg', 0.1, 5.0)
+    match = re.fullmatch(r'\s*([\d.]+)(cm|m)\s*/\s*([\d.]+)deg\s*', text)
+    if match is None:
+        raise ValueError(f"Invalid threshold '{text}', expected e.g. '5cm/5deg' or '0.5m/2deg'")
+    t_th = float(match.group(1)) * (0.01 if match.group(2) == 'cm' else 1.0)
+    return (text.strip(), t_th, float(match.group(3)))
+
+
+def parse_thresholds(text):
+    return [parse_threshold(t) for t in text.split(',')]
+
+
+def evaluate(rot_errors, trans_errors, thresholds=DEFAULT_THRESHOLDS):
+    # statistics of a single set of errors, see evaluate_groups for many at once
+    return evaluate_groups([{}], [rot_errors], [trans_errors], thresholds)[0]
+
+
+def evaluate_groups(keys, rot_errors, trans_errors, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Statistics for many groups of errors (scenes x estimators x datasets x stages) in one pass.
+    keys: one dict per group which is copied into the resulting row
+    rot_errors/trans_errors: one 1D array per group, in degrees and meters
+    """
+    lengths = np.array([len(r) for r in rot_errors])
+    rows = [dict(key, num_frames=int(n)) for key, n in zip(keys, lengths)]
+    non_empty = lengths > 0
+    if not non_empty.any():
+        return rows
+    lengths = lengths[non_empty]
+    rot = np.concatenate([np.asarray(r, dtype=np.float64) for r in rot_errors])
+    trans = np.concatenate([np.asarray(t, dtype=np.float64) for t in trans_errors])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    group = np.repeat(np.arange(len(lengths)), lengths)
+
+    t_th = np.array([t[1] for t in thresholds])
+    r_th = np.array([t[2] for t in thresholds])
+    hits = (rot[:, None] < r_th[None]) & (trans[:, None] < t_th[None])  # (N, T)
+    pct = np.add.reduceat(hits.astype(np.float64), starts, axis=0) / lengths[:, None] * 100
+
+    mean_rot = np.add.reduceat(rot, starts) / lengths
+    mean_trans = np.add.reduceat(trans, starts) / lengths
+
+    # sort inside each group, the median is then read at the middle of each segment
+    lo = starts + (lengths - 1) // 2
+    hi = starts + lengths // 2
+    rot_sorted = rot[np.lexsort((rot, group))]
+    trans_sorted = trans[np.lexsort((trans, group))]
+    median_rot = (rot_sorted[lo] + rot_sorted[hi]) / 2
+    median_trans = (trans_sorted[lo] + trans_sorted[hi]) / 2
+
+    for i, row in enumerate(r for r, keep in zip(rows, non_empty) if keep):
+        for (name, _, _), p in zip(thresholds, pct[i]):
+            row[name] = float(p)
+        row['median_trans'] = float(median_trans[i])
+        row['median_rot'] = float(median_rot[i])
+        row['mean_trans'] = float(mean_trans[i])
+        row['mean_rot'] = float(mean_rot[i])
+    return rows
+
+
+def average_over_scenes(rows, thresholds=DEFAULT_THRESHOLDS, group_by=('dataset', 'estimator', 'method', 'stage')):
+    # per-dataset summary rows, as usually reported: every metric averaged over the scenes
+    metrics = [t[0] for t in thresholds] + ['median_trans', 'median_rot', 'mean_trans', 'mean_rot']
+    groups = {}
+    for row in rows:
+        if row['num_frames'] == 0:
+            continue
+        groups.setdefault(tuple(row.get(k) for k in group_by), []).append(row)
+    averaged = []
+    for key, members in groups.items():
+        values = np.array([[m[name] for name in metrics] for m in members])
+        row = dict(zip(group_by, key), scene='average', num_frames=int(sum(m['num_frames'] for m in members)))
+        row.update(zip(metrics, values.mean(axis=0).tolist()))
+        averaged.append(row)
+    return averaged
+
+
+def log_accuracy(logger, title, results, thresholds=DEFAULT_THRESHOLDS):
+    # results: (N, 2) of [rot_error, translation_error] as accumulated by the refinement scripts
+    results = np.asarray(results).reshape(-1, 2)
+    stats = evaluate(results[:, 0], results[:, 1], thresholds)
+    logger.info(f'{title} Accuracy:')
+    for name, _, _ in thresholds:
+        logger.info(f'\t{name}: {stats.get(name, 0.0):.1f}%')
+    return stats
+
+
+def save_csv(rows, path):
+    columns = []
+    for row in rows:
+        columns += [k for k in row if k not in columns]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def save_json(rows, path):
+    with open(path, 'w') as f:
+        json.dump(rows, f, indent=2)
+
+
+def comparison_table(rows, thresholds=DEFAULT_THRESHOLDS):
+    # one line per (dataset, method, estimator, scene), 'initial -> refined' in each metric column
+    stages = {}
+    for row in rows:
+        key = (row.get('dataset'), row.get('method'), row.get('estimator'), row.get('scene'))
+        stages.setdefault(key, {})[row.get('stage')] = row
+    header = ['dataset', 'method', 'estimator', 'scene'] + [t[0] for t in thresholds] + ['median (cm/deg)']
+    lines = []
+    for key, by_stage in stages.items():
+        ini, ref = by_stage.get('initial', {}), by_stage.get('refined', {})
+        cells = [str(k) for k in key]
+        for name, _, _ in thresholds:
+            cells.append(f"{_fmt(ini.get(name), '.1f')} -> {_fmt(ref.get(name), '.1f')}")
+        cells.append(f"{_fmt_median(ini)} -> {_fmt_median(ref)}")
+        lines.append(cells)
+    widths = [max(len(c) for c in column) for column in zip(header, *lines)]
+    out = [' | '.join(h.ljust(w) for h, w in zip(header, widths)),
+           '-+-'.join('-' * w for w in widths)]
+    out += [' | '.join(c.ljust(w) for c, w in zip(cells, widths)) for cells in lines]
+    return '\n'.join(out)
+
+
+def _fmt(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def _fmt_median(row):
+    if 'median_trans' not in row:
+        return '-'
+    return f"{row['median_trans'] * 100:.1f}/{row['median_rot']:.2f}"
+
+
+def _frame_key(name):
+    # coarse pose files, query folders and refined outputs spell the sequence separator differently
+    return name.replace('/frame', '_frame').replace('-frame', '_frame')
+
+
+def load_gt_c2w(names, gt_path, gt_suffix):
+    poses = np.empty((len(names), 4, 4))
+    for i, name in enumerate(names):
+        poses[i] = np.loadtxt(gt_path + name.replace(gt_suffix[0], gt_suffix[1]).replace('/frame', '_frame'))
+    return poses
+
+
+def w2c_from_file(path):
+    names, qvecs, tvecs = load_pose_file(path)
+    return names, qvec_tvec_to_pose(qvecs, tvecs)
+
+
+def evaluate_prediction_file(refined_path, coarse_path, gt_path, gt_suffix, relative=False):
+    """
+    Re-evaluate a `refine_predictions/*.txt` file against the ground truth without re-running refinement.
+    Returns the (rot, trans) errors of the coarse and the refined poses, in the order of the refined file.
+    For GS-CPR_rel outputs the refined poses are relative to the coarse ones, as in gs_cpr_*_rel.py.
+    """
+    names, w2c_refined = w2c_from_file(refined_path)
+    coarse_names, w2c_coarse = w2c_from_file(coarse_path)
+    coarse_index = {_frame_key(n): i for i, n in enumerate(coarse_names)}
+    w2c_ini = w2c_coarse[[coarse_index[_frame_key(n)] for n in names]]
+    gt_c2w = load_gt_c2w(names, gt_path, gt_suffix)
+
+    c2w_ini = invert_pose(w2c_ini)
+    c2w_refined = invert_pose(w2c_refined)
+    ini_errors = pose_error(c2w_ini, gt_c2w)
+    if relative:
+        refined_errors = pose_error(c2w_refined, compose_poses(w2c_ini, gt_c2w))
+    else:
+        refined_errors = pose_error(c2w_refined, gt_c2w)
+    return names, ini_errors, refined_errors
+
+
+def collect_runs(datasets, estimators, methods=('GS_CPR',), scenes=None, matcher='mast3r'):
+    # all existing refine_predictions files for the requested combinations
+    runs = []
+    for dataset in datasets:
+        config = DATASETS[dataset]
+        for method in methods:
+            for pe in estimators:
+                for scene in (scenes or config['scenes']):
+                    refined_path = os.path.join(config['log_path'], f'{method}_{pe}_results', 'refine_predictions',
+                                                f'{pe}_refinew2c_{matcher}_{scene}.txt')
+                    if os.path.exists(refined_path):
+                        runs.append({'dataset': dataset, 'method': method, 'estimator': pe, 'scene': scene,
+                                     'refined_path': refined_path,
+                                     'coarse_path': config['coarse_path'].format(pe=pe, scene=scene),
+                                     'gt_path': config['gt_path'].format(scene=scene),
+                                     'gt_suffix': config['gt_suffix']})
+    return runs
@@ -2,6 +2,8 @@ import numpy as np
 import math
 import cv2
 
+from utils.pose_utils import load_pose_file, qvec2rotmat, rotmat2qvec, qvec_tvec_to_pose, rotation_error, translation_error, pose_error
+
 def perform_rodrigues_transformation(rvec):
     try:
         R, _ = cv2.Rodrigues(rvec)
@@ -9,87 +11,26 @@ def perform_rodrigues_transformation(rvec):
     except cv2.error as e:
         return False
     
+def getPredictPoses(pred_file):
+    # all w2c poses of a prediction file, converted in one batch: {image name: (4,4) w2c}
+    names, qvecs, tvecs = load_pose_file(pred_file)
+    w2c_predict = qvec_tvec_to_pose(qvecs, tvecs)
+    return dict(zip(names, w2c_predict))
+
 def getPredictPos(img_name,pred_file):
-    text = []
-    with open(pred_file) as f:
-        for line in f.readlines():
-            data = line.split('/t/n')
-            for str in data:
-                sub_str = str.split(' ')
-                text.append(sub_str)
-    num_database = len(text)
-    #print(text)
-    for i in range(num_database):
-        if img_name in text[i]:
-            trans_predict = [0,0,0]
-            ori_predict = [0,0,0,0]
-            for j in range(4):
-                ori_predict[j] = float(text[i][j+1])
-            for k in range(3):
-                trans_predict[k] = float(text[i][k+5])
-    trans_predict = np.array(trans_predict)
-    ori_predict = np.array(ori_predict)
-    Rot = qvec2rotmat(ori_predict)
-    w2c_predict = np.eye(4)
-    w2c_predict[:3,:3] = Rot
-    w2c_predict[:3,3] = trans_predict
-    return w2c_predict
+    # prefer getPredictPoses when looking up many images, this re-reads the file on every call
+    return getPredictPoses(pred_file)[img_name]
 
 def cal_rot_error(cur_R,obs_R):
-    r_err = np.matmul(cur_R, np.transpose(obs_R))
-    r_err = cv2.Rodrigues(r_err)[0]
-    # Extract the angle.
-    r_err = np.linalg.norm(r_err) * 180 / math.pi
-    return r_err
+    return rotation_error(cur_R, obs_R)
 
 def cal_tran_error(cur_T,obs_T):
-    return np.linalg.norm(cur_T-obs_T)
+    return translation_error(cur_T, obs_T)
 
 #Calculate the rotation and translation errors between two camera poses.
+#Also works on (N,4,4) stacks of poses, returning (N,) errors.
 def cal_campose_error(cur_pose_c2w,obs_pose_c2w):
-    rot_error=cal_rot_error(cur_pose_c2w[:3,:3],obs_pose_c2w[:3,:3])
-    translation_error = cal_tran_error(cur_pose_c2w[:3,3],obs_pose_c2w[:3,3])
-    return rot_error,translation_error
-    
-def qvec2rotmat(qvec):
-    return np.array(
-        [
-            [
-                1 - 2 * qvec[2] ** 2 - 2 * qvec[3] ** 2,
-                2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-                2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2],
-            ],
-            [
-                2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-                1 - 2 * qvec[1] ** 2 - 2 * qvec[3] ** 2,
-                2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1],
-            ],
-            [
-                2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-                2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-                1 - 2 * qvec[1] ** 2 - 2 * qvec[2] ** 2,
-            ],
-        ]
-    )
-
-def rotmat2qvec(R):
-    Rxx, Ryx, Rzx, Rxy, Ryy, Rzy, Rxz, Ryz, Rzz = R.flat
-    K = (
-        np.array(
-            [  # type: ignore
-                [Rxx - Ryy - Rzz, 0, 0, 0],
-                [Ryx + Rxy, Ryy - Rxx - Rzz, 0, 0],
-                [Rzx + Rxz, Rzy + Ryz, Rzz - Rxx - Ryy, 0],
-                [Ryz - Rzy, Rzx - Rxz, Rxy - Ryx, Rxx + Ryy + Rzz],
-            ]
-        )
-        / 3.0
-    )
-    eigvals, eigvecs = np.linalg.eigh(K)
-    qvec = eigvecs[[3, 0, 1, 2], np.argmax(eigvals)]
-    if qvec[0] < 0:
-        qvec *= -1
-    return qvec
+    return pose_error(cur_pose_c2w, obs_pose_c2w)
 
 def getScale(depth_mast3r,depth_gs):
     depth_map1 = depth_mast3r
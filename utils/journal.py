@@ -0,0 +1,103 @@
+import json
+import os
+
+import numpy as np
+
+
+class ResultJournal:
+    """Append-only per-frame record of a refinement run.
+
+    Every processed query is written as one JSON line holding the refined w2c pose,
+    initial/refined errors, match/inlier counts and timings. Lines are flushed as they
+    are written and fsynced every `sync_every` records, so an interrupted run can be
+    resumed: frames already present in the journal are skipped and the summary
+    statistics are rebuilt from the file.
+    """
+
+    def __init__(self, path, sync_every=20, resume=True):
+        self.path = path
+        self.sync_every = sync_every
+        self.records = {}
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            os.remove(path)
+        self._file = open(path, 'a')
+        self._pending = 0
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            # drop the torn last line of a crashed run, that frame is simply redone
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].decode().splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.records[record['image']] = record
+
+    def __contains__(self, image):
+        return image in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, image, qvec, tvec, ini_error, refine_error, num_matches=None, num_inliers=None, timings=None):
+        record = {
+            'image': image,
+            'qvec': [float(v) for v in qvec],
+            'tvec': [float(v) for v in tvec],
+            'ini_error': [float(v) for v in ini_error],
+            'refine_error': [float(v) for v in refine_error],
+            'num_matches': None if num_matches is None else int(num_matches),
+            'num_inliers': None if num_inliers is None else int(num_inliers),
+            'timings': {k: float(v) for k, v in (timings or {}).items()},
+        }
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.records[image] = record
+        self._pending += 1
+        if self._pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def errors(self, images=None):
+        # (N, 2) arrays of [rot_error, translation_error], in the order of `images`
+        if images is None:
+            images = list(self.records)
+        records = [self.records[image] for image in images if image in self.records]
+        results_ini = np.array([r['ini_error'] for r in records]).reshape(-1, 2)
+        results_final = np.array([r['refine_error'] for r in records]).reshape(-1, 2)
+        return results_ini, results_final
+
+    def export_txt(self, path, images=None):
+        # legacy `name qw qx qy qz tx ty tz` file consumed by the evaluation tools
+        if images is None:
+            images = list(self.records)
+        with open(path, 'w') as f:
+            for image in images:
+                if image not in self.records:
+                    continue
+                record = self.records[image]
+                combined_list = [image] + record['qvec'] + record['tvec']
+                f.write(' '.join(map(str, combined_list)) + '\n')
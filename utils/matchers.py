@@ -0,0 +1,202 @@
+from itertools import islice
+
+import cv2
+import numpy as np
+import torch
+
+from mast3r.fast_nn import fast_reciprocal_NNs
+from mast3r.utils.coarse_to_fine import crop_slice, pos2d_in_rect, select_pairs_of_crops
+import mast3r.utils.path_to_dust3r  # noqa
+from dust3r.inference import inference
+from dust3r.model import AsymmetricCroCo3DStereo
+from dust3r.utils.geometry import find_reciprocal_matches, xy_grid
+from dust3r.utils.image import load_images
+
+from utils.refine import inside_border, scale_matches
+
+MATCHERS = ('mast3r', 'dust3r', 'orb', 'sift')
+DUST3R_MODEL = 'naver/DUSt3R_ViTLarge_BaseDecoder_224_linear'
+
+
+class Matcher(object):
+    """
+    2D-2D matches between a rendering and a query image:
+    match(rendered_image, query_image, original_size) -> matches_im0 (rendering), matches_im1 (query), confidences,
+    with the matches as N x 2 int64 (x, y) pixels of the original_size (H, W) images and one confidence per match.
+    """
+    name = None
+
+    def match(self, rendered_image, query_image, original_size):
+        raise NotImplementedError
+
+
+class MASt3RMatcher(Matcher):
+    """Reciprocal nearest neighbours of the MASt3R descriptors at 512 (the GS-CPR matching of gs_cpr_*.py)."""
+    name = 'mast3r'
+
+    def __init__(self, model, device, precision='fp32', subsample=8):
+        self.model = model
+        self.device = device
+        self.precision = precision
+        self.subsample = subsample
+
+    def descriptor_matches(self, output, i=0):
+        """Matches of the i-th pair of an inference output, in pixels of its input images, and their confidences."""
+        pred1, pred2 = output['pred1'], output['pred2']
+        matches_im0, matches_im1 = fast_reciprocal_NNs(pred1['desc'][i].detach(), pred2['desc'][i].detach(),
+                                                       subsample_or_initxy1=self.subsample, device=self.device, dist='dot',
+                                                       block_size=2**13)
+        valid = inside_border(matches_im0, matches_im1, output['view1']['true_shape'][i], output['view2']['true_shape'][i])
+        matches_im0, matches_im1 = matches_im0[valid], matches_im1[valid]
+        conf1, conf2 = pred1['desc_conf'][i].float().numpy(), pred2['desc_conf'][i].float().numpy()
+        confidences = np.sqrt(conf1[matches_im0[:, 1], matches_im0[:, 0]] * conf2[matches_im1[:, 1], matches_im1[:, 0]])
+        return matches_im0, matches_im1, confidences
+
+    def match(self, rendered_image, query_image, original_size):
+        images = load_images([rendered_image, query_image], size=512, verbose=False)
+        output = inference([tuple(images)], self.model, self.device, batch_size=1, verbose=False, precision=self.precision)
+        matches_im0, matches_im1, confidences = self.descriptor_matches(output)
+        return scale_matches(matches_im0, original_size), scale_matches(matches_im1, original_size), confidences
+
+
+def load_full_resolution(image_path, original_size):
+    # RGB in [-1, 1] as load_images, but at original_size (H, W)
+    image = cv2.cvtColor(cv2.imread(image_path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    if image.shape[:2] != tuple(original_size):
+        image = cv2.resize(image, (original_size[1], original_size[0]), interpolation=cv2.INTER_AREA)
+    return image.astype(np.float32) / 127.5 - 1
+
+
+def crop_view(image, cell, idx):
+    crop = np.ascontiguousarray(image[crop_slice(cell)])
+    return dict(img=torch.from_numpy(crop).permute(2, 0, 1)[None], true_shape=np.int32([crop.shape[:2]]), idx=idx, instance=str(idx))
+
+
+class CoarseToFineMASt3RMatcher(MASt3RMatcher):
+    """
+    MASt3R matches at the resolution of the original images. The coarse matches of MASt3RMatcher at 512 select, with
+    the greedy selection of mast3r.utils.coarse_to_fine, up to max_crops pairs of full resolution crops of the size of
+    the coarse input. The crop pairs are matched in batches of crop_batch_size and their matches replace the coarse
+    ones of the parts of the rendering they cover. With pad_crop_batches (compiled models), the last batch is padded to
+    crop_batch_size so that every forward has the compiled batch size.
+    """
+    name = 'mast3r_c2f'
+
+    def __init__(self, model, device, precision='fp32', subsample=8, max_crops=8, crop_batch_size=4, pad_crop_batches=False):
+        super().__init__(model, device, precision=precision, subsample=subsample)
+        self.max_crops = max_crops
+        self.crop_batch_size = min(crop_batch_size, max_crops)
+        self.pad_crop_batches = pad_crop_batches
+
+    def match(self, rendered_image, query_image, original_size):
+        images = load_images([rendered_image, query_image], size=512, verbose=False)
+        output = inference([tuple(images)], self.model, self.device, batch_size=1, verbose=False, precision=self.precision)
+        coarse_im0, coarse_im1, coarse_confidences = self.descriptor_matches(output)
+        coarse_im0, coarse_im1 = scale_matches(coarse_im0, original_size), scale_matches(coarse_im1, original_size)
+
+        # crops of the coarse input size, ordered from the one covering most of the remaining matches
+        H, W = (int(v) for v in output['view1']['true_shape'][0])
+        image0, image1 = load_full_resolution(rendered_image, original_size), load_full_resolution(query_image, original_size)
+        crops = list(islice(select_pairs_of_crops(image0, image1, coarse_im0, coarse_im1, maxdim=max(H, W), overlap=.5,
+                                                  forced_resolution=(H, W)), self.max_crops))
+        if len(crops) == 0:
+            return coarse_im0, coarse_im1, coarse_confidences
+        pairs = [(crop_view(image0, cell0, 2 * i), crop_view(image1, cell1, 2 * i + 1)) for i, (cell0, cell1, _) in enumerate(crops)]
+        if self.pad_crop_batches:
+            # repeats of the last pair, their outputs are not read
+            pairs += pairs[-1:] * (-len(pairs) % self.crop_batch_size)
+        output = inference(pairs, self.model, self.device, batch_size=self.crop_batch_size, verbose=False, precision=self.precision)
+
+        matches_im0, matches_im1, confidences = [], [], []
+        for i, (cell0, cell1, _) in enumerate(crops):
+            crop_im0, crop_im1, crop_confidences = self.descriptor_matches(output, i)
+            matches_im0.append(crop_im0 + cell0[:2])
+            matches_im1.append(crop_im1 + cell1[:2])
+            confidences.append(crop_confidences)
+        uncovered = ~pos2d_in_rect(coarse_im0, np.stack([cell0 for cell0, _, _ in crops])[None].T).any(axis=0)
+        matches = np.concatenate([np.concatenate(matches_im0), np.concatenate(matches_im1)], axis=1)
+        matches = np.concatenate([matches, np.concatenate([coarse_im0, coarse_im1], axis=1)[uncovered]])
+        confidences = np.concatenate(confidences + [coarse_confidences[uncovered]])
+        # overlapping crops find some matches twice
+        matches, keep = np.unique(matches, axis=0, return_index=True)
+        return matches[:, :2].astype(np.int64), matches[:, 2:].astype(np.int64), confidences[keep]
+
+
+class DUSt3RMatcher(Matcher):
+    """
+    Reciprocal nearest neighbours of the DUSt3R 224 pointmaps, both expressed in the frame of the rendering, over the
+    pixels with a confidence above conf_thr. Much cheaper than MASt3R at 512, but at the 224 resolution.
+    """
+    name = 'dust3r'
+
+    def __init__(self, model, device, conf_thr=3.0):
+        self.model = model
+        self.device = device
+        self.conf_thr = conf_thr
+
+    def match(self, rendered_image, query_image, original_size):
+        images = load_images([rendered_image, query_image], size=224, verbose=False)
+        output = inference([tuple(images)], self.model, self.device, batch_size=1, verbose=False)
+        pts1, conf1 = output['pred1']['pts3d'][0].numpy(), output['pred1']['conf'][0].numpy()
+        pts2, conf2 = output['pred2']['pts3d_in_other_view'][0].numpy(), output['pred2']['conf'][0].numpy()
+        H, W = conf1.shape
+        xy = xy_grid(W, H)
+        valid1, valid2 = conf1 > self.conf_thr, conf2 > self.conf_thr
+        if valid1.sum() == 0 or valid2.sum() == 0:
+            return np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+        reciprocal_in_P2, nn2_in_P1, _ = find_reciprocal_matches(pts1[valid1], pts2[valid2])
+        matches_im1 = xy[valid2][reciprocal_in_P2]
+        matches_im0 = xy[valid1][nn2_in_P1][reciprocal_in_P2]
+        confidences = np.sqrt(conf1[valid1][nn2_in_P1][reciprocal_in_P2] * conf2[valid2][reciprocal_in_P2])
+        return scale_matches(matches_im0, original_size, size=224), scale_matches(matches_im1, original_size, size=224), confidences
+
+
+class OpenCVMatcher(Matcher):
+    """
+    ORB or SIFT keypoints of the grayscale images at original_size, brute force 2-nearest neighbours and Lowe's ratio
+    test. The confidence of a match is 1 - ratio of its two nearest distances.
+    """
+
+    def __init__(self, name='sift', max_features=8000, ratio=0.8):
+        self.name = name
+        self.ratio = ratio
+        if name == 'orb':
+            self.detector, norm = cv2.ORB_create(nfeatures=max_features), cv2.NORM_HAMMING
+        else:
+            self.detector, norm = cv2.SIFT_create(nfeatures=max_features), cv2.NORM_L2
+        self.matcher = cv2.BFMatcher(norm)
+
+    def features(self, image_path, original_size):
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if image.shape != tuple(original_size):
+            image = cv2.resize(image, (original_size[1], original_size[0]), interpolation=cv2.INTER_AREA)
+        return self.detector.detectAndCompute(image, None)
+
+    def match(self, rendered_image, query_image, original_size):
+        keypoints0, descriptors0 = self.features(rendered_image, original_size)
+        keypoints1, descriptors1 = self.features(query_image, original_size)
+        if descriptors0 is None or descriptors1 is None or len(keypoints0) < 2 or len(keypoints1) < 2:
+            return np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+        knn = [pair for pair in self.matcher.knnMatch(descriptors0, descriptors1, k=2)
+               if len(pair) == 2 and pair[0].distance < self.ratio * pair[1].distance]
+        matches_im0 = np.int64([keypoints0[best.queryIdx].pt for best, _ in knn]).reshape(-1, 2)
+        matches_im1 = np.int64([keypoints1[best.trainIdx].pt for best, _ in knn]).reshape(-1, 2)
+        confidences = np.float64([1 - best.distance / max(second.distance, 1e-6) for best, second in knn])
+        return matches_im0, matches_im1, confidences
+
+
+def load_matcher(name, device, model=None, precision='fp32', max_crops=0, crop_batch_size=4, pad_crop_batches=False):
+    """
+    Matcher backend by name (MATCHERS), `model` is the loaded MASt3R model of the mast3r backend. With max_crops > 0,
+    the mast3r backend matches coarse to fine with up to max_crops crop pairs per image pair.
+    """
+    if name == 'mast3r' and max_crops > 0:
+        return CoarseToFineMASt3RMatcher(model, device, precision=precision, max_crops=max_crops, crop_batch_size=crop_batch_size,
+                                         pad_crop_batches=pad_crop_batches)
+    if name == 'mast3r':
+        return MASt3RMatcher(model, device, precision=precision)
+    if name == 'dust3r':
+        return DUSt3RMatcher(AsymmetricCroCo3DStereo.from_pretrained(DUST3R_MODEL).to(device).eval(), device)
+    if name in ('orb', 'sift'):
+        return OpenCVMatcher(name)
+    raise ValueError(f'Unknown matcher {name}, expected one of {MATCHERS}')
@@ -0,0 +1,146 @@
+"""
+Batched pose helpers shared by the renderer, the refinement scripts and the evaluation.
+ACT_Scaffold_GS/utils/pose_utils.py is a copy for the scene tree, keep both files in sync.
+
+Every function accepts NumPy arrays or torch tensors with arbitrary leading batch
+dimensions, i.e. (..., 4) quaternions [qw, qx, qy, qz], (..., 3, 3) rotations and
+(..., 4, 4) homogeneous poses, and returns the same array type. A single pose is
+simply the case of an empty batch shape.
+"""
+import math
+
+import numpy as np
+import torch
+
+
+def _is_torch(x):
+    return isinstance(x, torch.Tensor)
+
+
+def _stack(xs, axis, like):
+    return torch.stack(xs, dim=axis) if _is_torch(like) else np.stack(xs, axis=axis)
+
+
+def _transpose(R):
+    return R.transpose(-1, -2) if _is_torch(R) else np.swapaxes(R, -1, -2)
+
+
+def _as_array(x):
+    return x if _is_torch(x) else np.asarray(x, dtype=np.float64)
+
+
+def load_pose_file(pose_file):
+    # `name qw qx qy qz tx ty tz [...]` per line -> names, (N,4) qvecs, (N,3) tvecs
+    names = []
+    values = []
+    with open(pose_file) as f:
+        for line in f:
+            data = line.split()
+            if len(data) < 8:
+                continue
+            names.append(data[0])
+            values.append([float(v) for v in data[1:8]])
+    values = np.array(values).reshape(-1, 7)
+    return names, values[:, :4], values[:, 4:]
+
+
+def qvec2rotmat(qvec):
+    qvec = _as_array(qvec)
+    w, x, y, z = qvec[..., 0], qvec[..., 1], qvec[..., 2], qvec[..., 3]
+    R = _stack([
+        1 - 2 * y ** 2 - 2 * z ** 2, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y,
+        2 * x * y + 2 * w * z, 1 - 2 * x ** 2 - 2 * z ** 2, 2 * y * z - 2 * w * x,
+        2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x ** 2 - 2 * y ** 2,
+    ], -1, qvec)
+    return R.reshape(tuple(R.shape[:-1]) + (3, 3))
+
+
+def rotmat2qvec(R):
+    # same symmetric 4x4 eigenproblem as the COLMAP implementation, solved for the whole batch at once
+    R = _as_array(R)
+    # same (transposed) naming as `Rxx, Ryx, Rzx, Rxy, ... = R.flat` in the COLMAP code
+    Rxx, Ryx, Rzx = R[..., 0, 0], R[..., 0, 1], R[..., 0, 2]
+    Rxy, Ryy, Rzy = R[..., 1, 0], R[..., 1, 1], R[..., 1, 2]
+    Rxz, Ryz, Rzz = R[..., 2, 0], R[..., 2, 1], R[..., 2, 2]
+    zero = Rxx * 0
+    K = _stack([
+        Rxx - Ryy - Rzz, zero, zero, zero,
+        Ryx + Rxy, Ryy - Rxx - Rzz, zero, zero,
+        Rzx + Rxz, Rzy + Ryz, Rzz - Rxx - Ryy, zero,
+        Ryz - Rzy, Rzx - Rxz, Rxy - Ryx, Rxx + Ryy + Rzz,
+    ], -1, R)
+    K = K.reshape(tuple(K.shape[:-1]) + (4, 4)) / 3.0
+    if _is_torch(K):
+        # eigh only reads the lower triangle, like np.linalg.eigh
+        eigvals, eigvecs = torch.linalg.eigh(K)
+        best = eigvals.argmax(dim=-1)
+        qvec = torch.take_along_dim(eigvecs, best[..., None, None], dim=-1)[..., 0]
+        qvec = qvec[..., [3, 0, 1, 2]]
+        return torch.where(qvec[..., :1] < 0, -qvec, qvec)
+    eigvals, eigvecs = np.linalg.eigh(K)
+    best = eigvals.argmax(axis=-1)
+    qvec = np.take_along_axis(eigvecs, best[..., None, None], axis=-1)[..., 0]
+    qvec = qvec[..., [3, 0, 1, 2]]
+    return np.where(qvec[..., :1] < 0, -qvec, qvec)
+
+
+def make_pose(R, t):
+    R = _as_array(R)
+    t = _as_array(t)
+    if _is_torch(R):
+        pose = torch.zeros(tuple(R.shape[:-2]) + (4, 4), dtype=R.dtype, device=R.device)
+    else:
+        pose = np.zeros(R.shape[:-2] + (4, 4), dtype=R.dtype)
+    pose[..., :3, :3] = R
+    pose[..., :3, 3] = t
+    pose[..., 3, 3] = 1
+    return pose
+
+
+def qvec_tvec_to_pose(qvec, tvec):
+    return make_pose(qvec2rotmat(qvec), tvec)
+
+
+def pose_to_qvec_tvec(pose):
+    return rotmat2qvec(pose[..., :3, :3]), pose[..., :3, 3]
+
+
+def invert_pose(pose):
+    # closed form inverse of rigid transforms: [R^T, -R^T t]
+    R_inv = _transpose(pose[..., :3, :3])
+    t_inv = -(R_inv @ pose[..., :3, 3:])[..., 0]
+    return make_pose(R_inv, t_inv)
+
+
+def compose_poses(*poses):
+    # compose_poses(A, B, C) = A @ B @ C, broadcasting over the batch dimensions
+    result = poses[0]
+    for pose in poses[1:]:
+        result = result @ pose
+    return result
+
+
+def rotation_error(R_est, R_gt):
+    # geodesic angle in degrees; atan2 of sine and cosine stays accurate near 0 and 180 degrees, unlike arccos
+    R_err = R_est @ _transpose(R_gt)
+    cos = (R_err[..., 0, 0] + R_err[..., 1, 1] + R_err[..., 2, 2] - 1) / 2
+    axis = _stack([R_err[..., 2, 1] - R_err[..., 1, 2],
+                   R_err[..., 0, 2] - R_err[..., 2, 0],
+                   R_err[..., 1, 0] - R_err[..., 0, 1]], -1, R_err)
+    if _is_torch(R_err):
+        return torch.atan2(torch.linalg.norm(axis, dim=-1) / 2, cos) * (180 / math.pi)
+    return np.degrees(np.arctan2(np.linalg.norm(axis, axis=-1) / 2, cos))
+
+
+def translation_error(t_est, t_gt):
+    if _is_torch(t_est):
+        return torch.linalg.norm(t_est - t_gt, dim=-1)
+    return np.linalg.norm(np.asarray(t_est) - np.asarray(t_gt), axis=-1)
+
+
+def pose_error(pose_est, pose_gt):
+    # rotation (degrees) and translation errors between c2w poses
+    pose_est = _as_array(pose_est)
+    pose_gt = _as_array(pose_gt)
+    return (rotation_error(pose_est[..., :3, :3], pose_gt[..., :3, :3]),
+            translation_error(pose_est[..., :3, 3], pose_gt[..., :3, 3]))
@@ -0,0 +1,233 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from utils.evaluation import DATASETS, _frame_key, load_gt_c2w
+from utils.functions import getPredictPoses, getScale
+
+# query images and intrinsics, as read by gs_cpr_{7s,12s,cam}.py
+QUERIES = {
+    '7scenes': {
+        'query_path': './datasets/pgt_7scenes_{scene}/test/rgb/',
+        'extension': '.png',
+        'focal_length': {'chess': 526.22, 'fire': 526.903, 'heads': 527.745, 'office': 525.143, 'pumpkin': 525.647,
+                         'redkitchen': 525.505, 'stairs': 525.505},
+    },
+    '12scenes': {
+        'query_path': './datasets/pgt_12scenes_{scene}/test/rgb/',
+        'extension': '.jpg',
+        'focal_length': {'apt1_kitchen': 1167.8, 'apt1_living': 1172.29, 'apt2_bed': 1166.72, 'apt2_kitchen': 1169.57,
+                         'apt2_living': 1166.41, 'apt2_luke': 1160.96, 'office1_gates362': 1170.08,
+                         'office1_gates381': 1168.02, 'office1_lounge': 1165.19, 'office1_manolis': 1168.41,
+                         'office2_5a': 1139.32, 'office2_5b': 1161.54},
+    },
+    'cambridge': {
+        'query_path': './datasets/Cambridge_{scene}/test/rgb/',
+        'extension': '.png',
+        # full resolution images and per image focal lengths of the ACE preprocessing, scaled by 2.25
+        'raw_path': './datasets/Cambridge_{scene}/',
+        'calibration_path': './datasets/Cambridge_{scene}/test/calibration/',
+        'calibration_scale': 2.25,
+    },
+}
+# renderings and depth maps at the coarse poses, written by ACT_Scaffold_GS/render_pred_*.py
+RENDERED_PATH = './ACT_Scaffold_GS/data/{dataset}/scene_{scene}/test/evaluate_{pe}/train_output/render_single_view/'
+# (H, W) of the query images, the matches are scaled to it
+ORIGINAL_SIZE = {'7scenes': (480, 640), '12scenes': (968, 1296), 'cambridge': (1080, 1920)}
+# PnP inlier threshold in pixels
+REPROJECTION_ERROR = {'7scenes': 1.0, '12scenes': 1.0, 'cambridge': 2.5}
+# GS-CPR_rel: minimum MASt3R confidence of the points, as the masks of dust3r's PairViewer
+RELATIVE_CONF_THR = 3.0
+# ACT_Scaffold_GS/render_pred_*.py --depth_format packed: one PackedDepthStore per render directory
+PACKED_DEPTH_NAME = 'depth'
+_packed_depths = {}
+
+
+def load_queries(dataset, scene, pose_estimator):
+    """(name, image path, coarse w2c, fx, gt c2w) of every test image of a scene."""
+    config = QUERIES[dataset]
+    query_path = config['query_path'].format(scene=scene)
+    coarse = {_frame_key(name): pose for name, pose in
+              getPredictPoses(DATASETS[dataset]['coarse_path'].format(pe=pose_estimator, scene=scene)).items()}
+    names = sorted(f for f in os.listdir(query_path) if f.endswith(config['extension']))
+    gt_c2w = load_gt_c2w(names, DATASETS[dataset]['gt_path'].format(scene=scene), DATASETS[dataset]['gt_suffix'])
+    queries = []
+    for name, gt in zip(names, gt_c2w):
+        if 'raw_path' in config:
+            image_path = config['raw_path'].format(scene=scene) + name.replace('_frame', '/frame')
+            fx = float(np.loadtxt(config['calibration_path'].format(scene=scene) + name.replace('.png', '.txt'))) * config['calibration_scale']
+        else:
+            image_path = query_path + name
+            fx = config['focal_length'][scene]
+        queries.append((name, image_path, coarse[_frame_key(name)], fx, gt))
+    return queries
+
+
+def rendered_paths(dataset, scene, pose_estimator, name):
+    """Rendered image and depth map of a query name of load_queries, with the sequence separators the renderers use."""
+    rendered_path = RENDERED_PATH.format(dataset=dataset, scene=scene, pe=pose_estimator)
+    for candidate in (name, name.replace('-frame', '/frame'), name.replace('_frame', '/frame')):
+        if os.path.exists(rendered_path + candidate):
+            break
+    extension = os.path.splitext(candidate)[1]
+    return rendered_path + candidate, rendered_path + candidate[:-len(extension)] + '.npy'
+
+
+def _packed_depth_store(render_path):
+    """
+    Memory map and index of the PackedDepthStore of a render directory (`depth.bin` + `depth.json`, the format of
+    ACT_Scaffold_GS/utils/render_io.py), opened once. The index is keyed by the rendered image names, it is returned
+    keyed by the `.npy` names the refinement scripts ask for.
+    """
+    if render_path not in _packed_depths:
+        path = os.path.join(render_path, PACKED_DEPTH_NAME)
+        with open(path + '.json') as f:
+            index = json.load(f)
+        data = np.memmap(path + '.bin', dtype=np.uint8, mode='r') if index else None
+        _packed_depths[render_path] = (data, {os.path.splitext(name)[0] + '.npy': entry for name, entry in index.items()})
+    return _packed_depths[render_path]
+
+
+def load_depth(depth_path):
+    """
+    Rendered depth map of a `.npy` path of ACT_Scaffold_GS/render_pred_*.py. Render sets written with
+    --depth_format packed have no `.npy` files, the map is then read from the PackedDepthStore of the render directory
+    (the closest parent directory holding one).
+    """
+    if os.path.isfile(depth_path):
+        return np.load(depth_path)
+    render_path = os.path.dirname(os.path.abspath(depth_path))
+    while not os.path.isfile(os.path.join(render_path, PACKED_DEPTH_NAME + '.json')):
+        if os.path.dirname(render_path) == render_path:
+            raise FileNotFoundError(f'no depth map {depth_path} and no packed depth store in its parent directories')
+        render_path = os.path.dirname(render_path)
+    data, index = _packed_depth_store(render_path)
+    name = os.path.relpath(os.path.abspath(depth_path), render_path).replace(os.sep, '/')
+    if name not in index:
+        raise FileNotFoundError(f'no depth map {name} in the packed depth store of {render_path}')
+    entry = index[name]
+    return np.frombuffer(data, dtype=np.dtype(entry['dtype']), count=int(np.prod(entry['shape'])),
+                         offset=entry['offset']).reshape(entry['shape'])
+
+
+# input_geometry ... solve_pose are copied in ACT_Scaffold_GS/utils/refine.py for the refinement server, keep both in sync
+def input_geometry(original_size, size=512):
+    """
+    Scale and (x, y) crop offset of load_images(size) for images of original_size (H, W), such that an input pixel
+    maps to (pixel + offset) * scale. size=512 resizes the long side to 512 and crops to multiples of 16 (12Scenes:
+    968x1296 -> 382x512 -> 368x512, square images to 4:3), size=224 resizes the short side to 224 and crops the center
+    square.
+    """
+    H, W = original_size
+    long_edge = round(size * max(W / H, H / W)) if size == 224 else size
+    cx, cy = (int(round(x * long_edge / max(W, H))) // 2 for x in (W, H))
+    if size == 224:
+        offset = (cx - min(cx, cy), cy - min(cx, cy))
+    else:
+        halfw, halfh = ((2 * cx) // 16) * 8, ((2 * cy) // 16) * 8
+        if W == H:
+            halfh = 3 * halfw / 4
+        offset = (cx - halfw, cy - halfh)
+    return max(W, H) / long_edge, np.array(offset)
+
+
+def inside_border(matches_im0, matches_im1, shape0, shape1, border=3):
+    """Matches farther than `border` pixels from the edges of both MASt3R inputs (true shapes H, W)."""
+    H0, W0 = int(shape0[0]), int(shape0[1])
+    H1, W1 = int(shape1[0]), int(shape1[1])
+    return ((matches_im0[:, 0] >= border) & (matches_im0[:, 0] < W0 - border) & (matches_im0[:, 1] >= border) & (matches_im0[:, 1] < H0 - border) &
+            (matches_im1[:, 0] >= border) & (matches_im1[:, 0] < W1 - border) & (matches_im1[:, 1] >= border) & (matches_im1[:, 1] < H1 - border))
+
+
+def scale_matches(matches, original_size, size=512):
+    """Input pixels of load_images(size) to original_size pixels, truncated like the in-place scaling of gs_cpr_*.py."""
+    scale, offset = input_geometry(original_size, size)
+    return ((matches + offset) * scale).astype(np.int64)
+
+
+def filter_and_scale_matches(matches_im0, matches_im1, shape0, shape1, original_size, border=3):
+    """
+    Drop the matches within `border` pixels of the edges of the MASt3R inputs (true shapes H, W) and scale them to
+    `original_size` (H, W), undoing the crop of load_images.
+    """
+    valid = inside_border(matches_im0, matches_im1, shape0, shape1, border)
+    return scale_matches(matches_im0[valid], original_size), scale_matches(matches_im1[valid], original_size)
+
+
+def solve_pose(matches_im0, matches_im1, depth_map, K, c2w_ini, reprojection_error):
+    """
+    Refined c2w and number of inliers: the matched rendering pixels are lifted to scene coordinates with the rendered
+    depth and the coarse pose, then PnP RANSAC is run against the query pixels, as in gs_cpr_*.py.
+    """
+    if matches_im1.shape[0] < 4:
+        return c2w_ini, 0
+    fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
+    depth = depth_map[matches_im0[:, 1], matches_im0[:, 0]]
+    points_camera = np.stack([(matches_im0[:, 0] - cx) / fx * depth, (matches_im0[:, 1] - cy) / fy * depth, depth], axis=1)
+    points_world = points_camera @ c2w_ini[:3, :3].T + c2w_ini[:3, 3]
+    initial_rvec, _ = cv2.Rodrigues(c2w_ini[:3, :3].astype(np.float32))
+    success, rvec, tvec, inliers = cv2.solvePnPRansac(points_world.astype(np.float32), matches_im1.astype(np.float32), K,
+                                                      np.zeros(4, dtype=np.float32), rvec=initial_rvec,
+                                                      tvec=c2w_ini[:3, 3].astype(np.float32), useExtrinsicGuess=True,
+                                                      reprojectionError=reprojection_error, iterationsCount=2000,
+                                                      flags=cv2.SOLVEPNP_EPNP)
+    if not success:
+        return c2w_ini, 0
+    R, _ = cv2.Rodrigues(rvec)
+    c2w_refine = np.eye(4)
+    c2w_refine[:3, :3] = R.T
+    c2w_refine[:3, 3] = (-R.T @ tvec).reshape(3)
+    return c2w_refine, 0 if inliers is None else len(inliers)
+
+
+def intrinsics(fx, original_size):
+    return np.array([[fx, 0, original_size[1] / 2], [0, fx, original_size[0] / 2], [0, 0, 1]])
+
+
+def subsampled_pixels(output, view, subsample=8, conf_thr=RELATIVE_CONF_THR):
+    """(x, y) of every `subsample`-th input pixel of a view ('1' or '2') of a single pair, with a confidence above conf_thr."""
+    H, W = (int(v) for v in output[f'view{view}']['true_shape'][0])
+    y, x = np.mgrid[subsample // 2:H:subsample, subsample // 2:W:subsample].reshape(2, -1)
+    valid = output[f'pred{view}']['conf'][0].float().numpy()[y, x] > conf_thr
+    return x[valid], y[valid]
+
+
+def solve_relative_pose(output, K, original_size, subsample=8, conf_thr=RELATIVE_CONF_THR, reprojection_error=5):
+    """
+    GS-CPR_rel pose of the query in the camera frame of the rendering, up to scale, from the single (rendering, query)
+    pair of `output`. PnP RANSAC between the subsampled confident query pixels and their MASt3R points in the frame of
+    the rendering, with the known query intrinsics K of original_size instead of the focal length estimated by
+    PairViewer. Returns the c2w (identity when PnP fails, as PairViewer) and the number of inliers.
+    """
+    x, y = subsampled_pixels(output, 2, subsample, conf_thr)
+    if len(x) < 4:
+        return np.eye(4), 0
+    # K of the MASt3R input: original = (input + offset) * scale
+    scale, offset = input_geometry(original_size)
+    K_input = np.asarray(K, dtype=np.float32).copy()
+    K_input[:2] /= scale
+    K_input[:2, 2] -= offset
+    pts3d = output['pred2']['pts3d_in_other_view'][0].float().numpy()[y, x]
+    success, rvec, tvec, inliers = cv2.solvePnPRansac(pts3d, np.stack([x, y], axis=1).astype(np.float32), K_input, None,
+                                                      iterationsCount=100, reprojectionError=reprojection_error,
+                                                      flags=cv2.SOLVEPNP_SQPNP)
+    if not success:
+        return np.eye(4), 0
+    R, _ = cv2.Rodrigues(rvec)
+    c2w = np.eye(4)
+    c2w[:3, :3] = R.T
+    c2w[:3, 3] = (-R.T @ tvec).reshape(3)
+    return c2w, 0 if inliers is None else len(inliers)
+
+
+def relative_scale(output, depth_map, original_size, subsample=8, conf_thr=RELATIVE_CONF_THR):
+    """
+    getScale of the rendered depth_map (original_size) to the MASt3R depth of the rendering, on the pixel grid of
+    solve_relative_pose (confident pixels of the rendering) instead of the whole resized depth map.
+    """
+    x, y = subsampled_pixels(output, 1, subsample, conf_thr)
+    depth_mast3r = output['pred1']['pts3d'][0, ..., 2].float().numpy()[y, x]
+    pixels = scale_matches(np.stack([x, y], axis=1), original_size)
+    return getScale(depth_mast3r, depth_map[pixels[:, 1], pixels[:, 0]])
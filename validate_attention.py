@@ -0,0 +1,122 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+import mast3r.utils.path_to_dust3r
+import dust3r.utils.path_to_croco
+from models import blocks
+from models.blocks import ATTENTION_BACKENDS, Block, DecoderBlock, set_attention_backend
+from models.pos_embed import RoPE2D
+
+# token grids of the MASt3R inputs (patch size 16): 512x384 (7Scenes, 12Scenes) and 512x288 (Cambridge)
+GRIDS = {'512x384': (24, 32), '512x288': (18, 32)}
+
+
+def grid_positions(batch_size, grid, device):
+    y, x = torch.meshgrid(torch.arange(grid[0], device=device), torch.arange(grid[1], device=device), indexing='ij')
+    return torch.stack([y.flatten(), x.flatten()], dim=-1)[None].expand(batch_size, -1, -1).contiguous()
+
+
+def run(fn, device, repeats):
+    # output, mean time and peak memory (cuda only) of fn()
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    t_start = time.time()
+    for _ in range(repeats):
+        out = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = (time.time() - t_start) / repeats
+    peak = torch.cuda.max_memory_allocated() - base if device.type == 'cuda' else 0
+    return out, elapsed, peak
+
+
+def compare_blocks(grid_name, backends, args, device):
+    """Encoder block (ViT-L width) and decoder block (self + cross attention) of every backend against 'math'."""
+    grid = GRIDS[grid_name]
+    torch.manual_seed(0)
+    rope = RoPE2D(freq=100.0)
+    encoder = Block(1024, 16, qkv_bias=True, rope=rope).to(device).eval()
+    decoder = DecoderBlock(768, 12, qkv_bias=True, rope=rope).to(device).eval()
+    pos = grid_positions(args.batch_size, grid, device)
+    n = grid[0] * grid[1]
+    x_enc = torch.randn(args.batch_size, n, 1024, device=device)
+    x_dec, y_dec = torch.randn(2, args.batch_size, n, 768, device=device).unbind(0)
+
+    rows = []
+    reference = {}
+    for backend in ['math'] + [b for b in backends if b != 'math']:
+        set_attention_backend(backend)
+        with torch.no_grad():
+            enc, enc_time, enc_peak = run(lambda: encoder(x_enc, pos), device, args.repeats)
+            dec, dec_time, dec_peak = run(lambda: decoder(x_dec, y_dec, pos, pos)[0], device, args.repeats)
+        if backend == 'math':
+            reference = {'encoder': enc, 'decoder': dec}
+        rows.append({'grid': grid_name, 'backend': backend, 'resolved': blocks.get_attention_backend(),
+                     'encoder_max_error': float((enc - reference['encoder']).abs().max()),
+                     'decoder_max_error': float((dec - reference['decoder']).abs().max()),
+                     'encoder_ms': enc_time * 1000, 'decoder_ms': dec_time * 1000,
+                     'encoder_peak_mb': enc_peak / 1024 ** 2, 'decoder_peak_mb': dec_peak / 1024 ** 2})
+    return rows
+
+
+def compare_model(model_name, image_paths, backends, device):
+    """Descriptors and match counts of the full MASt3R pair model on one image pair."""
+    from mast3r.model import AsymmetricMASt3R
+    from mast3r.fast_nn import fast_reciprocal_NNs
+    from dust3r.inference import inference
+    from dust3r.utils.image import load_images
+
+    model = AsymmetricMASt3R.from_pretrained(model_name).to(device).eval()
+    images = load_images(image_paths, size=512, verbose=False)
+    rows = []
+    reference = None
+    for backend in ['math'] + [b for b in backends if b != 'math']:
+        set_attention_backend(backend)
+        output = inference([tuple(images)], model, device, batch_size=1, verbose=False)
+        desc1, desc2 = output['pred1']['desc'].squeeze(0), output['pred2']['desc'].squeeze(0)
+        matches_im0, _ = fast_reciprocal_NNs(desc1, desc2, subsample_or_initxy1=8, device=device, dist='dot', block_size=2 ** 13)
+        if reference is None:
+            reference = (desc1, desc2, matches_im0)
+        same = len({tuple(m) for m in matches_im0} & {tuple(m) for m in reference[2]})
+        rows.append({'backend': backend, 'desc_max_error': float(max((desc1 - reference[0]).abs().max(), (desc2 - reference[1]).abs().max())),
+                     'matches': len(matches_im0), 'same_matches': same / max(len(reference[2]), 1)})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Numerical parity and cost of the CroCo attention backends against the reference 'math' path")
+    parser.add_argument("--backends", nargs='+', default=['sdpa', 'chunked'], choices=ATTENTION_BACKENDS)
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument("--batch_size", default=1, type=int, help='pairs per forward (the decoder sees one image of each)')
+    parser.add_argument("--repeats", default=5, type=int)
+    parser.add_argument("--tolerance", default=1e-4, type=float, help='max abs error of a block output to pass')
+    parser.add_argument("--model", default=None, type=str, help='also compare the full model, e.g. naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric')
+    parser.add_argument("--images", nargs=2, default=None, help='rendered and query image for --model')
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    report = {'blocks': [row for grid_name in GRIDS for row in compare_blocks(grid_name, args.backends, args, device)]}
+    print(f"{'grid':<8} {'backend':<8} {'enc.err':>9} {'dec.err':>9} {'enc(ms)':>8} {'dec(ms)':>8} {'enc(MB)':>8} {'dec(MB)':>8}")
+    for r in report['blocks']:
+        print(f"{r['grid']:<8} {r['backend']:<8} {r['encoder_max_error']:>9.2e} {r['decoder_max_error']:>9.2e} {r['encoder_ms']:>8.2f} "
+              f"{r['decoder_ms']:>8.2f} {r['encoder_peak_mb']:>8.1f} {r['decoder_peak_mb']:>8.1f}")
+    if args.model is not None:
+        report['model'] = compare_model(args.model, args.images, args.backends, device)
+        for r in report['model']:
+            print(f"model {r['backend']:<8} desc max error {r['desc_max_error']:.2e}, {r['matches']} matches, "
+                  f"{100 * r['same_matches']:.1f}% identical to math")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = [r for r in report['blocks'] if max(r['encoder_max_error'], r['decoder_max_error']) > args.tolerance]
+    if failed:
+        raise SystemExit(f"{len(failed)} block comparisons above the tolerance {args.tolerance}")
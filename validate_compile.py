@@ -0,0 +1,73 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from mast3r.model import AsymmetricMASt3R
+from mast3r.compiled import COMPILE_CACHE_DIR, CompiledMASt3R
+import mast3r.utils.path_to_dust3r
+from dust3r.inference import inference
+
+# (H, W) of load_images(size=512): 7Scenes, 12Scenes and Cambridge
+IMAGE_SIZES = {'512x384': (384, 512), '512x368': (368, 512), '512x288': (288, 512)}
+
+
+def synthetic_pairs(num_pairs, height, width, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    def view(idx):
+        return dict(img=torch.rand(1, 3, height, width, generator=generator) * 2 - 1, true_shape=np.int32([[height, width]]),
+                    idx=idx, instance=str(idx))
+    return [(view(2 * i), view(2 * i + 1)) for i in range(num_pairs)]
+
+
+def time_inference(model, pairs, device, batch_size, precision):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize()
+    t_start = time.time()
+    output = inference(pairs, model, device, batch_size=batch_size, verbose=False, precision=precision)
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - t_start) / len(pairs), output
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Speed and parity of the compiled MASt3R forward (CompiledMASt3R) against the eager model")
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str)
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument("--sizes", nargs='+', default=list(IMAGE_SIZES), choices=list(IMAGE_SIZES))
+    parser.add_argument("--batch_sizes", nargs='+', default=[1], type=int, help='pairs per forward, batch 1 uses the CUDA graph on GPU')
+    parser.add_argument("--precision", default='fp32', choices=['fp32', 'bf16', 'fp16'])
+    parser.add_argument("--num_pairs", default=8, type=int, help='pairs timed per size and batch size')
+    parser.add_argument("--cache_dir", default=COMPILE_CACHE_DIR, type=str)
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+
+    model = AsymmetricMASt3R.from_pretrained(args.model).to(args.device).eval()
+    compiled = CompiledMASt3R(model, cache_dir=args.cache_dir)
+    rows = []
+    for size_name in args.sizes:
+        H, W = IMAGE_SIZES[size_name]
+        for batch_size in args.batch_sizes:
+            pairs = synthetic_pairs(args.num_pairs, H, W)
+            inference(pairs[:batch_size], model, args.device, batch_size=batch_size, verbose=False, precision=args.precision)
+            eager_time, eager = time_inference(model, pairs, args.device, batch_size, args.precision)
+            # first run of this shape: compilation, or loading the artifacts cached by a previous run
+            t_start = time.time()
+            compiled.warmup([(H, W)], batch_size=batch_size, precision=args.precision)
+            warmup_time = time.time() - t_start
+            compiled_time, output = time_inference(compiled, pairs, args.device, batch_size, args.precision)
+            errors = {f'{pred}.{key}': float((output[pred][key].float() - eager[pred][key].float()).abs().max())
+                      for pred in ('pred1', 'pred2') for key in ('desc', 'conf') if key in output[pred]}
+            rows.append({'size': size_name, 'batch_size': batch_size, 'compiled': compiled.enabled, 'warmup_s': warmup_time,
+                         'eager_ms': eager_time * 1000, 'compiled_ms': compiled_time * 1000,
+                         'speedup': eager_time / compiled_time, 'max_abs_diff': errors})
+
+    print(f"{'size':<8} {'batch':>5} {'warmup(s)':>9} {'eager(ms)':>10} {'compiled(ms)':>12} {'speedup':>7} {'max.err':>9}")
+    for r in rows:
+        print(f"{r['size']:<8} {r['batch_size']:>5} {r['warmup_s']:>9.1f} {r['eager_ms']:>10.1f} {r['compiled_ms']:>12.1f} "
+              f"{r['speedup']:>7.2f} {max(r['max_abs_diff'].values()):>9.2e}" + ('' if r['compiled'] else '  (eager fallback)'))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,87 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from mast3r.model import AsymmetricMASt3R
+
+from utils.evaluation import evaluate
+from utils.matchers import MATCHERS, load_matcher
+from utils.pose_utils import invert_pose, pose_error
+from utils.refine import ORIGINAL_SIZE, QUERIES, REPROJECTION_ERROR, intrinsics, load_depth, solve_pose
+from validate_precision import load_subset
+
+
+def refine_with_matcher(matcher, subset, dataset, device, reprojection_error):
+    """GS-CPR refinement of the subset with the matches of `matcher`: per query matches, inliers, pose and timings."""
+    results = []
+    for query in subset:
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize()
+        t_start = time.time()
+        matches_im0, matches_im1, _ = matcher.match(*query['paths'], ORIGINAL_SIZE[dataset])
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize()
+        t_match = time.time()
+        c2w_refine, num_inliers = solve_pose(matches_im0, matches_im1, load_depth(query['depth']), intrinsics(query['fx'], ORIGINAL_SIZE[dataset]),
+                                             invert_pose(np.asarray(query['w2c'], dtype=np.float64)), reprojection_error)
+        results.append({'c2w': c2w_refine, 'num_matches': int(matches_im1.shape[0]), 'num_inliers': num_inliers,
+                        'match': t_match - t_start, 'pnp': time.time() - t_match})
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Matches per second and pose accuracy of every matcher backend on a fixed subset of queries")
+    parser.add_argument("--dataset", default="7scenes", choices=list(QUERIES), type=str)
+    parser.add_argument("--scenes", nargs='+', default=['chess'])
+    parser.add_argument("--pose_estimator", default="ace", type=str)
+    parser.add_argument("--num_queries", default=50, type=int, help='per scene')
+    parser.add_argument("--stride", default=10, type=int, help='take every n-th test image')
+    parser.add_argument("--matchers", nargs='+', default=list(MATCHERS), choices=list(MATCHERS))
+    parser.add_argument("--max_crops", nargs='+', default=[], type=int, help='also run the coarse to fine mast3r matcher with each crop budget')
+    parser.add_argument("--crop_batch_size", default=4, type=int)
+    parser.add_argument("--reprojection_error", default=None, type=float, help='PnP RANSAC threshold, default is the one of the dataset')
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str, help='MASt3R of the mast3r backend')
+    parser.add_argument("--precision", default='fp32', choices=['fp32', 'bf16', 'fp16'], help='MASt3R of the mast3r backend')
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+
+    subset = load_subset(args.dataset, args.scenes, args.pose_estimator, args.num_queries, args.stride)
+    gt_c2w = np.stack([q['gt_c2w'] for q in subset])
+    initial = evaluate(*pose_error(invert_pose(np.stack([q['w2c'] for q in subset])), gt_c2w))
+
+    reprojection_error = args.reprojection_error or REPROJECTION_ERROR[args.dataset]
+
+    # (run name, matcher, crop budget)
+    runs = [(name, name, 0) for name in args.matchers] + [(f'c2f x{n}', 'mast3r', n) for n in args.max_crops]
+    model = None
+    if any(name == 'mast3r' for _, name, _ in runs):
+        model = AsymmetricMASt3R.from_pretrained(args.model).to(args.device).eval()
+    report = {'queries': len(subset), 'initial': initial, 'runs': {}}
+    for run, name, max_crops in runs:
+        matcher = load_matcher(name, args.device, model=model, precision=args.precision, max_crops=max_crops,
+                               crop_batch_size=args.crop_batch_size)
+        # first pair outside of the timings: cudnn autotuning, lazy allocations
+        matcher.match(*subset[0]['paths'], ORIGINAL_SIZE[args.dataset])
+        results = refine_with_matcher(matcher, subset, args.dataset, args.device, reprojection_error)
+        stats = evaluate(*pose_error(np.stack([r['c2w'] for r in results]), gt_c2w))
+        match_time = float(np.sum([r['match'] for r in results]))
+        stats.update({'matches': float(np.mean([r['num_matches'] for r in results])),
+                      'inliers': float(np.mean([r['num_inliers'] for r in results])),
+                      'pairs_per_s': len(results) / match_time,
+                      'matches_per_s': float(np.sum([r['num_matches'] for r in results])) / match_time,
+                      'pnp_ms': 1000 * float(np.mean([r['pnp'] for r in results]))})
+        report['runs'][run] = stats
+        del matcher
+
+    print(f"{len(subset)} queries, initial median {initial['median_trans'] * 100:.1f}cm / {initial['median_rot']:.2f}deg")
+    print(f"{'matcher':<10} {'matches':>8} {'inliers':>8} {'pairs/s':>8} {'matches/s':>10} {'pnp(ms)':>8} {'median':>14}")
+    for name, r in report['runs'].items():
+        print(f"{name:<10} {r['matches']:>8.0f} {r['inliers']:>8.0f} {r['pairs_per_s']:>8.2f} {r['matches_per_s']:>10.0f} {r['pnp_ms']:>8.1f} "
+              f"{r['median_trans'] * 100:>7.1f}cm/{r['median_rot']:.2f}")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,123 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from mast3r.model import AsymmetricMASt3R
+from mast3r.fast_nn import fast_reciprocal_NNs
+import mast3r.utils.path_to_dust3r
+from dust3r.inference import PRECISIONS, inference
+from dust3r.utils.image import load_images
+
+from utils.evaluation import evaluate
+from utils.pose_utils import invert_pose, pose_error
+from utils.refine import (ORIGINAL_SIZE, QUERIES, REPROJECTION_ERROR, filter_and_scale_matches, intrinsics, load_queries,
+                          load_depth, rendered_paths, solve_pose)
+
+
+def load_subset(dataset, scenes, pose_estimator, num_queries, stride):
+    """Fixed subset of queries: every `stride`-th test image of each scene, at most `num_queries` per scene."""
+    subset = []
+    for scene in scenes:
+        for name, image_path, w2c, fx, gt_c2w in load_queries(dataset, scene, pose_estimator)[::stride][:num_queries]:
+            rendered_image, rendered_depth = rendered_paths(dataset, scene, pose_estimator, name)
+            subset.append({'scene': scene, 'name': name, 'paths': (rendered_image, image_path), 'images': load_images([rendered_image, image_path], size=512, verbose=False),
+                           'depth': rendered_depth, 'w2c': w2c, 'fx': fx, 'gt_c2w': gt_c2w})
+    return subset
+
+
+def refine_subset(model, subset, dataset, device, **inference_kw):
+    """GS-CPR refinement of the subset with `model`, as gs_cpr_*.py: per query matches, inliers, pose and timings."""
+    results = []
+    for query in subset:
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize()
+        t_start = time.time()
+        output = inference([tuple(query['images'])], model, device, batch_size=1, verbose=False, **inference_kw)
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize()
+        t_forward = time.time()
+        desc1, desc2 = output['pred1']['desc'].squeeze(0), output['pred2']['desc'].squeeze(0)
+        matches_im0, matches_im1 = fast_reciprocal_NNs(desc1, desc2, subsample_or_initxy1=8, device=device, dist='dot', block_size=2**13)
+        matches_im0, matches_im1 = filter_and_scale_matches(matches_im0, matches_im1, output['view1']['true_shape'][0],
+                                                            output['view2']['true_shape'][0], ORIGINAL_SIZE[dataset])
+        t_match = time.time()
+        c2w_refine, num_inliers = solve_pose(matches_im0, matches_im1, load_depth(query['depth']), intrinsics(query['fx'], ORIGINAL_SIZE[dataset]),
+                                             invert_pose(np.asarray(query['w2c'], dtype=np.float64)), REPROJECTION_ERROR[dataset])
+        results.append({'scene': query['scene'], 'name': query['name'], 'c2w': c2w_refine, 'num_matches': int(matches_im1.shape[0]),
+                        'num_inliers': num_inliers, 'forward': t_forward - t_start, 'match': t_match - t_forward,
+                        'matches': np.concatenate([matches_im0, matches_im1], axis=1)})
+    return results
+
+
+def summarize(results, subset, reference=None):
+    gt_c2w = np.stack([q['gt_c2w'] for q in subset])
+    stats = evaluate(*pose_error(np.stack([r['c2w'] for r in results]), gt_c2w))
+    stats.update({'matches': float(np.mean([r['num_matches'] for r in results])),
+                  'inliers': float(np.mean([r['num_inliers'] for r in results])),
+                  'forward_ms': 1000 * float(np.mean([r['forward'] for r in results])),
+                  'match_ms': 1000 * float(np.mean([r['match'] for r in results]))})
+    if reference is not None:
+        # per query, relative to the reference run
+        stats['matches_ratio'] = float(np.mean([r['num_matches'] / max(ref['num_matches'], 1) for r, ref in zip(results, reference)]))
+        stats['same_matches'] = float(np.mean([len({tuple(m) for m in r['matches']} & {tuple(m) for m in ref['matches']}) / max(ref['num_matches'], 1)
+                                               for r, ref in zip(results, reference)]))
+        rot, trans = pose_error(np.stack([r['c2w'] for r in results]), np.stack([ref['c2w'] for ref in reference]))
+        stats['pose_diff_median_cm'] = float(np.median(trans) * 100)
+        stats['pose_diff_median_deg'] = float(np.median(rot))
+    return stats
+
+
+def peak_activation_memory(model, subset, device, precision):
+    # peak CUDA memory of one forward above the weights, 0 on CPU
+    if torch.device(device).type != 'cuda':
+        return 0
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base = torch.cuda.memory_allocated()
+    inference([tuple(subset[0]['images'])], model, device, batch_size=1, verbose=False, precision=precision)
+    return torch.cuda.max_memory_allocated() - base
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Match counts, pose accuracy and latency of MASt3R in reduced precision on a fixed subset of queries")
+    parser.add_argument("--dataset", default="7scenes", choices=list(QUERIES), type=str)
+    parser.add_argument("--scenes", nargs='+', default=['chess'])
+    parser.add_argument("--pose_estimator", default="ace", type=str)
+    parser.add_argument("--num_queries", default=50, type=int, help='per scene')
+    parser.add_argument("--stride", default=10, type=int, help='take every n-th test image')
+    parser.add_argument("--precisions", nargs='+', default=['bf16', 'fp16'], choices=list(PRECISIONS))
+    parser.add_argument("--head_precision", nargs='+', default=['fp32'], choices=['fp32', 'amp'], help='per head (one value for both)')
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str)
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+
+    model = AsymmetricMASt3R.from_pretrained(args.model).to(args.device).eval()
+    subset = load_subset(args.dataset, args.scenes, args.pose_estimator, args.num_queries, args.stride)
+    initial = evaluate(*pose_error(invert_pose(np.stack([q['w2c'] for q in subset])), np.stack([q['gt_c2w'] for q in subset])))
+
+    report = {'queries': len(subset), 'initial': initial, 'runs': {}}
+    reference = refine_subset(model, subset, args.dataset, args.device, precision='fp32')
+    report['runs']['fp32'] = summarize(reference, subset)
+    report['runs']['fp32']['peak_mb'] = peak_activation_memory(model, subset, args.device, 'fp32') / 1024 ** 2
+    for precision in args.precisions:
+        if precision == 'fp32' or (precision == 'fp16' and torch.device(args.device).type != 'cuda'):
+            continue
+        model.head_precision = tuple(args.head_precision * 2)[:2]
+        results = refine_subset(model, subset, args.dataset, args.device, precision=precision)
+        report['runs'][precision] = summarize(results, subset, reference)
+        report['runs'][precision]['peak_mb'] = peak_activation_memory(model, subset, args.device, precision) / 1024 ** 2
+        model.head_precision = ('fp32', 'fp32')
+
+    print(f"{len(subset)} queries, initial median {initial['median_trans'] * 100:.1f}cm / {initial['median_rot']:.2f}deg")
+    print(f"{'precision':<10} {'matches':>8} {'ratio':>6} {'inliers':>8} {'median':>14} {'diff to fp32':>14} {'fwd(ms)':>8} {'peak(MB)':>9}")
+    for precision, r in report['runs'].items():
+        diff = f"{r['pose_diff_median_cm']:.2f}cm/{r['pose_diff_median_deg']:.3f}" if 'matches_ratio' in r else '-'
+        print(f"{precision:<10} {r['matches']:>8.0f} {r.get('matches_ratio', 1.0):>6.3f} {r['inliers']:>8.0f} "
+              f"{r['median_trans'] * 100:>7.1f}cm/{r['median_rot']:.2f} {diff:>14} {r['forward_ms']:>8.1f} {r['peak_mb']:>9.0f}")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
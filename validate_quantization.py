@@ -0,0 +1,85 @@
+import copy
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from mast3r.model import AsymmetricMASt3R
+from mast3r.quantization import quantizable_layers, quantize_int8
+import mast3r.utils.path_to_dust3r
+from dust3r.inference import inference
+
+from quantize_mast3r import model_bytes
+from utils.pose_utils import invert_pose, pose_error
+from utils.evaluation import evaluate
+from utils.refine import QUERIES
+from validate_precision import load_subset, refine_subset, summarize
+
+
+def synthetic_pairs(num_pairs, height=384, width=512, seed=0):
+    # MASt3R inputs of the 7Scenes size (load_images(size=512) of 640x480 images), the content does not change the cost
+    generator = torch.Generator().manual_seed(seed)
+    def view(idx):
+        return dict(img=torch.rand(1, 3, height, width, generator=generator) * 2 - 1, true_shape=np.int32([[height, width]]),
+                    idx=idx, instance=str(idx))
+    return [(view(2 * i), view(2 * i + 1)) for i in range(num_pairs)]
+
+
+def pairs_per_second(model, pairs, batch_size):
+    inference(pairs[:batch_size], model, 'cpu', batch_size=batch_size, verbose=False)
+    t_start = time.time()
+    inference(pairs, model, 'cpu', batch_size=batch_size, verbose=False)
+    return len(pairs) / (time.time() - t_start)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Speed and match quality of the int8 MASt3R (quantize_mast3r.py) against float32 on the CPU")
+    parser.add_argument("--model", default="naver/MASt3R_ViTLarge_BaseDecoder_512_catmlpdpt_metric", type=str)
+    parser.add_argument("--quantized", default=None, type=str, help='output of quantize_mast3r.py, default is to quantize --model here')
+    parser.add_argument("--threads", default=None, type=int, help='torch CPU threads, default is the torch default')
+    parser.add_argument("--num_pairs", default=8, type=int, help='pairs timed per model')
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--dataset", default="7scenes", choices=list(QUERIES), type=str)
+    parser.add_argument("--scenes", nargs='+', default=['chess'], help='queries for the match comparison, empty to skip it')
+    parser.add_argument("--pose_estimator", default="ace", type=str)
+    parser.add_argument("--num_queries", default=20, type=int, help='per scene')
+    parser.add_argument("--stride", default=25, type=int)
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    fp32 = AsymmetricMASt3R.from_pretrained(args.model).cpu().eval()
+    if args.quantized is not None:
+        int8 = AsymmetricMASt3R.from_pretrained(args.quantized).eval()
+    else:
+        int8 = quantize_int8(copy.deepcopy(fp32), quantizable_layers(fp32))
+
+    pairs = synthetic_pairs(args.num_pairs)
+    report = {'threads': torch.get_num_threads(), 'batch_size': args.batch_size,
+              'fp32': {'weights_mb': model_bytes(fp32) / 1024 ** 2, 'pairs_per_second': pairs_per_second(fp32, pairs, args.batch_size)},
+              'int8': {'weights_mb': model_bytes(int8) / 1024 ** 2, 'pairs_per_second': pairs_per_second(int8, pairs, args.batch_size)}}
+    report['speedup'] = report['int8']['pairs_per_second'] / report['fp32']['pairs_per_second']
+    print(f"{report['threads']} threads, batch {args.batch_size}: float32 {report['fp32']['pairs_per_second']:.3f} pairs/s "
+          f"({report['fp32']['weights_mb']:.0f} MB), int8 {report['int8']['pairs_per_second']:.3f} pairs/s "
+          f"({report['int8']['weights_mb']:.0f} MB), x{report['speedup']:.2f}")
+
+    if args.scenes:
+        subset = load_subset(args.dataset, args.scenes, args.pose_estimator, args.num_queries, args.stride)
+        report['initial'] = evaluate(*pose_error(invert_pose(np.stack([q['w2c'] for q in subset])), np.stack([q['gt_c2w'] for q in subset])))
+        reference = refine_subset(fp32, subset, args.dataset, 'cpu')
+        report['fp32'].update(summarize(reference, subset))
+        report['int8'].update(summarize(refine_subset(int8, subset, args.dataset, 'cpu'), subset, reference))
+        for name in ('fp32', 'int8'):
+            r = report[name]
+            extra = (f", {r['matches_ratio']:.3f} of the float32 matches, {100 * r['same_matches']:.1f}% identical, "
+                     f"pose diff {r['pose_diff_median_cm']:.2f}cm/{r['pose_diff_median_deg']:.3f}deg") if name == 'int8' else ''
+            print(f"{name}: {r['matches']:.0f} matches, {r['inliers']:.0f} inliers, median {r['median_trans'] * 100:.1f}cm/"
+                  f"{r['median_rot']:.2f}deg{extra}")
+    if args.report is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
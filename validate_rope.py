@@ -0,0 +1,69 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import torch
+
+import mast3r.utils.path_to_dust3r
+import dust3r.utils.path_to_croco
+from models.pos_embed import FastRoPE2D, PyTorchRoPE2D
+from validate_attention import GRIDS, grid_positions
+
+
+def time_layers(rope, tokens, positions, num_layers, device, repeats):
+    # one forward of a model: every layer rotates q and k with the same positions tensor
+    def forward():
+        for _ in range(num_layers):
+            rope(tokens.clone(), positions)
+            rope(tokens.clone(), positions)
+    forward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    t_start = time.time()
+    for _ in range(repeats):
+        forward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - t_start) / repeats
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Parity and speed of FastRoPE2D against the reference pytorch RoPE2D")
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument("--dtypes", nargs='+', default=['float32', 'bfloat16'], choices=['float32', 'float16', 'bfloat16'])
+    parser.add_argument("--batch_size", default=2, type=int, help='images per forward, 2 for one pair')
+    parser.add_argument("--num_layers", default=48, type=int, help='attention layers per forward: 24 encoder, 12 decoder self + 12 cross')
+    parser.add_argument("--repeats", default=10, type=int)
+    parser.add_argument("--report", default=None, type=str)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    rows = []
+    for grid_name, grid in GRIDS.items():
+        positions = grid_positions(args.batch_size, grid, device)
+        for dtype_name in args.dtypes:
+            dtype = getattr(torch, dtype_name)
+            # ViT-L encoder: 16 heads of 64 channels
+            tokens = torch.randn(args.batch_size, 16, grid[0] * grid[1], 64, device=device).to(dtype)
+            reference, fast = PyTorchRoPE2D(freq=100.0), FastRoPE2D(freq=100.0)
+            with torch.no_grad():
+                # errors against the reference in float32, the reference itself builds its angles in the token dtype
+                exact = reference(tokens.float(), positions)
+                reference_error = float((reference(tokens.clone(), positions).float() - exact).abs().max())
+                error = float((fast(tokens.clone(), positions).float() - exact).abs().max())
+                reference_time = time_layers(reference, tokens, positions, args.num_layers, device, args.repeats)
+                fast_time = time_layers(fast, tokens, positions, args.num_layers, device, args.repeats)
+            # the out-of-place path used when the tokens require a gradient
+            grad_tokens = tokens.float().requires_grad_()
+            grad_error = float((fast(grad_tokens, positions) - exact).abs().max())
+            rows.append({'grid': grid_name, 'dtype': dtype_name, 'max_error': error, 'reference_max_error': reference_error,
+                         'grad_path_max_error': grad_error, 'reference_ms': reference_time * 1000,
+                         'fast_ms': fast_time * 1000, 'speedup': reference_time / fast_time})
+
+    print(f"{'grid':<8} {'dtype':<9} {'ref.err':>9} {'fast.err':>9} {'grad.err':>9} {'ref(ms)':>8} {'fast(ms)':>8} {'speedup':>7}")
+    for r in rows:
+        print(f"{r['grid']:<8} {r['dtype']:<9} {r['reference_max_error']:>9.2e} {r['max_error']:>9.2e} {r['grad_path_max_error']:>9.2e} "
+              f"{r['reference_ms']:>8.2f} {r['fast_ms']:>8.2f} {r['speedup']:>7.2f}")
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(rows, f, indent=2)